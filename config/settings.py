@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework_simplejwt',
     'drf_spectacular',
+    'django_filters',
     'core'
 ]
 
@@ -48,6 +50,8 @@ INSTALLED_APPS = [
 CORS_ALLOW_ALL_ORIGINS = True
 
 MIDDLEWARE = [
+    'core.instrumentation.PerformanceMiddleware',
+    'core.profiling.SlowRequestProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -88,6 +92,17 @@ DATABASES = {
     }
 }
 
+# aliases holding user-owned data, one user per shard (core/sharding.py); empty means
+# everything lives on 'default'. DJANGO_SHARDS=N adds N local SQLite shards for testing;
+# migrate each with `manage.py migrate --database <alias>`
+DATABASE_SHARDS = [f'shard_{n}' for n in range(int(os.environ.get('DJANGO_SHARDS', '0')))]
+for _alias in DATABASE_SHARDS:
+    DATABASES[_alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{_alias}.sqlite3',
+    }
+DATABASE_ROUTERS = ['core.sharding.ShardRouter'] if DATABASE_SHARDS else []
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -140,12 +155,121 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_FILTER_BACKENDS': (
+        'django_filters.rest_framework.DjangoFilterBackend',
+        'core.filters.StableOrderingFilter',
+    ),
+    # lists come in pages of `limit` rows from `offset` when either is given, see core/pagination.py
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.UncountedLimitOffsetPagination',
+    'PAGE_SIZE': 100,
+    # for core.throttling.SyncCostThrottle the rate is cost units per period, not requests
+    'DEFAULT_THROTTLE_RATES': {
+        'sync': '5000/hour',
+    },
 }
 
+# largest `limit` a list request may ask for
+API_MAX_PAGE_SIZE = 500
+
 
 SPECTACULAR_SETTINGS = {
     'TITLE': 'API de Pets',
     'DESCRIPTION': 'Documentação da API para sincronização de pets',
     'VERSION': '1.0.0',
     'SERVE_INCLUDE_SCHEMA': False,
-}
\ No newline at end of file
+}
+
+# maximum number of sub-requests accepted by /api/batch
+BATCH_MAX_REQUESTS = 20
+
+# deletion tombstones older than this are purged by `manage.py purge_tombstones`;
+# clients that last synced before the window get a full download instead of a delta
+SYNC_TOMBSTONE_RETENTION_DAYS = 90
+
+# look-ahead window (days) for /api/vaccines/due and the nightly reminder job
+VACCINE_DUE_DEFAULT_DAYS = 30
+VACCINE_DUE_MAX_DAYS = 365
+
+# fraction of requests timed by core.instrumentation.PerformanceMiddleware
+PERF_METRICS_SAMPLE_RATE = 1.0 if DEBUG else 0.05
+# sampled requests get a Server-Timing header (database time, query counts) only for staff
+# users unless this is set
+PERF_SERVER_TIMING_PUBLIC = DEBUG
+
+# opt-in stack sampling + SQL log of slow sync requests, see core/profiling.py
+SLOW_REQUEST_PROFILING = {
+    'ENABLED': False,
+    'THRESHOLD_MS': 1000,
+    'PATHS': ['/api/sync/upload', '/api/sync/download'],
+    'SAMPLE_INTERVAL_MS': 5,
+    'DIRECTORY': BASE_DIR / 'profiles',
+    'MAX_PROFILES': 50,
+}
+
+# opt-in group commit: concurrent sync uploads/patches of at most MAX_ITEMS records
+# share one transaction, collected for up to WINDOW_MS or MAX_BATCH merges (core/groupcommit.py)
+SYNC_GROUP_COMMIT = {
+    'ENABLED': False,
+    'WINDOW_MS': 5,
+    'MAX_BATCH': 32,
+    'MAX_ITEMS': 20,
+}
+
+# cost units charged by core.throttling.SyncCostThrottle against the 'sync' rate
+SYNC_THROTTLE_COSTS = {
+    'FULL_DOWNLOAD': 50,
+    'DELTA_DOWNLOAD': 1,
+    'UPLOAD_ITEM': 1,
+    'RECONCILE': 1,
+    'EXPORT': 50,
+}
+
+# events and vaccines dated and last written before this many days move to the archive
+# tables (core/archive.py); must exceed SYNC_TOMBSTONE_RETENTION_DAYS
+ARCHIVE_HORIZON_DAYS = 730
+ARCHIVE_BATCH_SIZE = 1000
+
+# event types whose latest date is reported as the pet's last vet visit (core/stats.py)
+STATS_VET_VISIT_EVENT_TYPES = ['Consulta', 'Retorno', 'Cirurgia', 'Exame']
+
+# rows fetched per server-side cursor round trip by the streaming export (core/export.py)
+EXPORT_CHUNK_SIZE = 2000
+
+# rows validated and inserted per transaction by `manage.py import_history`
+IMPORT_BATCH_SIZE = 1000
+
+# upper bound on `buckets` listed by one /api/sync/reconcile request (of 256)
+SYNC_RECONCILE_MAX_BUCKETS = 32
+
+# gzip'd full-download bundles built by `manage.py build_sync_snapshots` for users with at
+# least MIN_RECORDS rows; served only while younger than MAX_AGE_HOURS (keep it well
+# inside the tombstone retention so the follow-up delta is possible). With
+# ACCEL_REDIRECT_PREFIX set, nginx serves DIRECTORY from that internal location.
+SYNC_SNAPSHOTS = {
+    'DIRECTORY': BASE_DIR / 'snapshots',
+    'MIN_RECORDS': 500,
+    'MAX_AGE_HOURS': 24,
+    'ACCEL_REDIRECT_PREFIX': None,
+}
+
+# rendered OpenAPI schemas, keyed by code version (see core/schema.py);
+# SCHEMA_CODE_VERSION can pin the version to a release tag / git SHA
+SCHEMA_CACHE_DIR = BASE_DIR / 'schema_cache'
+SCHEMA_CODE_VERSION = None
+
+# 'lean' (DJANGO_STARTUP_PROFILE=lean) boots API workers without the admin and defers
+# drf-spectacular's schema machinery until a schema is first generated, see core/docs.py
+STARTUP_PROFILE = os.environ.get('DJANGO_STARTUP_PROFILE', 'full')
+API_DOCS_DEFERRED = STARTUP_PROFILE == 'lean'
+if STARTUP_PROFILE == 'lean':
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in ('django.contrib.admin', 'django.contrib.messages')]
+    MIDDLEWARE = [name for name in MIDDLEWARE if name != 'django.contrib.messages.middleware.MessageMiddleware']
+    TEMPLATES[0]['OPTIONS']['context_processors'].remove('django.contrib.messages.context_processors.messages')
+
+# admin changelists count exactly up to this many rows and use the planner's estimate
+# beyond it (core/admin.py)
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# wall-clock budget for a lean worker boot, checked by `manage.py importtime --profile lean --check`;
+# timing depends on the machine, so the test suite only checks what boot loads
+WORKER_BOOT_BUDGET_MS = 1500
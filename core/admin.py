@@ -1,3 +1,120 @@
+"""Support admin for pets, events and vaccines, built for large tables.
+
+* Changelists never run an exact COUNT(*) over a whole table:
+  `EstimatedCountPaginator` counts exactly up to ADMIN_EXACT_COUNT_LIMIT rows
+  and past that asks the PostgreSQL planner for an estimate (other backends
+  report the cap). The "N total" link is off (`show_full_result_count`).
+* Rows are ordered by primary key only, the one index every table has and
+  that uuid7 ids keep in creation order. Sorting by other columns is
+  disabled, so each page is an index range scan rather than a sort of the table.
+* Related rows shown in the list or in `__str__` (pet name, owner) come in the
+  same query (`list_select_related`), and foreign keys use autocomplete
+  widgets instead of rendering every pet or user into a <select>.
+* Search only uses indexed equality: a UUID matches ids (`id_search_fields`)
+  and any other term matches `search_fields` exactly.
+
+The admin is not installed in the 'lean' startup profile. With
+DATABASE_SHARDS set these models are not registered at all: changelists
+would read 'default', where no pet lives, and join owners that are on
+another database than the rows.
+"""
+import json
+import uuid
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from .models import Animal, Event, Vaccine
+
+
+def estimated_count(queryset):
+    """The PostgreSQL planner's row estimate for `queryset`, or 0 on other backends."""
+    if connections[queryset.db].vendor != 'postgresql':
+        return 0
+    plan = json.loads(queryset.explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Exact counts up to ADMIN_EXACT_COUNT_LIMIT rows, estimates beyond."""
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        queryset = self.object_list.order_by()
+        # COUNT over a LIMITed subquery stops reading after limit + 1 rows
+        capped = queryset[:limit + 1].count()
+        if capped <= limit:
+            return capped
+        return max(capped, estimated_count(queryset))
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    ordering = ['-id']
+    sortable_by = ['id']
+    # equality lookups tried when the search term is a UUID
+    id_search_fields = ['id']
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        try:
+            value, fields = uuid.UUID(term), self.id_search_fields
+        except ValueError:
+            value, fields = term, self.search_fields
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{field: value})
+        # forward joins only, so no duplicate rows
+        return (queryset.filter(condition) if condition else queryset.none()), False
+
+
+class AnimalAdmin(LargeTableAdmin):
+    list_display = ['id', 'name', 'type', 'breed', 'user', 'updated_at']
+    list_select_related = ['user']
+    autocomplete_fields = ['user']
+    search_fields = ['name', 'user__username']
+    readonly_fields = ['content_hash', 'field_updated_at']
+
+
+class EventAdmin(LargeTableAdmin):
+    list_display = ['id', 'type', 'date', 'animal', 'owner', 'updated_at']
+    list_select_related = ['animal__user']
+    autocomplete_fields = ['animal']
+    id_search_fields = ['id', 'animal_id']
+    search_fields = ['animal__user__username']
+    readonly_fields = ['content_hash', 'field_updated_at']
+
+    @admin.display(description="Tutor")
+    def owner(self, obj):
+        return obj.animal.user
+
+
+class VaccineAdmin(LargeTableAdmin):
+    list_display = ['id', 'name', 'application_date', 'next_dose_date', 'animal', 'owner', 'updated_at']
+    list_select_related = ['animal__user']
+    autocomplete_fields = ['animal']
+    id_search_fields = ['id', 'animal_id']
+    search_fields = ['animal__user__username']
+    readonly_fields = ['content_hash', 'field_updated_at']
+
+    @admin.display(description="Tutor")
+    def owner(self, obj):
+        return obj.animal.user
+
+
+def register(site):
+    if settings.DATABASE_SHARDS:
+        return
+    site.register(Animal, AnimalAdmin)
+    site.register(Event, EventAdmin)
+    site.register(Vaccine, VaccineAdmin)
+
 
-# Register your models here.
+register(admin.site)
@@ -1,6 +1,75 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+
+
+def install_search_index(sender, using, **kwargs):
+    from .search import install_search_index
+    install_search_index(using)
+
+
+def track_sync_write(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        from .merkle import record_write
+        record_write(instance, created)
+
+
+def track_sync_delete(sender, instance, **kwargs):
+    from .merkle import record_delete
+    record_delete(instance)
+
+
+def purge_deleted_user(sender, instance, **kwargs):
+    from .sharding import purge_deleted_user
+    purge_deleted_user(sender, instance, **kwargs)
+
+
+def remember_animal_owner(sender, instance, **kwargs):
+    from .merkle import remember_owner
+    remember_owner(instance)
+
+
+def track_stats_write(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        from .stats import count_write
+        count_write(instance, created)
+
+
+def track_stats_delete(sender, instance, **kwargs):
+    from .stats import count_delete
+    count_delete(instance)
+
+
+def animal_stats_deleting(sender, instance, **kwargs):
+    from .stats import animal_deleting
+    animal_deleting(instance)
+
+
+def animal_stats_deleted(sender, instance, **kwargs):
+    from .stats import animal_deleting
+    animal_deleting(instance, done=True)
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        post_migrate.connect(install_search_index, sender=self)
+
+        from .models import Animal, ArchivedEvent, ArchivedVaccine, Event, Vaccine
+        for model in (Animal, Event, Vaccine, ArchivedEvent, ArchivedVaccine):
+            post_save.connect(track_sync_write, sender=model)
+            post_delete.connect(track_sync_delete, sender=model)
+        pre_delete.connect(remember_animal_owner, sender=Animal)
+        for model in (Event, Vaccine, ArchivedEvent, ArchivedVaccine):
+            post_save.connect(track_stats_write, sender=model)
+            post_delete.connect(track_stats_delete, sender=model)
+        pre_delete.connect(animal_stats_deleting, sender=Animal)
+        post_delete.connect(animal_stats_deleted, sender=Animal)
+        # registers its flush with core.merkle's write batches
+        from . import stats  # noqa: F401
+
+        if settings.DATABASE_SHARDS:
+            pre_delete.connect(purge_deleted_user, sender=get_user_model())
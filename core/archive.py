@@ -0,0 +1,104 @@
+"""Archival of old events and vaccines.
+
+Event and Vaccine only grow, while lists, sync downloads and their index scans
+mostly need recent history. `manage.py archive_history` moves rows whose date
+and last write are both older than ARCHIVE_HORIZON_DAYS into ArchivedEvent /
+ArchivedVaccine (same columns plus `archived_at`). It works in batches, one
+transaction each. Vaccines whose next dose is still ahead stay in place. The
+horizon is longer than the tombstone retention and the last write is older
+than it, so every client that syncs by delta already has these rows.
+
+Archived rows still belong to the user's data:
+
+* list endpoints and sync downloads include them when asked with
+  `include_archived`, and detail routes find them by id;
+* the reconciliation tree keeps their leaves. Moving a row XORs its leaf out
+  of one table and back in from the other, which cancels out;
+* an upload that writes an archived id first moves the row back (`restore`),
+  so last-writer-wins compares against what is stored.
+"""
+from datetime import timedelta
+from operator import attrgetter
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils.timezone import now
+from .merkle import batched, record_write
+from .models import ArchivedEvent, ArchivedVaccine, Event, Vaccine
+from .sharding import atomic
+from .stats import count_write
+
+ARCHIVES = {Event: ArchivedEvent, Vaccine: ArchivedVaccine}
+
+
+def archive_horizon(days=None):
+    return now() - timedelta(days=settings.ARCHIVE_HORIZON_DAYS if days is None else days)
+
+
+def archivable(model, horizon):
+    if model is Event:
+        return Q(date__lt=horizon.date(), updated_at__lt=horizon)
+    return (Q(application_date__lt=horizon.date(), updated_at__lt=horizon)
+            & (Q(next_dose_date__isnull=True) | Q(next_dose_date__lt=horizon.date())))
+
+
+def _move(rows, target):
+    """Re-create `rows` in `target`'s table and delete them from theirs; returns the copies."""
+    source = type(rows[0])
+    names = ({field.attname for field in target._meta.concrete_fields}
+             & {field.attname for field in source._meta.concrete_fields})
+    copies = [target(**{name: getattr(row, name) for name in names}) for row in rows]
+    with batched():
+        target.objects.bulk_create(copies)
+        for copy in copies:
+            record_write(copy, created=True)
+            count_write(copy, created=True)
+        source.objects.filter(pk__in=[row.pk for row in rows]).delete()
+    return copies
+
+
+def archive_batch(model, horizon, batch_size):
+    """Archive up to `batch_size` old rows of `model` on the active shard; returns how many."""
+    with atomic():
+        rows = list(model.objects.select_for_update(skip_locked=True)
+                    .filter(archivable(model, horizon)).order_by('pk')[:batch_size])
+        if rows:
+            _move(rows, ARCHIVES[model])
+    return len(rows)
+
+
+def restore(model, ids, **filters):
+    """Move archived rows with these ids (and `filters`) back to `model`'s table; returns the restored rows."""
+    if not ids:
+        return []
+    rows = list(ARCHIVES[model].objects.filter(id__in=ids, **filters))
+    if not rows:
+        return []
+    with atomic():
+        return _move(rows, model)
+
+
+def restore_missing(model, object_id, **filters):
+    """The archived row behind an id the hot table doesn't have, restored, or None.
+
+    The lookup can't be skipped by the incoming date: an upload may move an
+    archived record's date inside the horizon.
+    """
+    return next(iter(restore(model, [object_id], **filters)), None)
+
+
+def ordered(queryset, ordering):
+    """`queryset` in the order `order_rows` sorts to, NULLs last."""
+    return queryset.order_by(*(
+        F(field[1:]).desc(nulls_last=True) if field.startswith('-') else F(field).asc(nulls_last=True)
+        for field in ordering or []
+    ))
+
+
+def order_rows(rows, ordering):
+    """Sort model instances in place like `QuerySet.order_by(*ordering)` (NULLs last)."""
+    for field in reversed(ordering or []):
+        name = field.lstrip('-')
+        present = sorted((row for row in rows if getattr(row, name) is not None),
+                         key=attrgetter(name), reverse=field.startswith('-'))
+        rows[:] = present + [row for row in rows if getattr(row, name) is None]
+    return rows
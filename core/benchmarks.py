@@ -0,0 +1,176 @@
+"""Latency / query / memory benchmarks for the sync endpoints and viewset lists.
+
+Timings are taken in a clean pass; query counts and peak memory come from a
+separate, shorter pass under `CaptureQueriesContext` and `tracemalloc`, since
+both inflate wall time.
+"""
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import timedelta
+import django
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+from .models import uuid7
+from .synthetic import generate_dataset
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def upload_payload(user, bump):
+    """Re-upload every pet of `user` with newer timestamps and one new event each.
+
+    The new events make every iteration insert rows; the rest of the tree comes
+    back with the same content, so it exercises the skipped path alongside.
+    """
+    stamp = now() + timedelta(seconds=bump)
+    updated_at = stamp.isoformat()
+    pets = []
+    for animal in user.animals.prefetch_related('events', 'vaccines'):
+        pets.append({
+            'id': str(animal.id),
+            'name': animal.name,
+            'type': animal.type,
+            'breed': animal.breed,
+            'date_of_birth': animal.date_of_birth.isoformat(),
+            'updated_at': updated_at,
+            'events': [{
+                'id': str(event.id),
+                'type': event.type,
+                'date': event.date.isoformat(),
+                'observation': event.observation or '',
+                'updated_at': updated_at,
+            } for event in animal.events.all()] + [{
+                'id': str(uuid7()),
+                'type': 'Consulta',
+                'date': stamp.date().isoformat(),
+                'observation': f'Benchmark {bump}',
+                'updated_at': updated_at,
+            }],
+            'vaccines': [{
+                'id': str(vaccine.id),
+                'name': vaccine.name,
+                'application_date': vaccine.application_date.isoformat(),
+                **({'next_dose_date': vaccine.next_dose_date.isoformat()} if vaccine.next_dose_date else {}),
+                'updated_at': updated_at,
+            } for vaccine in animal.vaccines.all()],
+        })
+    return {'pets': pets}
+
+
+def scenarios():
+    """Map scenario name -> builder returning (method, url, body) for a user and iteration."""
+    delta_since = (now() - timedelta(days=7)).isoformat()
+    return {
+        'sync/check-update': lambda user, i: ('post', reverse('check_update'), {'last_synced_at': delta_since}),
+        'sync/download:full': lambda user, i: ('post', reverse('download'), {}),
+        'sync/download:delta': lambda user, i: ('post', reverse('download'), {'last_synced_at': delta_since}),
+        'sync/upload': lambda user, i: ('post', reverse('upload'), upload_payload(user, i + 1)),
+        'animals:list': lambda user, i: ('get', reverse('animal-list'), None),
+        'events:list': lambda user, i: ('get', reverse('event-list'), None),
+        'vaccines:list': lambda user, i: ('get', reverse('vaccine-list'), None),
+    }
+
+
+def send(client, user, spec):
+    method, url, body = spec
+    client.force_authenticate(user=user)
+    if method == 'get':
+        return client.get(url)
+    return getattr(client, method)(url, body, format='json')
+
+
+def measure(build, users, iterations, profile_iterations):
+    client = APIClient()
+    latencies, statuses = [], []
+    for i in range(iterations):
+        user = users[i % len(users)]
+        spec = build(user, i)
+        started = time.perf_counter()
+        response = send(client, user, spec)
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses.append(response.status_code)
+
+    queries, peaks = [], []
+    tracemalloc.start()
+    try:
+        for i in range(profile_iterations):
+            user = users[i % len(users)]
+            spec = build(user, iterations + i)
+            tracemalloc.reset_peak()
+            with CaptureQueriesContext(connection) as captured:
+                send(client, user, spec)
+            queries.append(len(captured))
+            peaks.append(tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'errors': sum(1 for code in statuses if code >= 400),
+        'latency_ms': {
+            'mean': statistics.fmean(latencies),
+            **{f'p{pct}': percentile(latencies, pct) for pct in PERCENTILES},
+            'max': max(latencies),
+        },
+        'queries': {'min': min(queries), 'max': max(queries)} if queries else None,
+        'peak_memory_bytes': max(peaks) if peaks else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def throttling_disabled():
+    """Measure raw capacity: repeated full downloads would otherwise hit SyncCostThrottle."""
+    return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}})
+
+
+def run_benchmarks(users=5, pets_per_user=3, events_per_pet=50, vaccines_per_pet=10,
+                   iterations=50, profile_iterations=5, seed=0, only=None):
+    """Generate the dataset in the current database and benchmark every scenario."""
+    dataset = {
+        'users': users,
+        'pets_per_user': pets_per_user,
+        'events_per_pet': events_per_pet,
+        'vaccines_per_pet': vaccines_per_pet,
+        'seed': seed,
+    }
+    # scenarios use windows relative to the clock (delta syncs), so the history ends now
+    generated = generate_dataset(users, pets_per_user, events_per_pet, vaccines_per_pet,
+                                 seed=seed, username_prefix='bench', epoch=now())
+    with throttling_disabled():
+        results = {
+            name: measure(build, generated, iterations, profile_iterations)
+            for name, build in scenarios().items()
+            if not only or name in only
+        }
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'dataset': dataset,
+        },
+        'results': results,
+    }
@@ -0,0 +1,57 @@
+"""API documentation hooks kept off the worker boot path.
+
+Workers rarely serve /schema/ or /swagger/, but drf-spectacular's generator and
+schema plumbing are imported as soon as a docs view is imported or an
+`extend_schema` annotation is applied (it resolves DEFAULT_SCHEMA_CLASS).
+
+* `lazy_view` registers a route whose view class is imported on first request.
+* `extend_schema` is a drop-in for drf-spectacular's. With API_DOCS_DEFERRED
+  (the 'lean' STARTUP_PROFILE) it only records the annotation, and
+  `apply_deferred` replays the annotations in declaration order right before
+  a schema is generated. Deferred view classes get `schema = None` meanwhile,
+  since DRF's router reads the class `schema` (importing DEFAULT_SCHEMA_CLASS)
+  while it collects extra actions.
+"""
+import inspect
+import threading
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
+from drf_spectacular.utils import extend_schema as _extend_schema, OpenApiExample, OpenApiTypes  # noqa: F401
+
+_pending = []
+_lock = threading.Lock()
+
+
+def extend_schema(**kwargs):
+    def decorator(f):
+        if not settings.API_DOCS_DEFERRED:
+            return _extend_schema(**kwargs)(f)
+        with _lock:
+            _pending.append((f, kwargs))
+        if inspect.isclass(f):
+            f.schema = None
+        return f
+    return decorator
+
+
+def apply_deferred():
+    """Apply recorded annotations. The URLconf must already be imported."""
+    # held while applying so a concurrent schema request can't see half of them
+    with _lock:
+        for f, kwargs in _pending:
+            _extend_schema(**kwargs)(f)
+        _pending.clear()
+
+
+def lazy_view(dotted_path, **initkwargs):
+    view = None
+
+    @csrf_exempt
+    def dispatch(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = import_string(dotted_path).as_view(**initkwargs)
+        return view(request, *args, **kwargs)
+
+    return dispatch
@@ -0,0 +1,118 @@
+"""Streaming full-history export.
+
+`export` answers with a ZIP that has one file per model (animals, events,
+vaccines, archived rows included), in CSV or NDJSON. The archive is built while it is sent: rows are
+read with `QuerySet.iterator()` (a server-side cursor on PostgreSQL) in
+EXPORT_CHUNK_SIZE batches, encoded and deflated into zipfile's streaming mode
+(sizes go in data descriptors, so nothing is seeked back) and handed to
+StreamingHttpResponse as they come out. Memory holds one batch plus the zip
+central directory whatever the size of the history, and the first bytes
+leave once the first batch is read.
+"""
+import csv
+import io
+import itertools
+import json
+import uuid
+import zipfile
+from datetime import date
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import Animal, ArchivedEvent, ArchivedVaccine, Event, Vaccine
+
+FORMATS = ('csv', 'ndjson')
+
+# (file name, models, owner lookup, exported columns); `animal` is the parent animal id
+EXPORTS = (
+    ('animals', (Animal,), 'user', ('id', 'name', 'type', 'breed', 'date_of_birth', 'updated_at')),
+    ('events', (Event, ArchivedEvent), 'animal__user',
+     ('id', 'animal', 'type', 'date', 'observation', 'updated_at')),
+    ('vaccines', (Vaccine, ArchivedVaccine), 'animal__user',
+     ('id', 'animal', 'name', 'application_date', 'next_dose_date', 'updated_at')),
+)
+
+_encoder = DjangoJSONEncoder()
+
+
+class _Sink:
+    """Write-only file for zipfile; `drain()` returns what was written since the last call."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _plain(value):
+    # same text the API renders for dates, datetimes and ids
+    return _encoder.default(value) if isinstance(value, (date, uuid.UUID)) else value
+
+
+def encode_csv(batches, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows([_plain(value) for value in row] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def encode_ndjson(batches, columns):
+    for batch in batches:
+        yield ''.join(
+            json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+            for row in batch
+        )
+
+
+ENCODERS = {'csv': encode_csv, 'ndjson': encode_ndjson}
+
+
+def export_chunks(user, data_format, using=None):
+    """Bytes of the user's export ZIP, produced incrementally.
+
+    The body runs after the view has returned, outside its shard scope, so the
+    view passes the database to read from.
+    """
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, models, owner, columns in EXPORTS:
+            rows = itertools.chain.from_iterable(
+                model.objects.using(using).filter(**{owner: user}).order_by('pk')
+                .values_list(*columns).iterator(chunk_size=chunk_size)
+                for model in models
+            )
+            # sizes are unknown up front, so always leave room for >4 GiB entries
+            with archive.open(f'{name}.{data_format}', 'w', force_zip64=True) as entry:
+                for text in ENCODERS[data_format](_batches(rows, chunk_size), columns):
+                    entry.write(text.encode())
+                    data = sink.drain()
+                    if data:
+                        yield data
+    yield sink.drain()
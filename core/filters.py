@@ -0,0 +1,62 @@
+import django_filters
+from rest_framework.filters import OrderingFilter
+from .models import Animal, Event, Vaccine
+
+
+class StrictFilterSet(django_filters.FilterSet):
+    """Reject query parameters that are not declared filters.
+
+    Every declared filter is backed by an index on `(user|animal, <field>)`, so
+    refusing anything else keeps list queries on indexed paths instead of
+    silently ignoring (or later accidentally honouring) arbitrary columns.
+    """
+    passthrough_params = {'ordering', 'format', 'include_archived', 'limit', 'offset'}
+
+    def is_valid(self):
+        valid = super().is_valid()
+        unknown = sorted(set(self.data) - set(self.filters) - self.passthrough_params)
+        if unknown:
+            self.form.add_error(None, f"Filtros não suportados: {', '.join(unknown)}")
+            return False
+        return valid
+
+
+class StableOrderingFilter(OrderingFilter):
+    """`?ordering=` with `id` appended, so rows that tie keep the same order from page to page."""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering is None or any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            return ordering
+        return [*ordering, 'id']
+
+
+class AnimalFilter(StrictFilterSet):
+    class Meta:
+        model = Animal
+        fields = {
+            'updated_at': ['gt'],
+        }
+
+
+class EventFilter(StrictFilterSet):
+    animal = django_filters.UUIDFilter(field_name='animal')
+
+    class Meta:
+        model = Event
+        fields = {
+            'type': ['exact'],
+            'date': ['gte', 'lte'],
+            'updated_at': ['gt'],
+        }
+
+
+class VaccineFilter(StrictFilterSet):
+    animal = django_filters.UUIDFilter(field_name='animal')
+
+    class Meta:
+        model = Vaccine
+        fields = {
+            'application_date': ['gte', 'lte'],
+            'updated_at': ['gt'],
+        }
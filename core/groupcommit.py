@@ -0,0 +1,114 @@
+"""Group commit for small concurrent sync merges.
+
+Bursts of tiny `sync/upload` and `sync/patch` requests (every device of a
+household after a push, say) each pay for their own transaction. On SQLite
+they also queue behind one write lock. With SYNC_GROUP_COMMIT enabled, merges of
+at most MAX_ITEMS records go through a WriteCoordinator instead:
+
+* the first request to arrive for a database becomes the group's leader and
+  waits up to WINDOW_MS for others (less once MAX_BATCH have joined);
+* the leader runs every merge of the group in one transaction, each in its own
+  savepoint, and commits once;
+* each request gets back its own result or exception. A merge that fails
+  rolls back only its savepoint. If the commit itself fails, every request
+  in the group gets that error.
+
+Groups form per process, among the threads of a threaded worker, so this pays
+off with `gthread`-style servers. Merges run on the leader's thread and
+connection, under the leader's shard scope, which is the group's database.
+Requests already inside a transaction (atomic batches) and larger merges keep
+their own transaction.
+"""
+import threading
+from django.conf import settings
+from django.db import transaction
+from .sharding import active_alias, atomic
+
+
+class _Job:
+    def __init__(self, work):
+        self.work = work
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _Group:
+    def __init__(self):
+        self.jobs = []
+        self.full = threading.Event()
+
+
+class WriteCoordinator:
+    """Coalesces concurrent `submit`s for the same database into one transaction."""
+
+    def __init__(self, window_ms=5, max_batch=32):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._open = {}  # alias -> group still accepting jobs
+
+    def submit(self, alias, work):
+        """Run `work()` in a transaction on `alias`, possibly shared; returns its result or raises its error."""
+        job = _Job(work)
+        with self._lock:
+            group = self._open.get(alias)
+            leader = group is None
+            if leader:
+                group = self._open[alias] = _Group()
+            group.jobs.append(job)
+            if len(group.jobs) >= self.max_batch:
+                # later arrivals start the next group
+                del self._open[alias]
+                group.full.set()
+        if leader:
+            self._lead(alias, group)
+        else:
+            job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _lead(self, alias, group):
+        group.full.wait(self.window)
+        with self._lock:
+            if self._open.get(alias) is group:
+                del self._open[alias]
+        try:
+            with transaction.atomic(using=alias):
+                for job in group.jobs:
+                    try:
+                        with transaction.atomic(using=alias):
+                            job.result = job.work()
+                    except Exception as exc:
+                        job.error = exc
+        except Exception as exc:
+            for job in group.jobs:
+                job.result, job.error = None, job.error or exc
+        finally:
+            for job in group.jobs:
+                job.done.set()
+
+
+_coordinator = None
+_coordinator_lock = threading.Lock()
+
+
+def coordinator():
+    global _coordinator
+    with _coordinator_lock:
+        if _coordinator is None:
+            config = settings.SYNC_GROUP_COMMIT
+            _coordinator = WriteCoordinator(config['WINDOW_MS'], config['MAX_BATCH'])
+        return _coordinator
+
+
+def run_merge(size, work):
+    """Run a sync merge of `size` records in a transaction on the active shard, grouped when enabled."""
+    alias = active_alias()
+    config = settings.SYNC_GROUP_COMMIT
+    if (not config['ENABLED'] or size > config['MAX_ITEMS']
+            or transaction.get_connection(alias).in_atomic_block):
+        with atomic():
+            return work()
+    return coordinator().submit(alias, work)
@@ -0,0 +1,217 @@
+"""Bulk loading of a user's history for `manage.py import_history`.
+
+The input is what `export` produces: `animals`, `events` and `vaccines` files
+in CSV or NDJSON, in a directory or a ZIP. Files are read row by row and
+every row is validated with the sync upload serializers (plus the parent
+`animal` column). Valid rows are inserted `batch_size` at a time, each batch
+in its own transaction, with `bulk_create` or, on PostgreSQL, `COPY ... FROM
+STDIN`. Rows whose id already exists, archived ones included, are skipped,
+not overwritten. Run it
+inside the user's shard scope (`core.sharding.user_shard`).
+
+After each committed batch the number of rows consumed per file goes to the
+checkpoint file, so an interrupted import can resume where it stopped.
+
+Inserted rows get `updated_at` = the time of their batch, so delta downloads
+and check-update report them like any other write. The `updated_at` from the
+file goes to `field_updated_at['*']`, where field merges read it: a device's
+edit made after the original write still wins. Model signals don't fire on
+these paths: the user's sync buckets and pet statistics are rebuilt once at
+the end, and their first-sync snapshot is dropped.
+"""
+import csv
+import io
+import json
+import os
+import time
+import zipfile
+from datetime import date
+from pathlib import Path
+from django.db import connections, router
+from django.utils.timezone import now
+from .merkle import rebuild_buckets
+from .archive import ARCHIVES
+from .models import Animal, Event, Vaccine
+from .serializers import AnimalUploadSerializer, EventImportSerializer, VaccineImportSerializer
+from .sharding import atomic
+from .snapshots import discard_snapshot
+from .stats import rebuild_stats
+
+# parents first, so events and vaccines can be checked against the user's animals
+SOURCES = (
+    ('animals', Animal, AnimalUploadSerializer),
+    ('events', Event, EventImportSerializer),
+    ('vaccines', Vaccine, VaccineImportSerializer),
+)
+FORMATS = ('csv', 'ndjson')
+METHODS = ('bulk', 'copy')
+
+
+def find_sources(source):
+    """(name, file name, format) of the import files present in a directory or ZIP."""
+    source = Path(source)
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            present = set(archive.namelist())
+    else:
+        present = set(os.listdir(source))
+    found = []
+    for name, _, _ in SOURCES:
+        for data_format in FORMATS:
+            if f'{name}.{data_format}' in present:
+                found.append((name, f'{name}.{data_format}', data_format))
+                break
+    return found
+
+
+def open_text(source, file_name):
+    source = Path(source)
+    if zipfile.is_zipfile(source):
+        # the member stays readable after the archive is closed
+        with zipfile.ZipFile(source) as archive:
+            return io.TextIOWrapper(archive.open(file_name), encoding='utf-8', newline='')
+    return open(source / file_name, encoding='utf-8', newline='')
+
+
+def read_rows(fp, data_format):
+    if data_format == 'csv':
+        # the export writes NULL as an empty cell
+        for row in csv.DictReader(fp):
+            yield {key: value if value != '' else None for key, value in row.items()}
+    else:
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _copy_value(value):
+    if value is None:
+        return r'\N'
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def copy_rows(model, objects):
+    """Insert `objects` with PostgreSQL COPY (psycopg 3 or psycopg2)."""
+    fields = model._meta.concrete_fields
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for obj in objects:
+        writer.writerow([_copy_value(getattr(obj, field.attname)) for field in fields])
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in fields)
+    sql = f"COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    with connection.cursor() as cursor:
+        raw = cursor.cursor
+        if hasattr(raw, 'copy'):
+            with raw.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+        else:
+            buffer.seek(0)
+            raw.copy_expert(sql, buffer)
+
+
+class Importer:
+    def __init__(self, user, batch_size=1000, method='bulk', checkpoint=None, resume=False,
+                 progress=None, reject=None):
+        self.user = user
+        self.batch_size = batch_size
+        self.method = method
+        self.checkpoint = Path(checkpoint) if checkpoint else None
+        self.done = {}
+        if resume and self.checkpoint and self.checkpoint.exists():
+            self.done = json.loads(self.checkpoint.read_text())['files']
+        # a resumed run also settles whatever the interrupted one had inserted
+        self.imported = sum(self.done.values())
+        self.progress = progress or (lambda stats: None)
+        self.reject = reject or (lambda file_name, number, errors: None)
+        self.animal_ids = set(Animal.objects.filter(user=user).values_list('id', flat=True))
+
+    def run(self, source):
+        """Import every file found in `source`; returns {file name: stats}."""
+        results = {}
+        try:
+            for name, file_name, data_format in find_sources(source):
+                with open_text(source, file_name) as fp:
+                    results[file_name] = self.import_file(name, file_name, read_rows(fp, data_format))
+        finally:
+            if self.imported:
+                rebuild_buckets(self.user.id)
+                rebuild_stats(Animal.objects.filter(user=self.user).values_list('id', flat=True))
+                discard_snapshot(self.user)
+        return results
+
+    def import_file(self, name, file_name, rows):
+        _, model, serializer_class = next(source for source in SOURCES if source[0] == name)
+        skip = self.done.get(file_name, 0)
+        stats = {'file': file_name, 'rows': skip, 'imported': 0, 'existing': 0, 'rejected': 0,
+                 'started': time.perf_counter()}
+        batch = []
+        consumed = skip
+        for consumed, row in enumerate(rows, start=1):
+            if consumed <= skip:
+                continue
+            serializer = serializer_class(data=row)
+            if not serializer.is_valid():
+                self.reject(file_name, consumed, serializer.errors)
+                stats['rejected'] += 1
+            elif model is not Animal and serializer.validated_data['animal'] not in self.animal_ids:
+                self.reject(file_name, consumed, {'animal': ["Animal não encontrado para este usuário."]})
+                stats['rejected'] += 1
+            else:
+                batch.append(self.build(model, serializer.validated_data))
+            if consumed - stats['rows'] >= self.batch_size:
+                self.write(model, batch, stats, consumed)
+                batch = []
+        if consumed > stats['rows']:
+            self.write(model, batch, stats, consumed)
+        return stats
+
+    def build(self, model, data):
+        data = {key: value for key, value in data.items() if key not in ('events', 'vaccines')}
+        if model is Animal:
+            obj = Animal(user=self.user, **data)
+        else:
+            obj = model(animal_id=data.pop('animal'), **data)
+        obj.content_hash = obj.compute_content_hash()
+        return obj
+
+    def write(self, model, objects, stats, rows):
+        with atomic():
+            ids = [obj.id for obj in objects]
+            existing = set(model.objects.filter(id__in=ids).values_list('id', flat=True))
+            if model in ARCHIVES:
+                existing.update(ARCHIVES[model].objects.filter(id__in=ids).values_list('id', flat=True))
+            new = {}
+            for obj in objects:
+                if obj.id not in existing:
+                    new.setdefault(obj.id, obj)
+            new = list(new.values())
+            stamp = now()
+            for obj in new:
+                obj.field_updated_at = {'*': obj.updated_at.isoformat()}
+                obj.updated_at = stamp
+            if self.method == 'copy':
+                copy_rows(model, new)
+            else:
+                model.objects.bulk_create(new)
+        if model is Animal:
+            self.animal_ids.update(obj.id for obj in new)
+        stats['rows'] = rows
+        stats['imported'] += len(new)
+        self.imported += len(new)
+        stats['existing'] += len(objects) - len(new)
+        self.save_checkpoint(stats['file'], rows)
+        self.progress(stats)
+
+    def save_checkpoint(self, file_name, rows):
+        if self.checkpoint is None:
+            return
+        self.done[file_name] = rows
+        tmp = self.checkpoint.with_name(f'{self.checkpoint.name}.tmp')
+        tmp.write_text(json.dumps({'user': self.user.get_username(), 'files': self.done}))
+        os.replace(tmp, self.checkpoint)
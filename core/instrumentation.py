@@ -0,0 +1,175 @@
+"""Per-request performance instrumentation.
+
+`PerformanceMiddleware` samples a fraction of requests
+(`PERF_METRICS_SAMPLE_RATE`). For a sampled request it records wall time,
+time spent in the database, query and duplicate-query counts, time spent in
+serializers and response size. It folds the numbers into an in-process,
+per-route aggregate served by `/api/metrics`, and for staff users (or
+everyone, with PERF_SERVER_TIMING_PUBLIC) adds a `Server-Timing` header.
+Unsampled requests only pay for one `random()` call.
+"""
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+
+# upper bounds (ms) of the wall-time histogram buckets; the last bucket is open
+HISTOGRAM_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.db_time = 0.0
+        self.queries = 0
+        self.statements = Counter()
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[(sql, None if many else repr(params))] += 1
+
+    @property
+    def duplicate_queries(self):
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+
+class TimedSerializerMixin:
+    """Adds this serializer's time to the current sampled request.
+
+    Only the outermost serializer is timed, so nested serializers are not
+    counted twice.
+    """
+
+    def to_representation(self, instance):
+        metrics = _current.get()
+        if metrics is None or metrics.serializer_depth:
+            return super().to_representation(instance)
+        metrics.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer_time += time.perf_counter() - started
+            metrics.serializer_depth -= 1
+
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.wall_ms = 0.0
+        self.db_ms = 0.0
+        self.serializer_ms = 0.0
+        self.queries = 0
+        self.duplicate_queries = 0
+        self.response_bytes = 0
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+
+    def add(self, wall_ms, metrics, response_bytes):
+        self.count += 1
+        self.wall_ms += wall_ms
+        self.db_ms += metrics.db_time * 1000
+        self.serializer_ms += metrics.serializer_time * 1000
+        self.queries += metrics.queries
+        self.duplicate_queries += metrics.duplicate_queries
+        self.response_bytes += response_bytes or 0
+        self.histogram[bisect_left(HISTOGRAM_BUCKETS_MS, wall_ms)] += 1
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'wall_ms': {'sum': self.wall_ms, 'mean': self.wall_ms / self.count},
+            'db_ms': {'sum': self.db_ms, 'mean': self.db_ms / self.count},
+            'serializer_ms': {'sum': self.serializer_ms, 'mean': self.serializer_ms / self.count},
+            'queries': {'sum': self.queries, 'mean': self.queries / self.count},
+            'duplicate_queries': self.duplicate_queries,
+            'response_bytes': {'sum': self.response_bytes, 'mean': self.response_bytes / self.count},
+            'histogram_ms': {
+                **{f'le_{bound}': bucket for bound, bucket in zip(HISTOGRAM_BUCKETS_MS, self.histogram)},
+                'le_inf': self.histogram[-1],
+            },
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, wall_ms, metrics, response_bytes):
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = RouteStats()
+            stats.add(wall_ms, metrics, response_bytes)
+
+    def snapshot(self):
+        with self._lock:
+            return {route: stats.as_dict() for route, stats in sorted(self._routes.items())}
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+registry = MetricsRegistry()
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    name = match.view_name if match else 'unresolved'
+    return f'{request.method} {name}'
+
+
+def shows_timing(request):
+    """Whether the response may carry `Server-Timing`: database time and query counts are internals."""
+    if settings.PERF_SERVER_TIMING_PUBLIC:
+        return True
+    # DRF sets the user it authenticated on the underlying request
+    user = getattr(request, 'user', None)
+    return bool(user is not None and user.is_staff)
+
+
+class PerformanceMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.PERF_METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        wall_ms = (time.perf_counter() - started) * 1000
+
+        response_bytes = None if response.streaming else len(response.content)
+        registry.record(route_name(request), wall_ms, metrics, response_bytes)
+        if not shows_timing(request):
+            return response
+        response['Server-Timing'] = ', '.join([
+            f'total;dur={wall_ms:.1f}',
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries, '
+            f'{metrics.duplicate_queries} duplicated"',
+            f'serializer;dur={metrics.serializer_time * 1000:.1f}',
+        ])
+        return response
@@ -0,0 +1,234 @@
+"""Synthetic traffic replay for capacity testing.
+
+Each virtual client logs in once (untimed) and then loops over a weighted mix
+of operations until the level's duration elapses. Levels run at increasing
+concurrency, and per-level throughput is compared to find the point where
+adding clients stops adding throughput.
+"""
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from datetime import timedelta
+from django.db import connections
+from django.test import Client
+from django.utils.timezone import now
+from .benchmarks import PERCENTILES, percentile
+
+DEFAULT_MIX = {
+    'check': 50,
+    'delta': 20,
+    'upload': 15,
+    'full': 5,
+    'refresh': 7,
+    'token': 3,
+}
+
+
+class InProcessTransport:
+    def __init__(self):
+        # report server errors as 500s instead of re-raising them in the worker
+        self.client = Client(raise_request_exception=False)
+
+    def post(self, path, body, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        response = self.client.post(path, json.dumps(body), content_type='application/json', **headers)
+        return response.status_code, response.json() if response.content else None
+
+    def close(self):
+        connections.close_all()
+
+
+class HTTPTransport:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def post(self, path, body, token=None):
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(body).encode(),
+            headers={
+                'Content-Type': 'application/json',
+                **({'Authorization': f'Bearer {token}'} if token else {}),
+            },
+            method='POST',
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return response.status, json.loads(response.read() or b'null')
+        except urllib.error.HTTPError as error:
+            return error.code, None
+
+    def close(self):
+        pass
+
+
+class VirtualClient:
+    def __init__(self, transport, username, password, rng):
+        self.transport = transport
+        self.username = username
+        self.password = password
+        self.rng = rng
+        self.access = None
+        self.refresh = None
+        self.pets = []
+
+    def login(self):
+        status, body = self.transport.post('/auth/token/', {'username': self.username, 'password': self.password})
+        if status != 200:
+            raise RuntimeError(f"login failed for {self.username}: HTTP {status}")
+        self.access, self.refresh = body['access'], body['refresh']
+        status, body = self.transport.post('/api/sync/download', {}, self.access)
+        self.pets = body['pets'] if status == 200 else []
+
+    def run(self, operation):
+        return getattr(self, f'op_{operation}')()
+
+    def op_token(self):
+        status, body = self.transport.post('/auth/token/', {'username': self.username, 'password': self.password})
+        if status == 200:
+            self.access, self.refresh = body['access'], body['refresh']
+        return status
+
+    def op_refresh(self):
+        status, body = self.transport.post('/auth/token/refresh/', {'refresh': self.refresh})
+        if status == 200:
+            self.access = body['access']
+            self.refresh = body.get('refresh', self.refresh)
+        return status
+
+    def op_check(self):
+        since = (now() - timedelta(minutes=5)).isoformat()
+        return self.transport.post('/api/sync/check-update', {'last_synced_at': since}, self.access)[0]
+
+    def op_delta(self):
+        since = (now() - timedelta(days=1)).isoformat()
+        return self.transport.post('/api/sync/download', {'last_synced_at': since}, self.access)[0]
+
+    def op_full(self):
+        return self.transport.post('/api/sync/download', {}, self.access)[0]
+
+    def op_upload(self):
+        """Upload one pet with a few edits; about a third carry stale timestamps (conflicts)."""
+        if not self.pets:
+            return self.op_check()
+        pet = dict(self.rng.choice(self.pets))
+        stale = self.rng.random() < 0.33
+        updated_at = (now() - timedelta(days=3650) if stale else now()).isoformat()
+        events = [dict(event, updated_at=updated_at) for event in pet.get('events', [])[:5]]
+        for event in events:
+            event.pop('animal', None)
+            event['observation'] = event.get('observation') or ''
+        vaccines = [dict(vaccine, updated_at=updated_at) for vaccine in pet.get('vaccines', [])[:3]]
+        for vaccine in vaccines:
+            vaccine.pop('animal', None)
+            if vaccine.get('next_dose_date') is None:
+                vaccine.pop('next_dose_date', None)
+        pet.update(updated_at=updated_at, events=events, vaccines=vaccines)
+        return self.transport.post('/api/sync/upload', {'pets': [pet]}, self.access)[0]
+
+
+def run_level(make_transport, accounts, concurrency, duration, mix, seed):
+    operations, weights = zip(*mix.items())
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    ready = threading.Barrier(concurrency + 1)
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        transport = make_transport()
+        local_samples, local_errors = defaultdict(list), defaultdict(int)
+        try:
+            username, password = accounts[index % len(accounts)]
+            client = VirtualClient(transport, username, password, rng)
+            try:
+                client.login()
+            except Exception:
+                ready.abort()
+                raise
+            ready.wait()
+            deadline = time.perf_counter() + duration
+            while time.perf_counter() < deadline:
+                operation = rng.choices(operations, weights)[0]
+                started = time.perf_counter()
+                try:
+                    status = client.run(operation)
+                except Exception:
+                    status = 599
+                local_samples[operation].append((time.perf_counter() - started) * 1000)
+                if status >= 400:
+                    local_errors[operation] += 1
+        finally:
+            transport.close()
+            with lock:
+                for operation, values in local_samples.items():
+                    samples[operation].extend(values)
+                for operation, count in local_errors.items():
+                    errors[operation] += count
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        for thread in threads:
+            thread.join()
+        raise RuntimeError("a virtual client failed to log in; see the thread traceback above")
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in samples.values())
+    return {
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'requests': total,
+        'throughput_rps': total / elapsed if elapsed else 0.0,
+        'error_rate': sum(errors.values()) / total if total else 0.0,
+        'endpoints': {
+            operation: {
+                'requests': len(values),
+                'throughput_rps': len(values) / elapsed if elapsed else 0.0,
+                'error_rate': errors[operation] / len(values),
+                'latency_ms': {f'p{pct}': percentile(values, pct) for pct in PERCENTILES},
+            }
+            for operation, values in sorted(samples.items())
+        },
+    }
+
+
+def saturation_point(levels, key=lambda level: level['throughput_rps'], min_gain=0.05):
+    """Lowest concurrency after which throughput grows by less than `min_gain`."""
+    for previous, current in zip(levels, levels[1:]):
+        if key(current) < key(previous) * (1 + min_gain):
+            return previous['concurrency']
+    return None
+
+
+def run_load_test(make_transport, accounts, concurrency_levels, duration, mix=None, seed=0):
+    mix = {name: weight for name, weight in (mix or DEFAULT_MIX).items() if weight > 0}
+    levels = [
+        run_level(make_transport, accounts, concurrency, duration, mix, seed)
+        for concurrency in concurrency_levels
+    ]
+    per_endpoint = {}
+    for operation in mix:
+        measured = [level for level in levels if operation in level['endpoints']]
+        per_endpoint[operation] = saturation_point(
+            measured, key=lambda level, op=operation: level['endpoints'][op]['throughput_rps']
+        )
+    return {
+        'mix': mix,
+        'duration': duration,
+        'levels': levels,
+        'saturation': {
+            'overall': saturation_point(levels),
+            'endpoints': per_endpoint,
+        },
+    }
@@ -0,0 +1,48 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.archive import ARCHIVES, archive_batch, archive_horizon
+from core.sharding import aliases, use_shard
+
+
+class Command(BaseCommand):
+    help = "Move old events and vaccines into the archive tables (see core/archive.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.ARCHIVE_HORIZON_DAYS,
+            help="Archive records dated and last written before this many days ago "
+                 "(default: ARCHIVE_HORIZON_DAYS).",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.ARCHIVE_BATCH_SIZE,
+            help="Rows moved per transaction, to keep write locks short.",
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0.0,
+            help="Seconds to pause between batches.",
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] <= settings.SYNC_TOMBSTONE_RETENTION_DAYS:
+            # delta clients could otherwise miss rows written after their last sync
+            raise CommandError("--days must be longer than SYNC_TOMBSTONE_RETENTION_DAYS.")
+        horizon = archive_horizon(options['days'])
+        for model in ARCHIVES:
+            archived = 0
+            for alias in aliases():
+                with use_shard(alias):
+                    while True:
+                        moved = archive_batch(model, horizon, options['batch_size'])
+                        archived += moved
+                        if moved < options['batch_size']:
+                            break
+                        time.sleep(options['sleep'])
+            self.stdout.write(f"Archived {archived} {model._meta.verbose_name_plural} "
+                              f"older than {horizon.date().isoformat()}.")
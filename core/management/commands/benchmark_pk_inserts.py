@@ -0,0 +1,72 @@
+import json
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from core.models import uuid7
+
+GENERATORS = {
+    'uuid4': uuid.uuid4,
+    'uuid7': uuid7,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare insert throughput of random (v4) and time-ordered (v7) UUID primary keys "
+        "on scratch tables in the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2_000_000, help="Rows inserted per key type.")
+        parser.add_argument('--batch-size', type=int, default=10_000, help="Rows per INSERT batch.")
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        results = {
+            name: self.run(name, generator, options['rows'], options['batch_size'])
+            for name, generator in GENERATORS.items()
+        }
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name}: {result['rows_per_second']:.0f} rows/s overall, "
+                f"{result['last_batch_rows_per_second']:.0f} rows/s on the last batch"
+            )
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                json.dump({'vendor': connection.vendor, 'results': results}, fp, indent=2)
+
+    def run(self, name, generator, rows, batch_size):
+        table = connection.ops.quote_name(f'bench_pk_{name}')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {table}')
+            cursor.execute(f'CREATE TABLE {table} (id char(32) PRIMARY KEY, payload varchar(100) NOT NULL)')
+        sql = f'INSERT INTO {table} (id, payload) VALUES (%s, %s)'
+
+        batches = []
+        try:
+            inserted = 0
+            while inserted < rows:
+                size = min(batch_size, rows - inserted)
+                params = [(generator().hex, 'x' * 64) for _ in range(size)]
+                started = time.perf_counter()
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.executemany(sql, params)
+                batches.append((size, time.perf_counter() - started))
+                inserted += size
+                self.stderr.write(f"{name}: {inserted}/{rows}", ending='\r')
+            self.stderr.write('')
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE IF EXISTS {table}')
+
+        total_time = sum(elapsed for _, elapsed in batches)
+        last_size, last_elapsed = batches[-1]
+        return {
+            'rows': rows,
+            'batch_size': batch_size,
+            'seconds': total_time,
+            'rows_per_second': rows / total_time,
+            'last_batch_rows_per_second': last_size / last_elapsed,
+            'batch_seconds': [elapsed for _, elapsed in batches],
+        }
@@ -0,0 +1,67 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import connection
+from core.benchmarks import run_benchmarks, scenarios
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the sync endpoints and viewset lists on a generated dataset. "
+        "Runs in a throwaway test database unless --use-current-db is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--pets-per-user', type=int, default=3)
+        parser.add_argument('--events-per-pet', type=int, default=50)
+        parser.add_argument('--vaccines-per-pet', type=int, default=10)
+        parser.add_argument('--iterations', type=int, default=50, help="Timed requests per scenario.")
+        parser.add_argument('--profile-iterations', type=int, default=5,
+                            help="Requests per scenario measured for queries and peak memory.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', nargs='+', choices=sorted(scenarios()), help="Run only these scenarios.")
+        parser.add_argument('--output', default='bench_results.json', help="JSON file for the results.")
+        parser.add_argument('--compare', help="Previous results file to print deltas against.")
+        parser.add_argument('--use-current-db', action='store_true',
+                            help="Write the dataset to the configured database instead of a test database.")
+
+    def handle(self, *args, **options):
+        old_name = None
+        if not options['use_current_db']:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            report = run_benchmarks(
+                users=options['users'],
+                pets_per_user=options['pets_per_user'],
+                events_per_pet=options['events_per_pet'],
+                vaccines_per_pet=options['vaccines_per_pet'],
+                iterations=options['iterations'],
+                profile_iterations=options['profile_iterations'],
+                seed=options['seed'],
+                only=options['only'],
+            )
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        with open(options['output'], 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+        previous = {}
+        if options['compare']:
+            with open(options['compare']) as fp:
+                previous = json.load(fp)['results']
+
+        for name, result in report['results'].items():
+            line = (
+                f"{name:<22} p50 {result['latency_ms']['p50']:8.2f} ms  "
+                f"p95 {result['latency_ms']['p95']:8.2f} ms  "
+                f"queries {result['queries']['max'] if result['queries'] else '-':>5}  "
+                f"peak {(result['peak_memory_bytes'] or 0) / 1024:8.0f} KiB"
+            )
+            if name in previous:
+                before = previous[name]['latency_ms']['p50']
+                line += f"  (p50 {100 * (result['latency_ms']['p50'] - before) / before:+.1f}%)"
+            self.stdout.write(line)
+        self.stdout.write(f"Results written to {options['output']}")
@@ -0,0 +1,30 @@
+import shutil
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.urls import reverse
+from core.schema import CachedSpectacularAPIView, code_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-render the OpenAPI schema for every supported format into SCHEMA_CACHE_DIR "
+        "for the current code version, removing files left by older versions."
+    )
+
+    def handle(self, *args, **options):
+        version = code_version()
+        cache_dir = Path(settings.SCHEMA_CACHE_DIR)
+        if cache_dir.exists():
+            for stale in cache_dir.iterdir():
+                if stale.is_dir() and stale.name != version:
+                    shutil.rmtree(stale)
+
+        factory = RequestFactory()
+        view = CachedSpectacularAPIView.as_view()
+        for renderer in CachedSpectacularAPIView.renderer_classes:
+            request = factory.get(reverse('schema'), HTTP_ACCEPT=renderer.media_type)
+            response = view(request)
+            self.stdout.write(f"{renderer.media_type}: {len(response.content)} bytes, ETag {response['ETag']}")
+        self.stdout.write(f"Schema cached for code version {version} in {cache_dir}.")
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from core.snapshots import build_snapshots, remove_stale, users_due
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the gzip'd first-sync snapshots served by sync/download for users "
+        "with at least SYNC_SNAPSHOTS['MIN_RECORDS'] records. Run periodically, "
+        "more often than SYNC_SNAPSHOTS['MAX_AGE_HOURS']."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-records', type=int, default=settings.SYNC_SNAPSHOTS['MIN_RECORDS'])
+        parser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME',
+                            help="Build only for this user (repeatable), regardless of size.")
+
+    def handle(self, *args, **options):
+        if options['usernames']:
+            user_ids = list(get_user_model().objects.filter(username__in=options['usernames'])
+                            .values_list('id', flat=True))
+            removed = 0
+        else:
+            user_ids = users_due(options['min_records'])
+            removed = remove_stale(user_ids)
+
+        snapshots = build_snapshots(user_ids=user_ids)
+        size = sum(snapshot.size for snapshot in snapshots)
+        records = sum(snapshot.records for snapshot in snapshots)
+        self.stdout.write(
+            f"Built {len(snapshots)} snapshots ({records} records, {size / 1024:.1f} KiB gzip); "
+            f"removed {removed} stale."
+        )
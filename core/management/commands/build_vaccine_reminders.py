@@ -0,0 +1,56 @@
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from core.models import Vaccine, VaccineReminder
+from core.sharding import atomic, group_by_shard, use_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Materialize reminders for vaccines whose next dose falls within the look-ahead window. "
+        "Meant to run nightly; users are processed in batches so each run touches only the "
+        "(animal, next_dose_date) index range of one batch at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.VACCINE_DUE_DEFAULT_DAYS,
+            help="Look-ahead window in days (default: VACCINE_DUE_DEFAULT_DAYS).",
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help="Users processed per transaction.")
+
+    def handle(self, *args, **options):
+        today = now().date()
+        window = (today, today + timedelta(days=options['days']))
+        users = get_user_model().objects.order_by('pk').values_list('pk', flat=True)
+
+        total = 0
+        last_pk = None
+        while True:
+            batch_qs = users if last_pk is None else users.filter(pk__gt=last_pk)
+            batch = list(batch_qs[:options['batch_size']])
+            if not batch:
+                break
+            for alias, user_ids in group_by_shard(batch).items():
+                with use_shard(alias):
+                    total += self.build_batch(user_ids, window)
+            last_pk = batch[-1]
+
+        self.stdout.write(f"Built {total} vaccine reminders due between {window[0]} and {window[1]}.")
+
+    @atomic()
+    def build_batch(self, user_ids, window):
+        VaccineReminder.objects.filter(user_id__in=user_ids).delete()
+        due = Vaccine.objects.filter(
+            animal__user_id__in=user_ids,
+            next_dose_date__range=window,
+        ).values_list('id', 'animal__user_id', 'next_dose_date')
+        created = VaccineReminder.objects.bulk_create([
+            VaccineReminder(vaccine_id=vaccine_id, user_id=user_id, due_date=due_date)
+            for vaccine_id, user_id, due_date in due.iterator(chunk_size=2000)
+        ])
+        return len(created)
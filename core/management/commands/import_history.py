@@ -0,0 +1,77 @@
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from core.importer import METHODS, Importer, find_sources
+from core.sharding import shard_for_user, use_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a user's pets, events and vaccines from animals/events/vaccines CSV or NDJSON files "
+        "(a directory or the ZIP from /api/export), validated like sync uploads and inserted in "
+        "batches. Existing ids are skipped. With --checkpoint, progress is saved after every batch "
+        "and --resume continues an interrupted import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Directory or ZIP with animals.*, events.* and/or vaccines.*")
+        parser.add_argument('--user', required=True, help="Username that will own the imported records.")
+        parser.add_argument('--batch-size', type=int, default=settings.IMPORT_BATCH_SIZE)
+        parser.add_argument('--method', choices=('auto', *METHODS), default='auto',
+                            help="bulk: bulk_create; copy: COPY FROM STDIN (PostgreSQL only); "
+                                 "auto: copy on PostgreSQL, bulk elsewhere.")
+        parser.add_argument('--checkpoint', help="JSON file where progress is recorded.")
+        parser.add_argument('--resume', action='store_true', help="Skip the rows recorded in --checkpoint.")
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {options['user']!r} not found.")
+        if options['resume'] and not options['checkpoint']:
+            raise CommandError("--resume needs --checkpoint.")
+        try:
+            found = find_sources(options['source'])
+        except OSError as error:
+            raise CommandError(str(error))
+        if not found:
+            raise CommandError(f"No animals/events/vaccines .csv or .ndjson files in {options['source']}.")
+
+        alias = shard_for_user(user.pk)
+        vendor = connections[alias].vendor
+        method = options['method']
+        if method == 'auto':
+            method = 'copy' if vendor == 'postgresql' else 'bulk'
+        elif method == 'copy' and vendor != 'postgresql':
+            raise CommandError("--method copy requires PostgreSQL.")
+
+        with use_shard(alias):
+            importer = Importer(
+                user,
+                batch_size=options['batch_size'],
+                method=method,
+                checkpoint=options['checkpoint'],
+                resume=options['resume'],
+                progress=self.report_progress,
+                reject=self.report_rejected,
+            )
+            results = importer.run(options['source'])
+        self.stderr.write('')
+        for stats in results.values():
+            self.stdout.write(
+                f"{stats['file']}: {stats['imported']} imported, {stats['existing']} already present, "
+                f"{stats['rejected']} rejected."
+            )
+
+    def report_progress(self, stats):
+        elapsed = time.perf_counter() - stats['started']
+        handled = stats['imported'] + stats['existing'] + stats['rejected']
+        self.stderr.write(
+            f"{stats['file']}: {stats['rows']} rows ({handled / elapsed if elapsed else 0:.0f} rows/s)",
+            ending='\r',
+        )
+
+    def report_rejected(self, file_name, number, errors):
+        self.stderr.write(f"{file_name} row {number}: {errors}")
@@ -0,0 +1,46 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.startup import by_package, measure_boot
+
+
+class Command(BaseCommand):
+    help = (
+        "Boot a worker in a fresh interpreter under `python -X importtime` and report "
+        "the slowest imports. Defaults to the STARTUP_PROFILE of the current environment."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', choices=['full', 'lean'])
+        parser.add_argument('--top', type=int, default=20, help="Rows to print.")
+        parser.add_argument('--sort', choices=['cumulative', 'self'], default='cumulative')
+        parser.add_argument('--by-package', action='store_true', help="Sum self time per top-level package.")
+        parser.add_argument('--json', action='store_true', help="Print the full report as JSON.")
+        parser.add_argument('--check', action='store_true',
+                            help="Fail if the boot took longer than WORKER_BOOT_BUDGET_MS.")
+
+    def handle(self, *args, **options):
+        report = measure_boot(options['profile'])
+        self.report(report, options)
+        if options['check'] and report['wall_ms'] > settings.WORKER_BOOT_BUDGET_MS:
+            raise CommandError(
+                f"Boot took {report['wall_ms']:.1f} ms, budget is {settings.WORKER_BOOT_BUDGET_MS} ms."
+            )
+
+    def report(self, report, options):
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            f"Boot ({report['profile']}): {report['wall_ms']:.1f} ms wall, "
+            f"{len(report['modules'])} modules, {report['imported_ms']:.1f} ms importing"
+        )
+        if options['by_package']:
+            for row in by_package(report['modules'])[:options['top']]:
+                self.stdout.write(f"{row['self_ms']:9.2f} ms  {row['package']}")
+            return
+
+        key = f"{options['sort']}_ms"
+        for row in sorted(report['modules'], key=lambda row: row[key], reverse=True)[:options['top']]:
+            self.stdout.write(f"{row['self_ms']:9.2f} {row['cumulative_ms']:9.2f} ms  {row['module']}")
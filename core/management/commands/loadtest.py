@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+from contextlib import nullcontext
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.timezone import now
+from core.benchmarks import throttling_disabled
+from core.loadtest import DEFAULT_MIX, HTTPTransport, InProcessTransport, run_load_test
+from core.synthetic import generate_dataset
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in DEFAULT_MIX or not weight.isdigit():
+            raise CommandError(f"Invalid mix entry {item!r}; use e.g. check=50,delta=20 with {sorted(DEFAULT_MIX)}.")
+        mix[name] = int(weight)
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic dataset and replay a weighted mix of authenticated traffic "
+        "(token obtain/refresh, check-update polling, delta/full downloads, uploads with conflicts) "
+        "at increasing concurrency, reporting throughput, latency percentiles, error rates "
+        "and the saturation point of each endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--pets-per-user', type=int, default=3)
+        parser.add_argument('--events-per-pet', type=int, default=30)
+        parser.add_argument('--vaccines-per-pet', type=int, default=8)
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per concurrency level.")
+        parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                            help="Operation weights, e.g. check=50,delta=20,upload=15,full=5,refresh=7,token=3.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--url', help="Replay against a running server (e.g. http://127.0.0.1:8000) "
+                                          "instead of in-process. The dataset is seeded into the configured "
+                                          "database, which must be the one the server uses.")
+        parser.add_argument('--use-current-db', action='store_true',
+                            help="Seed the configured database instead of a throwaway test database.")
+        parser.add_argument('--throttle', action='store_true',
+                            help="Keep SyncCostThrottle active (in-process only); by default raw capacity is measured.")
+        parser.add_argument('--output', help="Write the full report as JSON to this file.")
+
+    def handle(self, *args, **options):
+        use_test_db = not (options['use_current_db'] or options['url'])
+        old_name = connection.settings_dict['NAME']
+        if use_test_db:
+            if connection.vendor == 'sqlite':
+                # in-memory shared-cache databases lock whole tables between threads, so a file
+                # gives a picture much closer to a real deployment
+                handle, path = tempfile.mkstemp(suffix='.sqlite3', prefix='loadtest-')
+                os.close(handle)
+                connection.settings_dict['TEST'] = {**connection.settings_dict.get('TEST', {}), 'NAME': path}
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            password = 'loadtest'
+            users = generate_dataset(
+                options['users'], options['pets_per_user'], options['events_per_pet'],
+                options['vaccines_per_pet'], seed=options['seed'],
+                username_prefix=f"loadtest-{options['seed']}", password=password, epoch=now(),
+            )
+            accounts = [(user.username, password) for user in users]
+            if options['url']:
+                make_transport = lambda: HTTPTransport(options['url'])
+            else:
+                make_transport = InProcessTransport
+            with nullcontext() if options['throttle'] else throttling_disabled():
+                report = run_load_test(make_transport, accounts, options['concurrency'], options['duration'],
+                                       mix=options['mix'], seed=options['seed'])
+        finally:
+            if use_test_db:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for level in report['levels']:
+            self.stdout.write(
+                f"concurrency {level['concurrency']:>3}: {level['throughput_rps']:8.1f} req/s  "
+                f"errors {100 * level['error_rate']:5.1f}%"
+            )
+            for name, endpoint in level['endpoints'].items():
+                latency = endpoint['latency_ms']
+                self.stdout.write(
+                    f"    {name:<8} {endpoint['throughput_rps']:8.1f} req/s  p50 {latency['p50']:8.1f} ms  "
+                    f"p95 {latency['p95']:8.1f} ms  p99 {latency['p99']:8.1f} ms  "
+                    f"errors {100 * endpoint['error_rate']:5.1f}%"
+                )
+        saturation = report['saturation']
+        self.stdout.write(f"saturation (overall): {saturation['overall'] or 'not reached'}")
+        for name, point in saturation['endpoints'].items():
+            self.stdout.write(f"saturation ({name}): {point or 'not reached'}")
+
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                json.dump(report, fp, indent=2)
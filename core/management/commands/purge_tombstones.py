@@ -0,0 +1,36 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from core.models import Tombstone
+from core.sharding import aliases
+
+
+class Command(BaseCommand):
+    help = "Remove deletion tombstones older than the sync retention window."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.SYNC_TOMBSTONE_RETENTION_DAYS,
+            help="Retention window in days (default: SYNC_TOMBSTONE_RETENTION_DAYS).",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help="Rows deleted per statement, to keep write locks short.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = now() - timedelta(days=options['days'])
+        purged = 0
+        for alias in aliases():
+            expired = Tombstone.objects.using(alias).filter(deleted_at__lt=cutoff)
+            while True:
+                ids = list(expired.values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                purged += Tombstone.objects.using(alias).filter(id__in=ids).delete()[0]
+        self.stdout.write(f"Purged {purged} tombstones deleted before {cutoff.isoformat()}.")
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from core.models import UserShard
+from core.sharding import directory_entry, move_user, pick_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Move users between database shards while the API keeps serving them (their writes get "
+        "503 during the copy). By default every user whose rendezvous hash over DATABASE_SHARDS "
+        "now prefers another shard is moved, e.g. after adding a shard."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME',
+                            help="Only this user (repeatable).")
+        parser.add_argument('--to', dest='target', help="Move the selected users to this shard alias.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows copied per INSERT.")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_SHARDS:
+            raise CommandError("DATABASE_SHARDS is empty; there is nothing to rebalance.")
+        target = options['target']
+        if target is not None and target not in settings.DATABASE_SHARDS:
+            raise CommandError(f"Unknown shard {target!r}; choose from {settings.DATABASE_SHARDS}.")
+
+        entries = UserShard.objects.order_by('user_id')
+        if options['usernames']:
+            user_ids = list(get_user_model().objects.filter(username__in=options['usernames'])
+                            .values_list('pk', flat=True))
+            for user_id in user_ids:
+                directory_entry(user_id)
+            entries = entries.filter(user_id__in=user_ids)
+
+        moved = rows = 0
+        for user_id, alias in entries.values_list('user_id', 'alias').iterator():
+            destination = target or pick_shard(user_id)
+            if destination == alias:
+                continue
+            self.stdout.write(f"user {user_id}: {alias} -> {destination}")
+            if not options['dry_run']:
+                rows += move_user(user_id, destination, options['batch_size'])
+            moved += 1
+        self.stdout.write(f"Moved {moved} users ({rows} rows).")
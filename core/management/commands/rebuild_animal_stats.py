@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from core.models import Animal
+from core.sharding import aliases, use_shard, user_shard
+from core.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-pet statistics from the Event/Vaccine tables. "
+        "Run after bulk loads that bypass model signals, or to repair drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME',
+                            help="Only this user's pets (repeatable). Default: every pet.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Pets recomputed per transaction.")
+
+    def handle(self, *args, **options):
+        rebuilt = 0
+        if options['usernames']:
+            users = get_user_model().objects.filter(username__in=options['usernames'])
+            for user_id in users.values_list('id', flat=True):
+                with user_shard(user_id):
+                    rebuilt += self.rebuild(Animal.objects.filter(user_id=user_id), options['batch_size'])
+        else:
+            for alias in aliases():
+                with use_shard(alias):
+                    rebuilt += self.rebuild(Animal.objects.all(), options['batch_size'])
+        self.stdout.write(f"Rebuilt statistics for {rebuilt} pets.")
+
+    def rebuild(self, animals, batch_size):
+        ids = list(animals.order_by('pk').values_list('id', flat=True))
+        for start in range(0, len(ids), batch_size):
+            rebuild_stats(ids[start:start + batch_size])
+        return len(ids)
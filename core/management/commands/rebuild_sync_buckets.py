@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from core.merkle import rebuild_buckets
+from core.models import SyncBucket
+from core.sharding import aliases, user_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the reconciliation hash buckets from the Animal/Event/Vaccine tables. "
+        "Run after bulk loads that bypass model signals, or to repair drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME',
+                            help="Only this user (repeatable). Default: every user with buckets.")
+        parser.add_argument('--all-users', action='store_true',
+                            help="Also build buckets for users that have none yet.")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        elif not options['all_users']:
+            # collected per shard, the bucket tables may not share a database with the users
+            users = users.filter(id__in={
+                user_id for alias in aliases()
+                for user_id in SyncBucket.objects.using(alias).values_list('user_id', flat=True).distinct()
+            })
+
+        rebuilt = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            with user_shard(user_id):
+                rebuild_buckets(user_id)
+            rebuilt += 1
+        self.stdout.write(f"Rebuilt sync buckets for {rebuilt} users.")
@@ -0,0 +1,56 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from core.profiling import list_profiles, load_profile, profile_directory
+
+
+class Command(BaseCommand):
+    help = "List, dump or clear profiles captured by SlowRequestProfilerMiddleware."
+
+    def add_arguments(self, parser):
+        subcommands = parser.add_subparsers(dest='action', required=True)
+        subcommands.add_parser('list', help="List captured profiles, oldest first.")
+        dump = subcommands.add_parser('dump', help="Print one captured profile.")
+        dump.add_argument('profile_id')
+        dump.add_argument(
+            '--format',
+            choices=['json', 'collapsed', 'sql'],
+            default='json',
+            help="json: everything; collapsed: stacks for flamegraph.pl/speedscope; sql: the query log.",
+        )
+        subcommands.add_parser('clear', help="Delete every captured profile.")
+
+    def handle(self, *args, **options):
+        getattr(self, f"handle_{options['action']}")(options)
+
+    def handle_list(self, options):
+        profiles = list_profiles()
+        if not profiles:
+            self.stdout.write("No profiles captured.")
+            return
+        for profile in profiles:
+            self.stdout.write(
+                f"{profile['id']}  {profile['captured_at']}  {profile['duration_ms']:9.1f} ms  "
+                f"{profile['method']} {profile['path']}  status={profile['status']}  "
+                f"user={profile['username'] or '-'}  payload={profile['payload_bytes']}B  "
+                f"queries={profile['query_count']}"
+            )
+
+    def handle_dump(self, options):
+        profile = load_profile(options['profile_id'])
+        if profile is None:
+            raise CommandError(f"Profile {options['profile_id']} not found in {profile_directory()}.")
+        if options['format'] == 'collapsed':
+            for stack, count in profile['stacks'].items():
+                self.stdout.write(f"{stack} {count}")
+        elif options['format'] == 'sql':
+            for query in profile['queries']:
+                self.stdout.write(f"{query['ms']:8.3f} ms  {query['sql']}")
+        else:
+            self.stdout.write(json.dumps(profile, indent=2))
+
+    def handle_clear(self, options):
+        removed = 0
+        for path in profile_directory().glob('*.json'):
+            path.unlink(missing_ok=True)
+            removed += 1
+        self.stdout.write(f"Removed {removed} profiles.")
@@ -0,0 +1,277 @@
+"""Per-user hash tree over Animal/Event/Vaccine rows for sync reconciliation.
+
+Every row is a leaf whose hash covers its model, id and `updated_at`. Leaves
+fall into one of 256 buckets keyed by the last two hex digits of the id. Those
+digits are random for both client v4 and server v7 ids, so buckets stay even.
+A bucket stores the XOR of its leaf hashes and a row count. XOR makes the
+bucket order-independent and lets writes apply their change as a delta: on
+update XOR out the old leaf and XOR in the new one. Interior nodes (16 groups
+by first hex digit, then the root) are XORs of their children, computed on
+read from the 256 rows.
+
+A client computes the same hashes over its local rows and walks down only
+where they differ. `sync/reconcile` with `buckets` then lists the differing
+buckets' ids and versions, to be fetched or dropped individually.
+
+Deltas come from model signals (see CoreConfig.ready) and bulk writes call
+`record_write` themselves. Inside `batched()` they accumulate and are
+flushed once, at most two queries per user. BATCH_LISTENERS lets other
+per-write bookkeeping share the same batches. A user without bucket rows
+(new, or data loaded in bulk) is rebuilt from the tables on first use, and
+`manage.py rebuild_sync_buckets` repairs drift.
+"""
+import hashlib
+import threading
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from rest_framework.fields import DateTimeField
+from .models import Animal, ArchivedEvent, ArchivedVaccine, Event, Vaccine, SyncBucket
+from .sharding import atomic
+
+BUCKETS = [f'{i:02x}' for i in range(256)]
+# (flush, discard) of other per-write accumulators that share `batched()` (core/stats.py)
+BATCH_LISTENERS = []
+# archived rows keep their leaves: same model name, id and version as before the move
+TRACKED_MODELS = {
+    Animal: 'animal',
+    Event: 'event',
+    Vaccine: 'vaccine',
+    ArchivedEvent: 'event',
+    ArchivedVaccine: 'vaccine',
+}
+
+# leaves hash `updated_at` exactly as the API renders it, so clients can hash what they received
+_timestamp = DateTimeField()
+_state = threading.local()
+
+
+def leaf_hash(model_name, object_id, updated_at):
+    """63-bit hash of `"<model>:<id>:<updated_at>"`, so it fits a signed BIGINT."""
+    key = f'{model_name}:{_as_uuid(object_id)}:{_timestamp.to_representation(updated_at)}'
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], 'big') >> 1
+
+
+def bucket_of(object_id):
+    return _as_uuid(object_id).hex[-2:]
+
+
+def _as_uuid(value):
+    # unsaved instances may still hold the id as the string the client sent
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+def format_hash(value):
+    return f'{value:016x}'
+
+
+def user_leaves(user_id, buckets=None):
+    """(model name, id, updated_at) of every row the user owns, optionally only in `buckets`.
+
+    No index covers an id's last two digits, and `LIKE '%xx'` per bucket would
+    still visit every row the user owns. So bucket listings read the user's
+    (id, updated_at) pairs through the owner indexes and pick the buckets here:
+    one pass over the user's rows per request, the same cost as rebuild_buckets.
+    """
+    wanted = None if buckets is None else set(buckets)
+    querysets = [
+        ('animal', Animal.objects.filter(user_id=user_id)),
+        ('event', Event.objects.filter(animal__user_id=user_id)),
+        ('event', ArchivedEvent.objects.filter(animal__user_id=user_id)),
+        ('vaccine', Vaccine.objects.filter(animal__user_id=user_id)),
+        ('vaccine', ArchivedVaccine.objects.filter(animal__user_id=user_id)),
+    ]
+    for model_name, queryset in querysets:
+        for object_id, updated_at in queryset.values_list('id', 'updated_at').iterator():
+            if wanted is None or bucket_of(object_id) in wanted:
+                yield model_name, object_id, updated_at
+
+
+def rebuild_buckets(user_id):
+    hashes = dict.fromkeys(BUCKETS, 0)
+    counts = dict.fromkeys(BUCKETS, 0)
+    for model_name, object_id, updated_at in user_leaves(user_id):
+        bucket = bucket_of(object_id)
+        hashes[bucket] ^= leaf_hash(model_name, object_id, updated_at)
+        counts[bucket] += 1
+    with atomic(savepoint=False):
+        SyncBucket.objects.filter(user_id=user_id).delete()
+        SyncBucket.objects.bulk_create([
+            SyncBucket(user_id=user_id, bucket=bucket, hash=hashes[bucket], count=counts[bucket])
+            for bucket in BUCKETS
+        ])
+
+
+def user_buckets(user_id):
+    """{bucket: (hash, count)} for all 256 buckets, building them if the user has none yet."""
+    rows = SyncBucket.objects.filter(user_id=user_id).values_list('bucket', 'hash', 'count')
+    buckets = {bucket: (value, count) for bucket, value, count in rows}
+    if not buckets:
+        rebuild_buckets(user_id)
+        return user_buckets(user_id)
+    return buckets
+
+
+def tree(user_id, prefix=''):
+    """Node for `prefix` ('' is the root, one hex digit a group) with its child hashes."""
+    buckets = user_buckets(user_id)
+    node_hash, node_count = 0, 0
+    children = defaultdict(lambda: [0, 0])
+    for bucket, (value, count) in buckets.items():
+        if not bucket.startswith(prefix):
+            continue
+        node_hash ^= value
+        node_count += count
+        child = children[bucket[:len(prefix) + 1]]
+        child[0] ^= value
+        child[1] += count
+    return {
+        'prefix': prefix,
+        'hash': format_hash(node_hash),
+        'count': node_count,
+        'children': [
+            {'key': key, 'hash': format_hash(value), 'count': count}
+            for key, (value, count) in sorted(children.items())
+        ],
+    }
+
+
+def bucket_leaves(user_id, buckets):
+    leaves = {bucket: [] for bucket in buckets}
+    for model_name, object_id, updated_at in user_leaves(user_id, buckets):
+        leaves[bucket_of(object_id)].append({
+            'model': model_name,
+            'id': object_id,
+            'updated_at': updated_at,
+        })
+    return leaves
+
+
+# -- incremental maintenance ---------------------------------------------------
+
+def _pending():
+    if not hasattr(_state, 'depth'):
+        _state.depth = 0
+        _state.deltas = defaultdict(lambda: [0, 0])  # (owner key, bucket) -> [xor, count delta]
+        _state.owners = {}  # animal id -> user id
+        _state.stale = set()  # owner keys whose buckets must be rebuilt
+    return _state
+
+
+def _owner_key(instance):
+    state = _pending()
+    if isinstance(instance, Animal):
+        state.owners[instance.pk] = instance.user_id
+        return ('user', instance.user_id)
+    if type(instance).animal.is_cached(instance):
+        state.owners[instance.animal_id] = instance.animal.user_id
+    return ('animal', instance.animal_id)
+
+
+def _add(instance, xor, count):
+    state = _pending()
+    delta = state.deltas[(_owner_key(instance), bucket_of(instance.pk))]
+    delta[0] ^= xor
+    delta[1] += count
+    if state.depth == 0:
+        flush()
+
+
+def record_write(instance, created):
+    """Account for a saved or bulk-created row."""
+    model_name = TRACKED_MODELS[type(instance)]
+    old = getattr(instance, '_loaded_updated_at', None)
+    if not created and old == instance.updated_at:
+        return
+    if not created and old is None:
+        # saved over an existing row without loading it: the old leaf is unknown
+        _pending().stale.add(_owner_key(instance))
+        _add(instance, 0, 0)
+        return
+    xor = leaf_hash(model_name, instance.pk, instance.updated_at)
+    if not created and old is not None:
+        xor ^= leaf_hash(model_name, instance.pk, old)
+    instance._loaded_updated_at = instance.updated_at
+    _add(instance, xor, 1 if created else 0)
+
+
+def record_delete(instance):
+    model_name = TRACKED_MODELS[type(instance)]
+    updated_at = getattr(instance, '_loaded_updated_at', None) or instance.updated_at
+    _add(instance, leaf_hash(model_name, instance.pk, updated_at), -1)
+
+
+def remember_owner(instance):
+    """Called before an animal is deleted, while its children can still be attributed to its user."""
+    _pending().owners[instance.pk] = instance.user_id
+
+
+@contextmanager
+def batched():
+    """Accumulate bucket deltas and apply them once when the outermost block exits.
+
+    Use inside the transaction that performs the writes; on error the deltas are
+    dropped along with the rolled-back rows.
+    """
+    state = _pending()
+    state.depth += 1
+    try:
+        yield
+    except BaseException:
+        state.depth -= 1
+        if state.depth == 0:
+            state.deltas.clear()
+            state.stale.clear()
+            for _, discard in BATCH_LISTENERS:
+                discard()
+        raise
+    state.depth -= 1
+    if state.depth == 0:
+        flush()
+
+
+def in_batch():
+    return _pending().depth > 0
+
+
+def flush():
+    for flush_listener, _ in BATCH_LISTENERS:
+        flush_listener()
+    state = _pending()
+    if not state.deltas:
+        return
+    deltas, state.deltas = state.deltas, defaultdict(lambda: [0, 0])
+    owners, state.owners = state.owners, {}
+    stale, state.stale = state.stale, set()
+
+    unknown = {key for (kind, key), _ in deltas if kind == 'animal' and key not in owners}
+    if unknown:
+        owners.update(Animal.objects.filter(id__in=unknown).values_list('id', 'user_id'))
+
+    def user_of(owner):
+        kind, key = owner
+        return key if kind == 'user' else owners.get(key)
+
+    rebuild = {user_of(owner) for owner in stale} - {None}
+    by_user = defaultdict(dict)
+    for (owner, bucket), (xor, count) in deltas.items():
+        user_id = user_of(owner)
+        if user_id is None or user_id in rebuild or (xor == 0 and count == 0):
+            continue
+        current = by_user[user_id].get(bucket, (0, 0))
+        by_user[user_id][bucket] = (current[0] ^ xor, current[1] + count)
+
+    for user_id in rebuild:
+        rebuild_buckets(user_id)
+    for user_id, changes in by_user.items():
+        with atomic(savepoint=False):
+            rows = list(SyncBucket.objects.select_for_update().filter(user_id=user_id, bucket__in=changes))
+            if not rows:
+                # never built: the tables already include this write
+                rebuild_buckets(user_id)
+                continue
+            for row in rows:
+                xor, count = changes[row.bucket]
+                row.hash ^= xor
+                row.count += count
+            SyncBucket.objects.bulk_update(rows, ['hash', 'count'])
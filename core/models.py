@@ -1,21 +1,123 @@
+import hashlib
+import json
+import os
+import threading
+import time
 import uuid
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils.dateparse import parse_datetime
 from django.utils.timezone import now
 # Create your models here.
 
+_uuid7_lock = threading.Lock()
+_uuid7_last = (0, 0)
+
+
+def uuid7():
+    """Time-ordered UUID (RFC 9562 version 7).
+
+    The 48-bit millisecond timestamp leads, so new rows land at the end of the
+    primary-key index instead of a random leaf. `rand_a` holds a per-process
+    sequence that keeps ids monotonic within the same millisecond.
+    Client-generated v4 ids are still accepted everywhere; only the server-side
+    default changes, so no schema migration is needed.
+    """
+    global _uuid7_last
+    with _uuid7_lock:
+        ms = time.time_ns() // 1_000_000
+        last_ms, seq = _uuid7_last
+        if ms <= last_ms:
+            ms, seq = last_ms, seq + 1
+            if seq > 0xFFF:
+                ms, seq = ms + 1, 0
+        else:
+            seq = int.from_bytes(os.urandom(2), 'big') & 0x7FF
+        _uuid7_last = (ms, seq)
+    rand_b = int.from_bytes(os.urandom(8), 'big') & ((1 << 62) - 1)
+    return uuid.UUID(int=(ms << 80) | (0x7 << 76) | (seq << 64) | (0b10 << 62) | rand_b)
+
+
 class BaseModel(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     updated_at = models.DateTimeField(default=now)
+    # per-field timestamps written by patch uploads. '*' keeps the time of the
+    # last whole-record write for fields without their own entry; an empty map
+    # means that write is `updated_at`
+    field_updated_at = models.JSONField(default=dict, blank=True)
+    # hash of CONTENT_FIELDS, kept by save(); lets sync uploads skip rewriting identical rows
+    content_hash = models.CharField(max_length=32, blank=True, default='')
+
+    CONTENT_FIELDS = ()
+    # the columns a row contributes to its pet's AnimalStats by (core/stats.py), owner first
+    STATS_FIELDS = ()
+
     class Meta:
         abstract = True 
 
+    def compute_content_hash(self, **overrides):
+        values = [overrides.get(field, getattr(self, field)) for field in self.CONTENT_FIELDS]
+        return hashlib.sha256(json.dumps(values, default=str).encode()).hexdigest()[:32]
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.compute_content_hash()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & set(self.CONTENT_FIELDS):
+            kwargs['update_fields'] = [*update_fields, 'content_hash']
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the stored version, so core.merkle can remove the old leaf on save/delete
+        instance._loaded_updated_at = instance.__dict__.get('updated_at')
+        # and the stored stats contribution, so core.stats can move it on save/delete
+        if cls.STATS_FIELDS and all(field in instance.__dict__ for field in cls.STATS_FIELDS):
+            instance._loaded_stats = instance.stats_values()
+        return instance
+
+    def stats_values(self):
+        # dates as ISO text, so rows built from strings and from dates count alike
+        return tuple(value.isoformat() if hasattr(value, 'isoformat') else value
+                     for value in (getattr(self, field) for field in self.STATS_FIELDS))
+
+    def field_timestamp(self, field):
+        stamp = self.field_updated_at.get(field) or self.field_updated_at.get('*')
+        return parse_datetime(stamp) if stamp else self.updated_at
+
+    def merge_fields(self, changes):
+        """Apply `{field: (value, updated_at)}` last-writer-wins per field.
+
+        Returns the names of the fields that were newer than what is stored.
+        """
+        applied = []
+        if not self.field_updated_at:
+            self.field_updated_at = {'*': self.updated_at.isoformat()}
+        for field, (value, updated_at) in changes.items():
+            if updated_at > self.field_timestamp(field):
+                setattr(self, field, value)
+                self.field_updated_at[field] = updated_at.isoformat()
+                self.updated_at = max(self.updated_at, updated_at)
+                applied.append(field)
+        return applied
+
 class Animal(BaseModel):
-    user = models.ForeignKey(get_user_model(),on_delete=models.CASCADE, related_name='animals')
+    # users live on the default database and pets on the user's shard (core/sharding.py),
+    # so owner keys carry no database-level constraint
+    user = models.ForeignKey(get_user_model(),on_delete=models.CASCADE, related_name='animals', db_constraint=False)
     name = models.CharField(max_length=100)
     type = models.CharField(max_length=100)
     breed = models.CharField(max_length=100)
     date_of_birth = models.DateField()
+
+    CONTENT_FIELDS = ('name', 'type', 'breed', 'date_of_birth')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'updated_at']),
+            # exact-name lookups from the support admin (core/admin.py)
+            models.Index(fields=['name']),
+        ]
     
     def __str__(self):
         return self.name
@@ -26,15 +128,178 @@ class Vaccine(BaseModel):
     application_date = models.DateField()
     next_dose_date = models.DateField(null=True, blank=True)
 
+    CONTENT_FIELDS = ('name', 'application_date', 'next_dose_date')
+    STATS_FIELDS = ('animal_id', 'name', 'application_date', 'next_dose_date')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['animal', 'next_dose_date']),
+            models.Index(fields=['animal', 'application_date']),
+            models.Index(fields=['animal', 'updated_at']),
+        ]
+
     def __str__(self):
         return f"{self.name} - {self.animal.name}"
 
 
+class VaccineReminder(models.Model):
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='vaccine_reminders',
+                             db_constraint=False)
+    vaccine = models.OneToOneField(Vaccine, on_delete=models.CASCADE, related_name='reminder')
+    due_date = models.DateField()
+    created_at = models.DateTimeField(default=now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['due_date', 'user']),
+        ]
+
+    def __str__(self):
+        return f"{self.vaccine_id} - {self.due_date}"
+
+
 class Event(BaseModel):
     animal = models.ForeignKey(Animal,on_delete=models.CASCADE,related_name='events')
     type = models.CharField(max_length=100)
     date = models.DateField()
     observation = models.TextField(null=True, blank=True)
 
+    CONTENT_FIELDS = ('type', 'date', 'observation')
+    STATS_FIELDS = ('animal_id', 'type', 'date')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['animal', 'date']),
+            models.Index(fields=['animal', 'type']),
+            models.Index(fields=['animal', 'updated_at']),
+        ]
+
     def __str__(self):
         return f"{self.type} - {self.animal.name} - {self.date}"
+
+
+class ArchivedEvent(BaseModel):
+    """Event moved out of the hot table by `manage.py archive_history`, see core/archive.py."""
+    animal = models.ForeignKey(Animal, on_delete=models.CASCADE, related_name='archived_events')
+    type = models.CharField(max_length=100)
+    date = models.DateField()
+    observation = models.TextField(null=True, blank=True)
+    archived_at = models.DateTimeField(default=now)
+
+    CONTENT_FIELDS = Event.CONTENT_FIELDS
+    STATS_FIELDS = Event.STATS_FIELDS
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['animal', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.type} - {self.date} (arquivado)"
+
+
+class ArchivedVaccine(BaseModel):
+    """Vaccine moved out of the hot table by `manage.py archive_history`, see core/archive.py."""
+    animal = models.ForeignKey(Animal, on_delete=models.CASCADE, related_name='archived_vaccines')
+    name = models.CharField(max_length=100)
+    application_date = models.DateField()
+    next_dose_date = models.DateField(null=True, blank=True)
+    archived_at = models.DateTimeField(default=now)
+
+    CONTENT_FIELDS = Vaccine.CONTENT_FIELDS
+    STATS_FIELDS = Vaccine.STATS_FIELDS
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['animal', 'application_date']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} - {self.application_date} (arquivada)"
+
+
+class AnimalStats(models.Model):
+    """Per-pet aggregates kept up to date on every event and vaccine write, see core/stats.py."""
+    animal = models.OneToOneField(Animal, on_delete=models.CASCADE, related_name='stats')
+    # {event type: count} and {event type: latest date}, archived events included
+    event_counts = models.JSONField(default=dict)
+    last_event_dates = models.JSONField(default=dict)
+    vaccine_count = models.IntegerField(default=0)
+    # {vaccine name: [latest application date, its next dose date or null]}: earlier
+    # doses of a vaccine are superseded by the booster, so only the latest one can be due
+    latest_doses = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(default=now)
+
+    def __str__(self):
+        return f"{self.animal_id} - {sum(self.event_counts.values())} eventos"
+
+
+class Tombstone(models.Model):
+    MODEL_CHOICES = [
+        ('animal', 'Animal'),
+        ('event', 'Event'),
+        ('vaccine', 'Vaccine'),
+    ]
+
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='tombstones', db_constraint=False)
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.UUIDField()
+    deleted_at = models.DateTimeField(default=now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at']),
+            models.Index(fields=['deleted_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} - {self.deleted_at}"
+
+    @classmethod
+    def record(cls, user, model, object_ids, deleted_at=None):
+        deleted_at = deleted_at or now()
+        return cls.objects.bulk_create([
+            cls(user=user, model=model, object_id=object_id, deleted_at=deleted_at)
+            for object_id in object_ids
+        ])
+
+
+class SyncBucket(models.Model):
+    """One leaf bucket of a user's reconciliation hash tree, see core/merkle.py."""
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='sync_buckets', db_constraint=False)
+    bucket = models.CharField(max_length=2)
+    hash = models.BigIntegerField(default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'bucket'], name='unique_sync_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}/{self.bucket} - {self.count}"
+
+
+class SyncSnapshot(models.Model):
+    """Prebuilt full-download file for a user, see core/snapshots.py."""
+    user = models.OneToOneField(get_user_model(), on_delete=models.CASCADE, related_name='sync_snapshot',
+                                db_constraint=False)
+    file_name = models.CharField(max_length=255)
+    cursor = models.DateTimeField()
+    records = models.IntegerField()
+    size = models.BigIntegerField()
+    built_at = models.DateTimeField(default=now)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.cursor}"
+
+
+class UserShard(models.Model):
+    """Directory entry placing a user's data on one database shard, see core/sharding.py."""
+    user = models.OneToOneField(get_user_model(), on_delete=models.CASCADE, related_name='shard')
+    alias = models.CharField(max_length=100)
+    # set while `manage.py rebalance_shards` copies the user to another shard; writes are refused meanwhile
+    moving = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.alias}"
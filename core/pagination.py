@@ -0,0 +1,53 @@
+"""Pagination for the REST list endpoints.
+
+Paging is opt-in: a list without `limit` or `offset` is the bare array it
+always was. With either, it returns `limit` rows (REST_FRAMEWORK['PAGE_SIZE']
+by default, at most API_MAX_PAGE_SIZE) starting at `offset`. Like event
+search, a page reads one row more than it returns to know whether another
+page exists instead of counting the user's rows, so responses carry `next` /
+`previous` links and no `count`.
+"""
+from django.conf import settings
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class UncountedLimitOffsetPagination(LimitOffsetPagination):
+    # the browsable API's page links need a count
+    template = None
+
+    def __init__(self):
+        self.max_limit = settings.API_MAX_PAGE_SIZE
+
+    def requested(self, request):
+        return self.limit_query_param in request.query_params or self.offset_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.requested(request):
+            return None
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        rows = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        return rows[:self.limit]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = replace_query_param(self.request.build_absolute_uri(), self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        paginated = super().get_paginated_response_schema(schema)
+        paginated['properties'].pop('count')
+        paginated['required'] = ['results']
+        return {'oneOf': [schema, paginated]}
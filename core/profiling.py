@@ -0,0 +1,149 @@
+"""Opt-in profiling of slow requests.
+
+`SlowRequestProfilerMiddleware` watches the paths listed in
+`SLOW_REQUEST_PROFILING['PATHS']`. While one of those requests runs, a
+sampling thread records the request thread's stack every `SAMPLE_INTERVAL_MS`,
+and every SQL statement is logged with its duration. If the request ends up
+slower than `THRESHOLD_MS`, the collapsed stacks (flamegraph format), the SQL
+log and user/payload metadata are written to `DIRECTORY`. That directory is
+kept as a ring buffer of at most `MAX_PROFILES` files. Use
+`manage.py slow_profiles` to inspect it.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+from django.conf import settings
+from django.db import connections
+from django.utils.timezone import now
+
+MAX_LOGGED_QUERIES = 500
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(name='slow-request-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class SQLLog:
+    def __init__(self):
+        self.queries = []
+        self.count = 0
+        self.db_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.db_time += elapsed
+            if len(self.queries) < MAX_LOGGED_QUERIES:
+                self.queries.append({'sql': sql, 'many': many, 'ms': round(elapsed * 1000, 3)})
+
+
+def profile_directory():
+    return Path(settings.SLOW_REQUEST_PROFILING['DIRECTORY'])
+
+
+def save_profile(profile):
+    directory = profile_directory()
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_id = f"{time.time_ns() // 1_000_000}-{uuid.uuid4().hex[:8]}"
+    profile['id'] = profile_id
+    tmp = directory / f'.{profile_id}.tmp'
+    tmp.write_text(json.dumps(profile))
+    tmp.replace(directory / f'{profile_id}.json')
+
+    # ring buffer: ids start with a millisecond timestamp, so name order is age order
+    files = sorted(directory.glob('*.json'))
+    for stale in files[:max(0, len(files) - settings.SLOW_REQUEST_PROFILING['MAX_PROFILES'])]:
+        stale.unlink(missing_ok=True)
+    return profile_id
+
+
+def list_profiles():
+    directory = profile_directory()
+    if not directory.exists():
+        return []
+    return [json.loads(path.read_text()) for path in sorted(directory.glob('*.json'))]
+
+
+def load_profile(profile_id):
+    path = profile_directory() / f'{profile_id}.json'
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+class SlowRequestProfilerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = settings.SLOW_REQUEST_PROFILING
+        if not config['ENABLED'] or not request.path.startswith(tuple(config['PATHS'])):
+            return self.get_response(request)
+
+        sql_log = SQLLog()
+        sampler = StackSampler(threading.get_ident(), config['SAMPLE_INTERVAL_MS'] / 1000)
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sql_log))
+                response = self.get_response(request)
+        finally:
+            sampler.stop()
+        duration_ms = (time.perf_counter() - started) * 1000
+
+        if duration_ms >= config['THRESHOLD_MS']:
+            # DRF copies the token-authenticated user onto the Django request
+            user = getattr(request, 'user', None)
+            save_profile({
+                'captured_at': now().isoformat(),
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'duration_ms': round(duration_ms, 3),
+                'user_id': user.pk if user is not None and user.is_authenticated else None,
+                'username': user.get_username() if user is not None and user.is_authenticated else None,
+                'payload_bytes': int(request.META.get('CONTENT_LENGTH') or 0),
+                'response_bytes': None if response.streaming else len(response.content),
+                'query_count': sql_log.count,
+                'db_ms': round(sql_log.db_time * 1000, 3),
+                'queries': sql_log.queries,
+                'sample_interval_ms': config['SAMPLE_INTERVAL_MS'],
+                'samples': sampler.samples,
+                'stacks': dict(sampler.stacks.most_common()),
+            })
+        return response
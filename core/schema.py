@@ -0,0 +1,114 @@
+"""OpenAPI schema generated once per code version.
+
+`CachedSpectacularAPIView` renders the schema the first time a given format
+is requested and keeps the bytes in process memory. It also writes them to
+`SCHEMA_CACHE_DIR`, so other workers and restarts of the same release skip
+generation. `manage.py build_schema` pre-renders every format at deploy time.
+Responses carry a strong ETag and answer `If-None-Match` with 304.
+
+The cache key is the code version: `SCHEMA_CODE_VERSION` if set (e.g. a
+release tag or git SHA), otherwise a hash of the project's Python sources and
+installed DRF/drf-spectacular versions.
+"""
+import hashlib
+import threading
+from functools import lru_cache
+from importlib import import_module
+from pathlib import Path
+import rest_framework
+import drf_spectacular
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import quote_etag
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SCHEMA_KWARGS, SpectacularAPIView
+from .docs import apply_deferred
+
+SOURCE_PACKAGES = ('config', 'core')
+
+_rendered = {}
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    if settings.SCHEMA_CODE_VERSION:
+        return settings.SCHEMA_CODE_VERSION
+    digest = hashlib.sha256()
+    digest.update(f'{rest_framework.VERSION}:{drf_spectacular.__version__}'.encode())
+    digest.update(repr(sorted(settings.SPECTACULAR_SETTINGS.items())).encode())
+    base = Path(settings.BASE_DIR)
+    for package in SOURCE_PACKAGES:
+        for path in sorted((base / package).rglob('*.py')):
+            if 'migrations' in path.parts or 'tests' in path.stem:
+                continue
+            digest.update(str(path.relative_to(base)).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def cache_file(key):
+    version, media_type, lang, api_version = key
+    name = hashlib.sha256(f'{media_type}|{lang}|{api_version}'.encode()).hexdigest()[:16]
+    return Path(settings.SCHEMA_CACHE_DIR) / version / name
+
+
+def clear_memory_cache():
+    with _lock:
+        _rendered.clear()
+    code_version.cache_clear()
+
+
+class CachedSpectacularAPIView(SpectacularAPIView):
+
+    @extend_schema(**SCHEMA_KWARGS)
+    def get(self, request, *args, **kwargs):
+        key = (
+            code_version(),
+            request.accepted_media_type,
+            request.GET.get('lang', ''),
+            request.GET.get('version', ''),
+        )
+        cached = _rendered.get(key) or self.load(key) or self.generate(key, request, *args, **kwargs)
+        content, content_type, etag = cached
+
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+        return response
+
+    def load(self, key):
+        path = cache_file(key)
+        if not path.exists():
+            return None
+        content = path.read_bytes()
+        content_type = path.with_suffix('.type').read_text()
+        return self.remember(key, content, content_type)
+
+    def generate(self, key, request, *args, **kwargs):
+        # deferred annotations are recorded while the URLconf imports the views
+        import_module(settings.ROOT_URLCONF)
+        apply_deferred()
+        response = super().get(request, *args, **kwargs)
+        response.accepted_renderer = request.accepted_renderer
+        response.accepted_media_type = request.accepted_media_type
+        response.renderer_context = self.get_renderer_context()
+        response.render()
+        content_type = response['Content-Type']
+
+        path = cache_file(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        tmp.write_bytes(response.content)
+        path.with_suffix('.type').write_text(content_type)
+        tmp.replace(path)
+        return self.remember(key, response.content, content_type)
+
+    def remember(self, key, content, content_type):
+        entry = (content, content_type, quote_etag(hashlib.sha256(content).hexdigest()[:32]))
+        with _lock:
+            _rendered[key] = entry
+        return entry
@@ -0,0 +1,166 @@
+"""Full-text search over `Event.observation`.
+
+The index lives in the database and is maintained by the database itself, so
+every write path (viewsets, `sync/upload`, bulk inserts, raw updates) keeps it
+current without application hooks:
+
+* SQLite: an FTS5 table fed by triggers on the event and animal tables. FTS
+  rows are keyed by a small integer doc table because `core_event` has a UUID
+  primary key and its implicit rowid is not stable across VACUUM. Each row
+  also holds its owner as a token (`owner` column, `u<user id>`), and queries
+  match it together with the terms, so FTS5 intersects the term's postings
+  with the user's instead of matching every user's documents.
+* PostgreSQL: a GIN index on `to_tsvector(...)` of the column. Queries use
+  the indexed expression verbatim so the planner answers the match from the
+  index, and the owner condition filters alongside it (the planner can also
+  start from the user's pets when they are the smaller side).
+
+Other backends fall back to an unindexed `icontains` scan.
+"""
+import re
+from django.db import connections, router
+from .models import Event
+
+TS_CONFIG = 'simple'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _animal_table():
+    return Event._meta.get_field('animal').related_model._meta.db_table
+
+
+def _sqlite_outdated(cursor):
+    """Drop an FTS table (and its triggers) built before rows carried their owner."""
+    event = Event._meta.db_table
+    cursor.execute(f"PRAGMA table_info({event}_fts)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if not columns or 'owner' in columns:
+        return
+    for trigger in ('insert', 'update'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {event}_fts_{trigger}")
+    # the backfill below re-indexes every document
+    cursor.execute(f"DROP TABLE {event}_fts")
+
+
+def _sqlite_statements():
+    event = Event._meta.db_table
+    animal = _animal_table()
+    return [
+        f"""CREATE TABLE IF NOT EXISTS {event}_fts_doc (
+            docid INTEGER PRIMARY KEY,
+            event_id char(32) NOT NULL UNIQUE
+        )""",
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {event}_fts USING fts5(
+            observation, owner, tokenize = 'unicode61 remove_diacritics 2'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {event}_fts_insert AFTER INSERT ON {event} BEGIN
+            INSERT INTO {event}_fts_doc (event_id) SELECT new.id WHERE COALESCE(new.observation, '') != '';
+            INSERT INTO {event}_fts (rowid, observation, owner)
+                SELECT d.docid, new.observation, 'u' || a.user_id FROM {event}_fts_doc d
+                JOIN {animal} a ON a.id = new.animal_id WHERE d.event_id = new.id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {event}_fts_delete AFTER DELETE ON {event} BEGIN
+            DELETE FROM {event}_fts WHERE rowid = (SELECT docid FROM {event}_fts_doc WHERE event_id = old.id);
+            DELETE FROM {event}_fts_doc WHERE event_id = old.id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {event}_fts_update
+        AFTER UPDATE OF id, observation, animal_id ON {event} BEGIN
+            DELETE FROM {event}_fts WHERE rowid = (SELECT docid FROM {event}_fts_doc WHERE event_id = old.id);
+            DELETE FROM {event}_fts_doc WHERE event_id = old.id;
+            INSERT INTO {event}_fts_doc (event_id) SELECT new.id WHERE COALESCE(new.observation, '') != '';
+            INSERT INTO {event}_fts (rowid, observation, owner)
+                SELECT d.docid, new.observation, 'u' || a.user_id FROM {event}_fts_doc d
+                JOIN {animal} a ON a.id = new.animal_id WHERE d.event_id = new.id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {event}_fts_owner AFTER UPDATE OF user_id ON {animal} BEGIN
+            UPDATE {event}_fts SET owner = 'u' || new.user_id WHERE rowid IN (
+                SELECT d.docid FROM {event}_fts_doc d JOIN {event} e ON e.id = d.event_id
+                WHERE e.animal_id = new.id
+            );
+        END""",
+        # backfill rows written before the triggers existed
+        f"""INSERT INTO {event}_fts_doc (event_id)
+            SELECT e.id FROM {event} e
+            WHERE COALESCE(e.observation, '') != ''
+              AND NOT EXISTS (SELECT 1 FROM {event}_fts_doc d WHERE d.event_id = e.id)""",
+        f"""INSERT INTO {event}_fts (rowid, observation, owner)
+            SELECT d.docid, e.observation, 'u' || a.user_id FROM {event}_fts_doc d
+            JOIN {event} e ON e.id = d.event_id JOIN {animal} a ON a.id = e.animal_id
+            WHERE NOT EXISTS (SELECT 1 FROM {event}_fts f WHERE f.rowid = d.docid)""",
+    ]
+
+
+def _postgresql_statements():
+    event = Event._meta.db_table
+    return [
+        f"""CREATE INDEX IF NOT EXISTS {event}_observation_fts ON {event}
+            USING GIN (to_tsvector('{TS_CONFIG}', COALESCE(observation, '')))""",
+    ]
+
+
+def install_search_index(using='default'):
+    connection = connections[using]
+    statements = {
+        'sqlite': _sqlite_statements,
+        'postgresql': _postgresql_statements,
+    }.get(connection.vendor)
+    if statements is None:
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            _sqlite_outdated(cursor)
+        for sql in statements():
+            cursor.execute(sql)
+
+
+def search_events(user, query, limit, offset=0, using=None):
+    """Return the user's events matching `query`, best match first.
+
+    All terms must match; the last one is treated as a prefix so results
+    follow the user while typing.
+    """
+    tokens = TOKEN_RE.findall(query)
+    if not tokens:
+        return []
+
+    using = using or router.db_for_read(Event)
+    connection = connections[using]
+    event = Event._meta.db_table
+    animal = _animal_table()
+    if connection.vendor == 'sqlite':
+        terms = ' '.join(f'"{token}"' for token in tokens) + '*'
+        match = f'owner : "u{user.pk}" AND observation : ({terms})'
+        sql = f"""
+            SELECT d.event_id FROM {event}_fts f
+            JOIN {event}_fts_doc d ON d.docid = f.rowid
+            JOIN {event} e ON e.id = d.event_id
+            WHERE {event}_fts MATCH %s
+            ORDER BY bm25({event}_fts, 1.0, 0.0), e.date DESC
+            LIMIT %s OFFSET %s
+        """
+        params = [match, limit, offset]
+    elif connection.vendor == 'postgresql':
+        match = ' & '.join(tokens) + ':*'
+        # the same expression as the GIN index, so the match is an index scan
+        vector = f"to_tsvector('{TS_CONFIG}', COALESCE(e.observation, ''))"
+        sql = f"""
+            SELECT e.id FROM {event} e
+            JOIN {animal} a ON a.id = e.animal_id
+            WHERE {vector} @@ to_tsquery('{TS_CONFIG}', %s) AND a.user_id = %s
+            ORDER BY ts_rank({vector}, to_tsquery('{TS_CONFIG}', %s)) DESC, e.date DESC
+            LIMIT %s OFFSET %s
+        """
+        params = [match, user.pk, match, limit, offset]
+    else:
+        events = Event.objects.using(using).filter(animal__user=user)
+        for token in tokens:
+            events = events.filter(observation__icontains=token)
+        return list(events.order_by('-date')[offset:offset + limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [row[0] for row in cursor.fetchall()]
+
+    ids = [Event._meta.pk.to_python(value) for value in ids]
+    events = Event.objects.using(using).in_bulk(ids)
+    return [events[pk] for pk in ids if pk in events]
@@ -1,24 +1,30 @@
+from datetime import date
+from django.conf import settings
+from django.utils.timezone import now
 from rest_framework import serializers
-from .models import Animal,Vaccine,Event
+from .export import FORMATS
+from .instrumentation import TimedSerializerMixin
+from .models import Animal,Vaccine,Event,Tombstone,AnimalStats
+from .stats import last_vet_visit, next_dose_date, vaccines_overdue
 
-class VaccineSerializer(serializers.ModelSerializer):
+class VaccineSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Vaccine
-        fields = '__all__'
+        exclude = ['field_updated_at', 'content_hash']
 
 
-class EventSerializer(serializers.ModelSerializer):
+class EventSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Event
-        fields = '__all__'
+        exclude = ['field_updated_at', 'content_hash']
 
 
-class AnimalSerializer(serializers.ModelSerializer):
+class AnimalSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     events = EventSerializer(many=True, read_only=True)
     vaccines = VaccineSerializer(many=True, read_only=True)
     class Meta:
         model = Animal
-        exclude = ['user']
+        exclude = ['user', 'field_updated_at', 'content_hash']
     
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
@@ -28,11 +34,73 @@ class AnimalSerializer(serializers.ModelSerializer):
         validated_data.pop('user', None)
         return super().update(instance, validated_data)
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if self.context.get('include_archived'):
+            # archived rows serialize like the hot ones (core/archive.py)
+            data['events'].extend(EventSerializer(instance.archived_events.all(), many=True).data)
+            data['vaccines'].extend(VaccineSerializer(instance.archived_vaccines.all(), many=True).data)
+        return data
+
+class AnimalStatsSerializer(serializers.ModelSerializer):
+    animal = serializers.UUIDField(source='animal_id')
+    event_count = serializers.SerializerMethodField(help_text="Total de eventos, arquivados inclusive")
+    last_vet_visit = serializers.SerializerMethodField(help_text="Data do último evento de consulta veterinária")
+    vaccines_overdue = serializers.SerializerMethodField(help_text="Vacinas com a próxima dose já vencida")
+    next_dose_date = serializers.SerializerMethodField(help_text="Próxima dose a partir de hoje")
+
+    class Meta:
+        model = AnimalStats
+        fields = ['animal', 'event_count', 'event_counts', 'last_event_dates', 'last_vet_visit',
+                  'vaccine_count', 'vaccines_overdue', 'next_dose_date', 'updated_at']
+
+    def get_event_count(self, obj) -> int:
+        return sum(obj.event_counts.values())
+
+    def get_last_vet_visit(self, obj) -> date | None:
+        return last_vet_visit(obj)
+
+    def get_vaccines_overdue(self, obj) -> int:
+        return vaccines_overdue(obj, now().date())
+
+    def get_next_dose_date(self, obj) -> date | None:
+        return next_dose_date(obj, now().date())
+
+
+class VaccineDueQuerySerializer(serializers.Serializer):
+    days = serializers.IntegerField(
+        min_value=0,
+        required=False,
+        help_text="Quantidade de dias à frente a considerar",
+    )
+
+    def validate_days(self, value):
+        if value > settings.VACCINE_DUE_MAX_DAYS:
+            raise serializers.ValidationError(f"O máximo permitido é {settings.VACCINE_DUE_MAX_DAYS} dias.")
+        return value
+
+
+class EventSearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(help_text="Termos buscados nas observações dos eventos")
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    offset = serializers.IntegerField(min_value=0, default=0)
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    data_format = serializers.ChoiceField(choices=FORMATS, default='csv',
+                                          help_text="Formato dos arquivos dentro do ZIP")
+
+
+class ArchiveQuerySerializer(serializers.Serializer):
+    include_archived = serializers.BooleanField(default=False,
+                                                help_text="Inclui eventos e vacinas arquivados")
+
+
 class EventUploadSerializer(serializers.Serializer):
     id = serializers.UUIDField()
     type = serializers.CharField()
     date = serializers.DateField()
-    observation = serializers.CharField(allow_blank=True, required=False)
+    observation = serializers.CharField(allow_blank=True, allow_null=True, required=False)
     updated_at = serializers.DateTimeField()
 
 
@@ -40,7 +108,7 @@ class VaccineUploadSerializer(serializers.Serializer):
     id = serializers.UUIDField()
     name = serializers.CharField()
     application_date = serializers.DateField()
-    next_dose_date = serializers.DateField(required=False)
+    next_dose_date = serializers.DateField(allow_null=True, required=False)
     updated_at = serializers.DateTimeField()
 
 
@@ -54,15 +122,148 @@ class AnimalUploadSerializer(serializers.Serializer):
     events = EventUploadSerializer(many=True, required=False)
     vaccines = VaccineUploadSerializer(many=True, required=False)
 
+class EventImportSerializer(EventUploadSerializer):
+    animal = serializers.UUIDField()
+
+
+class VaccineImportSerializer(VaccineUploadSerializer):
+    animal = serializers.UUIDField()
+
+
 class SyncUploadRequestSerializer(serializers.Serializer):
     pets = AnimalUploadSerializer(many=True)
 
+
+class SyncUploadResponseSerializer(serializers.Serializer):
+    created = serializers.IntegerField()
+    updated = serializers.IntegerField()
+    skipped = serializers.IntegerField(help_text="Registros com `updated_at` mais recente mas conteúdo idêntico; não regravados")
+    outdated = serializers.IntegerField(help_text="Registros com `updated_at` mais antigo que o do servidor")
+
+
+class FieldChangeSerializer(serializers.Serializer):
+    value = serializers.JSONField(allow_null=True)
+    updated_at = serializers.DateTimeField()
+
+
+class PatchRecordSerializer(serializers.Serializer):
+    """One record of a patch upload: only the changed fields, each with its own timestamp.
+
+    Values are validated with the matching whole-record upload serializer, so both
+    formats accept the same data. `validated_data['changes']` maps field name to
+    `(value, updated_at)`.
+    """
+    upload_serializer_class = None
+    id = serializers.UUIDField()
+    changes = serializers.DictField(child=FieldChangeSerializer(), default=dict)
+
+    @classmethod
+    def patchable_fields(cls):
+        fields = cls.upload_serializer_class().fields
+        return {name: field for name, field in fields.items()
+                if name not in ('id', 'updated_at', 'events', 'vaccines')}
+
+    @classmethod
+    def required_fields(cls):
+        return {name for name, field in cls.patchable_fields().items() if field.required}
+
+    def validate_changes(self, changes):
+        unknown = set(changes) - set(self.patchable_fields())
+        if unknown:
+            raise serializers.ValidationError(f"Campos desconhecidos: {', '.join(sorted(unknown))}.")
+        values = self.upload_serializer_class(
+            data={name: change['value'] for name, change in changes.items()}, partial=True
+        )
+        values.is_valid(raise_exception=True)
+        return {name: (values.validated_data.get(name), change['updated_at']) for name, change in changes.items()}
+
+
+class EventPatchSerializer(PatchRecordSerializer):
+    upload_serializer_class = EventUploadSerializer
+
+
+class VaccinePatchSerializer(PatchRecordSerializer):
+    upload_serializer_class = VaccineUploadSerializer
+
+
+class AnimalPatchSerializer(PatchRecordSerializer):
+    upload_serializer_class = AnimalUploadSerializer
+    events = EventPatchSerializer(many=True, required=False)
+    vaccines = VaccinePatchSerializer(many=True, required=False)
+
+
+class SyncPatchRequestSerializer(serializers.Serializer):
+    pets = AnimalPatchSerializer(many=True)
+
+
+class SyncPatchResponseSerializer(serializers.Serializer):
+    created = serializers.IntegerField()
+    updated = serializers.IntegerField()
+    ignored = serializers.IntegerField(help_text="Registros em que todas as alterações eram mais antigas que as do servidor")
+
 class SyncDownloadRequestSerializer(serializers.Serializer):
     last_synced_at = serializers.DateTimeField(
         required=False,
         help_text="Timestamp da última sincronização feita pelo app",
     )
+    include_archived = serializers.BooleanField(
+        default=False,
+        help_text="Inclui eventos e vacinas arquivados no download completo",
+    )
+
+class TombstoneSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    id = serializers.UUIDField(source='object_id')
+    class Meta:
+        model = Tombstone
+        fields = ['id', 'model', 'deleted_at']
 
-class SyncDownloadResponseSerializer(serializers.Serializer):
+
+class SyncDownloadResponseSerializer(TimedSerializerMixin, serializers.Serializer):
     pets = AnimalSerializer(many=True)
-    synced_at = serializers.DateTimeField()
\ No newline at end of file
+    deleted = TombstoneSerializer(many=True)
+    full_sync = serializers.BooleanField()
+    synced_at = serializers.DateTimeField()
+
+class SyncReconcileRequestSerializer(serializers.Serializer):
+    prefix = serializers.RegexField(r'^[0-9a-f]?$', required=False, allow_blank=True, default='',
+                                    help_text="Nó da árvore: vazio para a raiz ou um dígito hexadecimal")
+    buckets = serializers.ListField(
+        child=serializers.RegexField(r'^[0-9a-f]{2}$'), required=False, allow_empty=False,
+        help_text="Buckets (dois dígitos hexadecimais) cujos registros devem ser listados",
+    )
+
+    def validate_buckets(self, value):
+        limit = settings.SYNC_RECONCILE_MAX_BUCKETS
+        if len(value) > limit:
+            raise serializers.ValidationError(f"No máximo {limit} buckets por requisição.")
+        return value
+
+
+class SyncLeafSerializer(serializers.Serializer):
+    model = serializers.CharField()
+    id = serializers.UUIDField()
+    updated_at = serializers.DateTimeField()
+
+
+class SyncBucketLeavesSerializer(serializers.Serializer):
+    buckets = serializers.DictField(child=SyncLeafSerializer(many=True))
+
+
+class BatchSubRequestSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'], default='GET')
+    path = serializers.CharField(help_text="Rota relativa à API, ex.: `/api/animals/`")
+    body = serializers.JSONField(required=False)
+
+
+class BatchRequestSerializer(serializers.Serializer):
+    requests = BatchSubRequestSerializer(many=True, allow_empty=False)
+    atomic = serializers.BooleanField(
+        default=False,
+        help_text="Executa todas as sub-requisições em uma única transação",
+    )
+
+    def validate_requests(self, value):
+        limit = settings.BATCH_MAX_REQUESTS
+        if len(value) > limit:
+            raise serializers.ValidationError(f"No máximo {limit} sub-requisições por lote.")
+        return value
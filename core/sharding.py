@@ -0,0 +1,268 @@
+"""User-sharded storage.
+
+Everything in `core` except the shard directory belongs to exactly one user,
+so a user's pets, events, vaccines and sync bookkeeping can live together on
+one database. Users, tokens and the `UserShard` directory stay on 'default'.
+DATABASE_SHARDS lists the shard aliases; when it is empty (the default) all
+of this is inert and every query goes to 'default'.
+
+* A user is placed on first use by rendezvous hashing over DATABASE_SHARDS and
+  the choice is stored in `UserShard`. Adding a shard therefore moves nobody
+  by itself; `manage.py rebalance_shards` moves the users whose hash now
+  prefers the new shard (about 1/N of them), or a given user to a given shard.
+* The active shard is a context variable. `ShardedViewMixin` sets it once the
+  request is authenticated, and `ShardRouter` sends queries on sharded models
+  there. Code outside requests uses `use_shard` / `user_shard`.
+* `atomic` is `transaction.atomic` on the active shard, resolved when the block
+  is entered rather than at import time.
+
+Moves are online: the user is flagged `moving` (their writes get 503 while
+reads continue), rows are copied in batches to the target,
+the directory entry is flipped and the source rows are removed. Where
+'default' has row locks (PostgreSQL), write requests fence themselves
+against a move: each one locks its user's directory row in a transaction on
+'default' that stays open until the request is done, and reads the entry
+only under that lock. Flagging a user therefore waits for the writes already
+in flight, and every later write sees the flag, so nothing lands on the
+source once the copy starts.
+On SQLite the only lock is the whole database, so holding it for a request
+would serialize every user's writes; there, writes just check the flag. A
+write that read the entry right before the user was flagged can still land
+on the source during the copy, so on SQLite move users while they are not
+syncing (or the API is stopped).
+Writes from outside requests (management commands) are not fenced; don't
+run them for a user who is being moved.
+"""
+import hashlib
+from contextlib import ContextDecorator, contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import F
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+from .models import (Animal, AnimalStats, ArchivedEvent, ArchivedVaccine, Event, Vaccine, VaccineReminder, Tombstone,
+                     SyncBucket, SyncSnapshot, UserShard)
+
+# every user-owned model with the lookup to its owner, parents before children
+SHARDED_MODELS = (
+    (Animal, 'user'),
+    (Event, 'animal__user'),
+    (Vaccine, 'animal__user'),
+    (ArchivedEvent, 'animal__user'),
+    (ArchivedVaccine, 'animal__user'),
+    (AnimalStats, 'animal__user'),
+    (VaccineReminder, 'user'),
+    (Tombstone, 'user'),
+    (SyncBucket, 'user'),
+    (SyncSnapshot, 'user'),
+)
+
+_active = ContextVar('active_shard', default=None)
+
+
+def is_sharded(model):
+    return any(model is sharded for sharded, _ in SHARDED_MODELS)
+
+
+def aliases():
+    return list(settings.DATABASE_SHARDS) or [DEFAULT_DB_ALIAS]
+
+
+def active_alias():
+    return _active.get() or DEFAULT_DB_ALIAS
+
+
+def pick_shard(user_id, candidates=None):
+    """Rendezvous (highest random weight) hash of the user over the shard aliases."""
+    return max(candidates or aliases(),
+               key=lambda alias: hashlib.sha256(f'{alias}:{user_id}'.encode()).digest())
+
+
+def directory_entry(user_id):
+    entry = UserShard.objects.filter(user_id=user_id).first()
+    if entry is None:
+        entry, _ = UserShard.objects.get_or_create(user_id=user_id, defaults={'alias': pick_shard(user_id)})
+    return entry
+
+
+def shard_for_user(user_id):
+    if not settings.DATABASE_SHARDS:
+        return DEFAULT_DB_ALIAS
+    return directory_entry(user_id).alias
+
+
+def group_by_shard(user_ids):
+    """{alias: [user ids]} for a batch of users."""
+    if not settings.DATABASE_SHARDS:
+        return {DEFAULT_DB_ALIAS: list(user_ids)}
+    groups = {}
+    for user_id in user_ids:
+        groups.setdefault(shard_for_user(user_id), []).append(user_id)
+    return groups
+
+
+@contextmanager
+def use_shard(alias):
+    token = _active.set(alias)
+    try:
+        yield alias
+    finally:
+        _active.reset(token)
+
+
+def user_shard(user_id):
+    return use_shard(shard_for_user(user_id))
+
+
+class atomic(ContextDecorator):
+    """`transaction.atomic` on the shard active when the block is entered."""
+
+    def __init__(self, savepoint=True):
+        self.savepoint = savepoint
+
+    def _recreate_cm(self):
+        # one instance per decorated call, so concurrent calls don't share `block`
+        return type(self)(self.savepoint)
+
+    def __enter__(self):
+        self.block = transaction.atomic(using=active_alias(), savepoint=self.savepoint)
+        return self.block.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.block.__exit__(*exc_info)
+
+
+class ShardRouter:
+    """Sends sharded models to the active shard and everything else to 'default'."""
+
+    def db_for_read(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and is_sharded(type(instance)) and instance._state.db:
+            return instance._state.db
+        return active_alias()
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # owner keys cross from a shard to the users on 'default'
+        if is_sharded(type(obj1)) != is_sharded(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in settings.DATABASE_SHARDS:
+            return None
+        return app_label == 'core' and model_name is not None and any(
+            model._meta.model_name == model_name for model, _ in SHARDED_MODELS
+        )
+
+
+class ShardMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Os dados desta conta estão sendo migrados. Tente novamente em instantes."
+    default_code = 'shard_moving'
+
+
+def fences_writes():
+    """Whether write requests hold their directory row (see the module docstring)."""
+    return connections[DEFAULT_DB_ALIAS].features.has_select_for_update
+
+
+class ShardedViewMixin:
+    """Routes the view's queries to the authenticated user's shard.
+
+    Views that only read set `shard_read_only` so they keep working while the
+    user is being moved; other views refuse unsafe methods during a move, and
+    where the database has row locks hold the user's directory row for the
+    whole request (the move fence).
+    """
+    shard_read_only = False
+
+    def writes(self, request):
+        return not self.shard_read_only and request.method not in SAFE_METHODS
+
+    def dispatch(self, request, *args, **kwargs):
+        token = _active.set(None)
+        try:
+            if settings.DATABASE_SHARDS and self.writes(request) and fences_writes():
+                with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                    return super().dispatch(request, *args, **kwargs)
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _active.reset(token)
+
+    def perform_authentication(self, request):
+        super().perform_authentication(request)
+        if not settings.DATABASE_SHARDS or not request.user.is_authenticated:
+            return
+        writes = self.writes(request)
+        if writes and fences_writes():
+            # lock first, read after: a move flagged before this commits waits for the request
+            UserShard.objects.filter(user_id=request.user.pk).update(moving=F('moving'))
+        entry = directory_entry(request.user.pk)
+        if entry.moving and writes:
+            raise ShardMoving()
+        _active.set(entry.alias)
+
+
+# -- moving users --------------------------------------------------------------
+
+def purge_user(user_id, alias):
+    """Delete everything the user owns on `alias`."""
+    from .merkle import batched
+
+    with use_shard(alias), atomic():
+        with batched():
+            for model, lookup in SHARDED_MODELS:
+                if model is not SyncBucket:
+                    model.objects.filter(**{lookup: user_id}).delete()
+        # last, once the deletes above have settled their bucket deltas
+        SyncBucket.objects.filter(user_id=user_id).delete()
+
+
+def copy_user(user_id, source, target, batch_size=1000):
+    copied = 0
+    for model, lookup in SHARDED_MODELS:
+        rows = model.objects.using(source).filter(**{lookup: user_id}).order_by('pk')
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) == batch_size:
+                model.objects.using(target).bulk_create(batch)
+                copied += len(batch)
+                batch = []
+        model.objects.using(target).bulk_create(batch)
+        copied += len(batch)
+    return copied
+
+
+def move_user(user_id, target, batch_size=1000):
+    """Move the user's rows to `target`; returns the number of rows copied."""
+    entry = directory_entry(user_id)
+    source = entry.alias
+    if source == target:
+        return 0
+    # blocks until the write requests holding the entry (ShardedViewMixin) are done
+    UserShard.objects.filter(pk=entry.pk).update(moving=True)
+    try:
+        # leftovers of an interrupted move
+        purge_user(user_id, target)
+        with transaction.atomic(using=target):
+            copied = copy_user(user_id, source, target, batch_size)
+        UserShard.objects.filter(pk=entry.pk).update(alias=target, moving=False)
+    except BaseException:
+        UserShard.objects.filter(pk=entry.pk).update(moving=False)
+        raise
+    purge_user(user_id, source)
+    return copied
+
+
+def purge_deleted_user(sender, instance, **kwargs):
+    """pre_delete(User): the cascade only sees 'default', so clear the user's shard explicitly."""
+    entry = UserShard.objects.filter(user_id=instance.pk).first()
+    if entry is not None:
+        purge_user(instance.pk, entry.alias)
@@ -0,0 +1,144 @@
+"""Prebuilt first-sync bundles.
+
+A full `sync/download` serializes the user's whole tree on every new device.
+For users with a long history, `manage.py build_sync_snapshots` renders that
+same response ahead of time into a gzip file under SYNC_SNAPSHOTS['DIRECTORY'].
+The SyncSnapshot row records the cursor the file was built at, which is its
+`synced_at`. A full download that accepts gzip is then answered with the file
+as-is, with `Content-Encoding: gzip`. The file goes out through FileResponse
+(sendfile via wsgi.file_wrapper) or an X-Accel-Redirect. The client stores
+`synced_at` as usual, so its next delta download catches up on everything
+written since the build.
+
+Uploads and patches keep the device's `updated_at`, so an edit made offline
+can land after the build stamped earlier than the cursor, and a delta from the
+cursor would never send it. Every write through the API therefore drops the
+user's snapshot (SnapshotInvalidationMixin) and the next first sync is live.
+"""
+import gzip
+import os
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count
+from django.http import FileResponse, HttpResponse
+from django.utils.timezone import now
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.renderers import JSONRenderer
+from .models import Animal, Event, Vaccine, SyncSnapshot
+from .serializers import SyncDownloadResponseSerializer
+from .sharding import aliases, user_shard
+
+
+def snapshot_directory():
+    return Path(settings.SYNC_SNAPSHOTS['DIRECTORY'])
+
+
+def users_due(min_records):
+    """Ids of users owning at least `min_records` pets, events and vaccines combined."""
+    totals = Counter()
+    for alias in aliases():
+        totals.update(dict(Animal.objects.using(alias).values_list('user').annotate(n=Count('id'))))
+        for model in (Event, Vaccine):
+            totals.update(dict(model.objects.using(alias).values_list('animal__user').annotate(n=Count('id'))))
+    return sorted(user_id for user_id, total in totals.items() if total >= min_records)
+
+
+def build_snapshot(user):
+    # taken before reading, like SyncDownloadView, so rows written during the
+    # build are newer than the cursor and reach the client in its next delta
+    cursor = now()
+    pets = list(Animal.objects.filter(user=user).prefetch_related('events', 'vaccines'))
+    data = SyncDownloadResponseSerializer({
+        'pets': pets,
+        'deleted': [],
+        'full_sync': True,
+        'synced_at': cursor,
+    }).data
+    body = gzip.compress(JSONRenderer().render(data), mtime=0)
+
+    directory = snapshot_directory()
+    directory.mkdir(parents=True, exist_ok=True)
+    file_name = f'{user.pk}-{int(cursor.timestamp() * 1000)}.json.gz'
+    tmp = directory / f'{file_name}.tmp'
+    tmp.write_bytes(body)
+    os.replace(tmp, directory / file_name)
+
+    previous = SyncSnapshot.objects.filter(user=user).values_list('file_name', flat=True).first()
+    snapshot, _ = SyncSnapshot.objects.update_or_create(user=user, defaults={
+        'file_name': file_name,
+        'cursor': cursor,
+        'records': len(pets) + sum(len(pet.events.all()) + len(pet.vaccines.all()) for pet in pets),
+        'size': len(body),
+        'built_at': now(),
+    })
+    if previous and previous != file_name:
+        (directory / previous).unlink(missing_ok=True)
+    return snapshot
+
+
+def build_snapshots(user_ids):
+    snapshots = []
+    for user in get_user_model().objects.filter(id__in=user_ids).iterator():
+        with user_shard(user.pk):
+            snapshots.append(build_snapshot(user))
+    return snapshots
+
+
+def remove_stale(user_ids):
+    """Drop snapshots of users that no longer qualify, with their files."""
+    removed = 0
+    for alias in aliases():
+        stale = SyncSnapshot.objects.using(alias).exclude(user_id__in=user_ids)
+        for file_name in stale.values_list('file_name', flat=True):
+            (snapshot_directory() / file_name).unlink(missing_ok=True)
+        removed += stale.delete()[0]
+    return removed
+
+
+def discard_snapshot(user):
+    """Drop the user's snapshot, for writes its cursor can't account for (see core/importer.py)."""
+    file_names = list(SyncSnapshot.objects.filter(user=user).values_list('file_name', flat=True))
+    if not file_names:
+        return
+    for file_name in file_names:
+        (snapshot_directory() / file_name).unlink(missing_ok=True)
+    SyncSnapshot.objects.filter(user=user).delete()
+
+
+class SnapshotInvalidationMixin:
+    """Drops the caller's snapshot once a write to its data succeeds."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in SAFE_METHODS and status.is_success(response.status_code):
+            discard_snapshot(request.user)
+        return response
+
+
+def snapshot_response(request):
+    """The user's snapshot as a gzip response, or None to fall back to a live download."""
+    if 'gzip' not in request.headers.get('Accept-Encoding', ''):
+        return None
+    max_age = timedelta(hours=settings.SYNC_SNAPSHOTS['MAX_AGE_HOURS'])
+    snapshot = SyncSnapshot.objects.filter(user=request.user, cursor__gte=now() - max_age).first()
+    if snapshot is None:
+        return None
+
+    prefix = settings.SYNC_SNAPSHOTS['ACCEL_REDIRECT_PREFIX']
+    if prefix:
+        response = HttpResponse(content_type='application/json')
+        response['X-Accel-Redirect'] = f'{prefix}{snapshot.file_name}'
+    else:
+        try:
+            handle = open(snapshot_directory() / snapshot.file_name, 'rb')
+        except FileNotFoundError:
+            return None
+        response = FileResponse(handle, content_type='application/json')
+    response['Content-Encoding'] = 'gzip'
+    response['Vary'] = 'Accept-Encoding'
+    response['X-Sync-Snapshot'] = snapshot.cursor.isoformat()
+    return response
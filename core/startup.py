@@ -0,0 +1,71 @@
+"""Worker boot measurement.
+
+`measure_boot` starts a fresh interpreter with `python -X importtime`, boots
+the project the way a WSGI worker does before its first request (settings,
+app registry, WSGI handler, URLconf) and returns the wall time together with
+the installed apps and the per-module import breakdown. Used by
+`manage.py importtime` (which also checks WORKER_BOOT_BUDGET_MS) and by the
+tests of what the lean profile leaves out.
+"""
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from django.conf import settings
+
+BOOT_SCRIPT = (
+    "import json, time\n"
+    "start = time.perf_counter()\n"
+    "from config.wsgi import application\n"
+    "from django.urls import get_resolver\n"
+    "get_resolver().url_patterns\n"
+    "wall_ms = (time.perf_counter() - start) * 1000\n"
+    "from django.apps import apps\n"
+    "print(json.dumps({'wall_ms': wall_ms, 'apps': [app.name for app in apps.get_app_configs()]}))\n"
+)
+
+
+def parse_importtime(output):
+    """Rows of `-X importtime` stderr as dicts, in the order Python printed them."""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append({
+            'module': name.strip(),
+            'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+            'self_ms': int(self_us) / 1000,
+            'cumulative_ms': int(cumulative_us) / 1000,
+        })
+    return modules
+
+
+def by_package(modules):
+    totals = defaultdict(float)
+    for row in modules:
+        totals[row['module'].split('.')[0]] += row['self_ms']
+    return sorted(({'package': name, 'self_ms': total} for name, total in totals.items()),
+                  key=lambda row: row['self_ms'], reverse=True)
+
+
+def measure_boot(profile=None):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='config.settings')
+    if profile:
+        env['DJANGO_STARTUP_PROFILE'] = profile
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Worker boot failed:\n{result.stderr[-2000:]}")
+    modules = parse_importtime(result.stderr)
+    boot = json.loads(result.stdout.splitlines()[-1])
+    return {
+        'profile': env.get('DJANGO_STARTUP_PROFILE', 'full'),
+        'wall_ms': boot['wall_ms'],
+        'apps': boot['apps'],
+        'imported_ms': sum(row['self_ms'] for row in modules),
+        'modules': modules,
+    }
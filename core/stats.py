@@ -0,0 +1,243 @@
+"""Per-pet statistics for dashboards.
+
+AnimalStats keeps, for each pet and over its whole history (archived rows
+included), the number of events and the latest event date per type, the
+number of vaccines and the latest application of each vaccine (by name) with
+its next dose. The `stats` endpoints derive last vet visit, overdue vaccines
+and next dose from that single row instead of grouping the event and vaccine
+tables.
+
+Rows are maintained incrementally like the sync buckets (core/merkle.py).
+Model signals, and bulk writes explicitly, record what each row adds or
+removes (`count_write` / `count_delete`), keyed by its STATS_FIELDS. Inside
+`merkle.batched()` the deltas accumulate and are applied when the batch
+flushes, in two queries however many rows were written. Only removing the
+latest event of a type, or the latest dose of a vaccine, costs a lookup for
+the new latest. Pets without a
+row (new, or loaded in bulk) are built from the tables on first use, and
+`manage.py rebuild_animal_stats` repairs drift.
+"""
+import threading
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db.models import Count, F, Max
+from django.utils.timezone import now
+from .merkle import BATCH_LISTENERS, in_batch
+from .models import Animal, AnimalStats, ArchivedEvent, ArchivedVaccine, Event, Vaccine
+from .sharding import atomic
+
+EVENT_MODELS = (Event, ArchivedEvent)
+VACCINE_MODELS = (Vaccine, ArchivedVaccine)
+
+_state = threading.local()
+
+
+def _pending():
+    if not hasattr(_state, 'events'):
+        _state.events = defaultdict(Counter)  # animal id -> {(type, date): count delta}
+        _state.vaccines = defaultdict(Counter)  # animal id -> {(name, applied, next dose): count delta}
+        _state.stale = set()  # animal ids whose rows must be rebuilt
+        _state.deleting = set()  # animals being deleted; their rows go with them
+    return _state
+
+
+def _add(instance, values, count):
+    state = _pending()
+    animal_id, *key = values
+    if animal_id in state.deleting:
+        return
+    deltas = state.events if isinstance(instance, EVENT_MODELS) else state.vaccines
+    deltas[animal_id][tuple(key)] += count
+
+
+def count_write(instance, created):
+    """Account for a saved or bulk-created event or vaccine."""
+    new = instance.stats_values()
+    old = getattr(instance, '_loaded_stats', None)
+    if created:
+        _add(instance, new, 1)
+    elif old is None:
+        # saved over an existing row without loading it: what it counted for is unknown
+        _pending().stale.add(instance.animal_id)
+    elif old != new:
+        _add(instance, old, -1)
+        _add(instance, new, 1)
+    instance._loaded_stats = new
+    if not in_batch():
+        flush()
+
+
+def count_delete(instance):
+    _add(instance, getattr(instance, '_loaded_stats', None) or instance.stats_values(), -1)
+    if not in_batch():
+        flush()
+
+
+def animal_deleting(instance, done=False):
+    """Around an animal's delete: its cascaded events and vaccines need no accounting."""
+    if done:
+        _pending().deleting.discard(instance.pk)
+    else:
+        _pending().deleting.add(instance.pk)
+
+
+def _dose_order(dose):
+    applied, next_dose = dose
+    return applied, next_dose or ''
+
+
+def _apply(row, events, vaccines):
+    """Apply count deltas to `row`.
+
+    Returns the event types and the vaccine names whose latest date or dose must be looked up.
+    """
+    recheck, recheck_doses = set(), set()
+    for (event_type, day), count in (events or {}).items():
+        if not count:
+            continue
+        total = row.event_counts.get(event_type, 0) + count
+        last = row.last_event_dates.get(event_type)
+        if total <= 0:
+            row.event_counts.pop(event_type, None)
+            row.last_event_dates.pop(event_type, None)
+            continue
+        row.event_counts[event_type] = total
+        if count > 0 and (last is None or day > last):
+            row.last_event_dates[event_type] = day
+        elif count < 0 and (last is None or day >= last):
+            recheck.add(event_type)
+    for (name, applied, next_dose), count in (vaccines or {}).items():
+        if not count:
+            continue
+        row.vaccine_count += count
+        dose, latest = [applied, next_dose], row.latest_doses.get(name)
+        if count > 0 and (latest is None or _dose_order(dose) > _dose_order(latest)):
+            row.latest_doses[name] = dose
+        elif count < 0 and (latest is None or _dose_order(dose) >= _dose_order(latest)):
+            recheck_doses.add(name)
+    return recheck, recheck_doses
+
+
+def _latest(animal_id, event_type):
+    dates = [model.objects.filter(animal_id=animal_id, type=event_type).aggregate(last=Max('date'))['last']
+             for model in EVENT_MODELS]
+    dates = [day for day in dates if day is not None]
+    return max(dates).isoformat() if dates else None
+
+
+def _iso(day):
+    return day.isoformat() if day is not None else None
+
+
+def _latest_dose(animal_id, name):
+    doses = [
+        model.objects.filter(animal_id=animal_id, name=name)
+        .order_by('-application_date', F('next_dose_date').desc(nulls_last=True))
+        .values_list('application_date', 'next_dose_date').first()
+        for model in VACCINE_MODELS
+    ]
+    doses = [[_iso(applied), _iso(next_dose)] for applied, next_dose in filter(None, doses)]
+    return max(doses, key=_dose_order) if doses else None
+
+
+def flush():
+    state = _pending()
+    events, state.events = state.events, defaultdict(Counter)
+    vaccines, state.vaccines = state.vaccines, defaultdict(Counter)
+    stale, state.stale = state.stale, set()
+    changed = {animal_id for deltas in (events, vaccines) for animal_id, delta in deltas.items()
+               if any(delta.values())}
+    if not changed and not stale:
+        return
+
+    with atomic(savepoint=False):
+        rows = AnimalStats.objects.select_for_update().in_bulk(changed - stale, field_name='animal_id')
+        for animal_id, row in rows.items():
+            event_types, names = _apply(row, events.get(animal_id), vaccines.get(animal_id))
+            for event_type in event_types:
+                last = _latest(animal_id, event_type)
+                if last is None:
+                    row.last_event_dates.pop(event_type, None)
+                else:
+                    row.last_event_dates[event_type] = last
+            for name in names:
+                dose = _latest_dose(animal_id, name)
+                if dose is None:
+                    row.latest_doses.pop(name, None)
+                else:
+                    row.latest_doses[name] = dose
+            row.updated_at = now()
+        AnimalStats.objects.bulk_update(
+            rows.values(), ['event_counts', 'last_event_dates', 'vaccine_count', 'latest_doses', 'updated_at']
+        )
+    # never built (the tables already include these writes) or unknown deltas
+    missing = (changed | stale) - set(rows)
+    if missing:
+        rebuild_stats(missing)
+
+
+def discard():
+    state = _pending()
+    state.events.clear()
+    state.vaccines.clear()
+    state.stale.clear()
+
+
+BATCH_LISTENERS.append((flush, discard))
+
+
+def rebuild_stats(animal_ids):
+    """Recompute the rows of these pets from the tables; returns the new rows."""
+    rows = {animal_id: AnimalStats(animal_id=animal_id)
+            for animal_id in Animal.objects.filter(id__in=list(animal_ids)).values_list('id', flat=True)}
+    if not rows:
+        return []
+    for model in EVENT_MODELS:
+        grouped = (model.objects.filter(animal_id__in=rows).values_list('animal', 'type')
+                   .annotate(n=Count('id'), last=Max('date')).order_by())
+        for animal_id, event_type, count, last in grouped:
+            row = rows[animal_id]
+            row.event_counts[event_type] = row.event_counts.get(event_type, 0) + count
+            row.last_event_dates[event_type] = max(last.isoformat(), row.last_event_dates.get(event_type, ''))
+    for model in VACCINE_MODELS:
+        grouped = (model.objects.filter(animal_id__in=rows)
+                   .values_list('animal', 'name', 'application_date', 'next_dose_date')
+                   .annotate(n=Count('id')).order_by())
+        for animal_id, name, applied, next_dose, count in grouped:
+            row = rows[animal_id]
+            row.vaccine_count += count
+            dose, latest = [_iso(applied), _iso(next_dose)], row.latest_doses.get(name)
+            if latest is None or _dose_order(dose) > _dose_order(latest):
+                row.latest_doses[name] = dose
+    with atomic():
+        AnimalStats.objects.filter(animal_id__in=rows).delete()
+        AnimalStats.objects.bulk_create(rows.values())
+    return list(rows.values())
+
+
+def animal_stats(animal_ids):
+    """Stats rows of these pets, in the given order, building the missing ones."""
+    animal_ids = list(animal_ids)
+    rows = AnimalStats.objects.in_bulk(animal_ids, field_name='animal_id')
+    missing = [animal_id for animal_id in animal_ids if animal_id not in rows]
+    if missing:
+        rows.update((row.animal_id, row) for row in rebuild_stats(missing))
+    return [rows[animal_id] for animal_id in animal_ids if animal_id in rows]
+
+
+def last_vet_visit(stats):
+    dates = [stats.last_event_dates[event_type] for event_type in settings.STATS_VET_VISIT_EVENT_TYPES
+             if event_type in stats.last_event_dates]
+    return max(dates) if dates else None
+
+
+def vaccines_overdue(stats, today):
+    """Vaccines whose latest dose asked for a booster before `today`."""
+    today = today.isoformat()
+    return sum(1 for _, next_dose in stats.latest_doses.values() if next_dose and next_dose < today)
+
+
+def next_dose_date(stats, today):
+    today = today.isoformat()
+    return min((next_dose for _, next_dose in stats.latest_doses.values() if next_dose and next_dose >= today),
+               default=None)
@@ -0,0 +1,95 @@
+"""Deterministic synthetic data for benchmarks and load tests."""
+import random
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from .models import Animal, Event, Vaccine
+
+# default reference time the generated history leads up to
+EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+PET_TYPES = [
+    ('Cachorro', ['Labrador', 'SRD', 'Poodle', 'Bulldog', 'Beagle']),
+    ('Gato', ['Siamês', 'SRD', 'Persa', 'Maine Coon']),
+]
+EVENT_TYPES = ['Consulta veterinária', 'Vacinação', 'Banho', 'Tosa', 'Cirurgia', 'Exame']
+VACCINE_NAMES = ['V8', 'V10', 'Antirrábica', 'Gripe', 'Giárdia', 'V4', 'V5']
+OBSERVATIONS = [
+    'Check-up anual sem alterações',
+    'Apresentou febre leve após a aplicação',
+    'Retorno em 15 dias',
+    'Coceira nas orelhas, iniciado tratamento',
+    '',
+]
+
+
+def generate_dataset(users=10, pets_per_user=3, events_per_pet=20, vaccines_per_pet=5,
+                     seed=0, username_prefix='synthetic', password='synthetic', batch_size=2000, epoch=EPOCH):
+    """Create users with a pet history of the requested shape and return the users.
+
+    The same arguments always produce the same rows (ids and dates included),
+    so runs on different commits measure identical data. Dates fall in the ten
+    years and `updated_at` in the year before `epoch`; callers that exercise
+    windows relative to the server clock (delta syncs, due vaccines) pass the
+    current time, which keeps the rows identical relative to it. All users
+    share `password`, hashed once, so token endpoints can be exercised without
+    paying the hasher cost per user at generation time.
+    """
+    rng = random.Random(seed)
+    User = get_user_model()
+    password_hash = make_password(password)
+    created = User.objects.bulk_create([
+        User(username=f'{username_prefix}-{index}', password=password_hash)
+        for index in range(users)
+    ], batch_size=batch_size)
+    users_qs = User.objects.filter(username__in=[user.username for user in created]).order_by('username')
+    today = epoch.date()
+    base_time = epoch - timedelta(days=365)
+
+    def new_id():
+        return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+    def moment(days):
+        return base_time + timedelta(days=days, seconds=rng.randrange(86400))
+
+    animals, events, vaccines = [], [], []
+    for user in users_qs:
+        for _ in range(pets_per_user):
+            pet_type, breeds = rng.choice(PET_TYPES)
+            animal = Animal(
+                id=new_id(),
+                user=user,
+                name=f'Pet {rng.randrange(10**6)}',
+                type=pet_type,
+                breed=rng.choice(breeds),
+                date_of_birth=date(2015, 1, 1) + timedelta(days=rng.randrange(3000)),
+                updated_at=moment(rng.randrange(365)),
+            )
+            animals.append(animal)
+            for _ in range(events_per_pet):
+                events.append(Event(
+                    id=new_id(),
+                    animal=animal,
+                    type=rng.choice(EVENT_TYPES),
+                    date=today - timedelta(days=rng.randrange(3650)),
+                    observation=rng.choice(OBSERVATIONS),
+                    updated_at=moment(rng.randrange(365)),
+                ))
+            for _ in range(vaccines_per_pet):
+                applied = today - timedelta(days=rng.randrange(1500))
+                vaccines.append(Vaccine(
+                    id=new_id(),
+                    animal=animal,
+                    name=rng.choice(VACCINE_NAMES),
+                    application_date=applied,
+                    next_dose_date=applied + timedelta(days=365) if rng.random() < 0.7 else None,
+                    updated_at=moment(rng.randrange(365)),
+                ))
+
+    for obj in (*animals, *events, *vaccines):
+        obj.content_hash = obj.compute_content_hash()
+    Animal.objects.bulk_create(animals, batch_size=batch_size)
+    Event.objects.bulk_create(events, batch_size=batch_size)
+    Vaccine.objects.bulk_create(vaccines, batch_size=batch_size)
+    return list(users_qs)
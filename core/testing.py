@@ -0,0 +1,91 @@
+"""Query-budget assertions for tests.
+
+A budget caps how many SQL queries a block may run, optionally growing with
+the payload size::
+
+    with query_budget(QueryBudget(base=3, per_item=2), size=len(pets)):
+        client.post(url, payload, format='json')
+
+`query_budget` also works as a decorator. Test cases can mix in
+`QueryBudgetMixin` and call `self.assertQueryBudget(...)` instead. When the
+budget is exceeded the failure lists every captured statement. Budgets count
+the queries of the active shard, so they hold with and without
+DATABASE_SHARDS.
+
+`OneShardMixin` lets a test case run unchanged under DATABASE_SHARDS: every
+user lands on the first shard, and the test's own queries go there too.
+"""
+from contextlib import ContextDecorator
+from dataclasses import dataclass
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from .sharding import active_alias, use_shard
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    base: int
+    per_item: int = 0
+
+    def limit(self, size=0):
+        return self.base + self.per_item * size
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class query_budget(ContextDecorator):
+    def __init__(self, budget, size=0, using=None):
+        if isinstance(budget, int):
+            budget = QueryBudget(base=budget)
+        self.budget = budget
+        self.size = size
+        self.using = using
+
+    def __enter__(self):
+        self.captured = CaptureQueriesContext(connections[self.using or active_alias()])
+        self.captured.__enter__()
+        return self.captured
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.captured.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return False
+        limit = self.budget.limit(self.size)
+        executed = len(self.captured)
+        if executed > limit:
+            statements = '\n'.join(
+                f"{index}. {query['sql']}" for index, query in enumerate(self.captured.captured_queries, 1)
+            )
+            raise QueryBudgetExceeded(
+                f"{executed} queries executed, budget is {limit} "
+                f"(base={self.budget.base}, per_item={self.budget.per_item}, size={self.size}):\n{statements}"
+            )
+        return False
+
+
+class QueryBudgetMixin:
+    def assertQueryBudget(self, budget, size=0, using=None):
+        return query_budget(budget, size=size, using=using)
+
+
+class OneShardMixin:
+    """With DATABASE_SHARDS set, runs the test case with the first shard as the only one.
+
+    Users are placed on it by the directory as usual, and fixtures created
+    outside requests are written to it, so tests that mix both see the same
+    rows. Without shards this changes nothing. Count queries on
+    `connections[active_alias()]` to see the test's data queries either way.
+    """
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        if settings.DATABASE_SHARDS:
+            alias = settings.DATABASE_SHARDS[0]
+            cls.databases = {DEFAULT_DB_ALIAS, alias}
+            cls.enterClassContext(override_settings(DATABASE_SHARDS=[alias]))
+            cls.enterClassContext(use_shard(alias))
+        super().setUpClass()
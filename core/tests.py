@@ -1,17 +1,56 @@
-from django.test import TestCase
+from django.contrib.admin import AdminSite
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.contrib.auth import get_user_model
-from .models import Animal, Event, Vaccine
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from .models import (Animal, AnimalStats, ArchivedEvent, ArchivedVaccine, Event, Vaccine, Tombstone, VaccineReminder,
+                     SyncBucket, SyncSnapshot, UserShard, uuid7)
+from .merkle import bucket_of, format_hash, leaf_hash, rebuild_buckets, tree
+from .benchmarks import run_benchmarks, scenarios, upload_payload
+from .synthetic import generate_dataset
+from .instrumentation import registry as metrics_registry
+from .loadtest import VirtualClient, run_load_test, saturation_point
+from .schema import clear_memory_cache
+from .startup import measure_boot, parse_importtime
+from .snapshots import build_snapshot
+from . import search as search_module
+from .search import install_search_index
+from .export import export_chunks
+from .sharding import active_alias, fences_writes, pick_shard, shard_for_user, use_shard
+from .stats import rebuild_stats
+from .groupcommit import WriteCoordinator
+from .admin import EstimatedCountPaginator, register as register_admin
+from .views import SyncUploadView
+from .docs import apply_deferred, extend_schema
+from .testing import OneShardMixin, QueryBudget, QueryBudgetExceeded, QueryBudgetMixin, query_budget
+from io import StringIO
+from unittest import mock, skipIf, skipUnless
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import uuid
+import zipfile
 
 User = get_user_model()
 
 
-class SyncUploadViewTest(TestCase):
+class SyncUploadViewTest(OneShardMixin, TestCase):
     @classmethod
     def setUpTestData(cls):
         cls.user = User.objects.create_user(username='testuser', password='pass')
@@ -372,8 +411,88 @@ class SyncUploadViewTest(TestCase):
         self.assertEqual(vaccine.application_date.strftime("%Y-%m-%d"), "2023-01-01")
         self.assertEqual(vaccine.next_dose_date.strftime("%Y-%m-%d"), "2024-01-01")
 
+    def test_identical_content_is_not_rewritten(self):
+        animal = Animal.objects.create(
+            id=self.animal_id,
+            name="Rex",
+            type="Dog",
+            breed="Labrador",
+            date_of_birth=self.default_dob,
+            updated_at=self.now - timedelta(days=1),
+            user=self.user
+        )
+        Event.objects.create(
+            id=self.event_id,
+            type="Consulta",
+            date="2023-01-01",
+            observation="",
+            updated_at=self.now - timedelta(days=1),
+            animal=animal
+        )
+        payload = {
+            "pets": [{
+                "id": self.animal_id,
+                "name": "Rex",
+                "type": "Dog",
+                "breed": "Labrador",
+                "date_of_birth": self.default_dob,
+                "updated_at": self.now,
+                "events": [{
+                    "id": self.event_id,
+                    "type": "Consulta",
+                    "date": "2023-01-01",
+                    "observation": "Retorno",
+                    "updated_at": self.now
+                }],
+                "vaccines": [{
+                    "id": self.vaccine_id,
+                    "name": "V10",
+                    "application_date": "2023-01-01",
+                    "next_dose_date": None,
+                    "updated_at": self.now
+                }]
+            }]
+        }
+
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'created': 1, 'updated': 1, 'skipped': 1, 'outdated': 0})
+        animal.refresh_from_db()
+        self.assertEqual(animal.updated_at, self.now)
+        self.assertEqual(Event.objects.get(id=self.event_id).observation, "Retorno")
+
+        # the same batch again: every row is now as new as the upload, so only the lookups run
+        # (plus the snapshot check every successful write makes)
+        with self.assertNumQueries(6, using=active_alias()):
+            response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.data, {'created': 0, 'updated': 0, 'skipped': 0, 'outdated': 3})
 
-class SyncDownloadViewTests(APITestCase):
+    def test_skipped_upload_keeps_its_timestamp(self):
+        animal = Animal.objects.create(id=self.animal_id, name="Rex", type="Dog", breed="Labrador",
+                                       date_of_birth=self.default_dob, updated_at=self.now - timedelta(days=2),
+                                       user=self.user)
+        pet = {"id": self.animal_id, "name": "Rex", "type": "Dog", "breed": "Labrador",
+               "date_of_birth": self.default_dob}
+
+        response = self.client.post(self.url, {"pets": [{**pet, "updated_at": self.now}]}, format='json')
+        self.assertEqual(response.data['skipped'], 1)
+        self.assertEqual(tree(self.user.id)['hash'], format_hash(leaf_hash('animal', animal.id, self.now)))
+
+        # edited on another device before the skipped upload, but sent after it
+        response = self.client.post(self.url, {"pets": [{
+            **pet, "name": "Rex II", "updated_at": self.now - timedelta(days=1),
+        }]}, format='json')
+        self.assertEqual(response.data, {'created': 0, 'updated': 0, 'skipped': 0, 'outdated': 1})
+        self.assertEqual(Animal.objects.get(id=self.animal_id).name, "Rex")
+
+    def test_content_hash_not_exposed(self):
+        Animal.objects.create(id=self.animal_id, name="Rex", type="Dog", breed="SRD",
+                              date_of_birth=self.default_dob, user=self.user)
+        response = self.client.get(reverse('animal-list'))
+        self.assertNotIn('content_hash', response.data[0])
+
+
+class SyncDownloadViewTests(OneShardMixin, APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
             username='testuser', 
@@ -477,7 +596,7 @@ class SyncDownloadViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['pets']), 0)
 
-class SyncCheckUpdatesViewTests(APITestCase):
+class SyncCheckUpdatesViewTests(OneShardMixin, APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
             username='testuser', 
@@ -582,4 +701,2209 @@ class SyncCheckUpdatesViewTests(APITestCase):
         self.assertTrue(data['has_updates'])
         self.assertEqual(data['update_counts']['animals'], 1)
         self.assertEqual(data['update_counts']['events'], 0)
-        self.assertEqual(data['update_counts']['vaccines'], 1)
\ No newline at end of file
+        self.assertEqual(data['update_counts']['vaccines'], 1)
+
+    def test_check_outside_retention_window_asks_for_full_sync(self):
+        # nothing changed since, but deletions older than the window are gone
+        Animal.objects.update(updated_at=timezone.now() - timedelta(days=400))
+        Event.objects.update(updated_at=timezone.now() - timedelta(days=400))
+        Vaccine.objects.update(updated_at=timezone.now() - timedelta(days=400))
+        last_sync = timezone.now() - timedelta(days=365)
+
+        with self.settings(SYNC_TOMBSTONE_RETENTION_DAYS=30):
+            response = self.client.post(self.url, {'last_synced_at': last_sync.isoformat()}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['has_updates'])
+        self.assertTrue(response.data['full_sync'])
+        self.assertEqual(response.data['update_counts']['animals'], 1)
+
+        with self.settings(SYNC_TOMBSTONE_RETENTION_DAYS=730):
+            response = self.client.post(self.url, {'last_synced_at': last_sync.isoformat()}, format='json')
+        self.assertFalse(response.data['has_updates'])
+        self.assertFalse(response.data['full_sync'])
+
+class BatchViewTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('batch')
+
+        self.animal = Animal.objects.create(
+            user=self.user,
+            name="Max",
+            type="Dog",
+            breed="Labrador",
+            date_of_birth="2018-11-20",
+            updated_at=timezone.now() - timedelta(days=3)
+        )
+
+    def test_unauthenticated_access(self):
+        self.client.logout()
+        response = self.client.post(self.url, {"requests": [{"path": "/api/animals/"}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_runs_sub_requests_with_batch_user(self):
+        response = self.client.post(self.url, {
+            "requests": [
+                {"method": "GET", "path": "/api/animals/"},
+                {"method": "POST", "path": "/api/sync/check-update", "body": {}}
+            ]
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        animals, check = response.data['responses']
+        self.assertEqual(animals['status'], status.HTTP_200_OK)
+        self.assertEqual(animals['body'][0]['id'], str(self.animal.id))
+        self.assertEqual(check['status'], status.HTTP_200_OK)
+        self.assertEqual(check['body']['update_counts']['animals'], 1)
+
+    def test_query_string_is_forwarded(self):
+        response = self.client.post(self.url, {
+            "requests": [{"method": "GET", "path": f"/api/animals/{self.animal.id}/?format=json"}]
+        }, format='json')
+
+        self.assertEqual(response.data['responses'][0]['body']['name'], "Max")
+
+    def test_unknown_and_nested_batch_routes_are_rejected(self):
+        response = self.client.post(self.url, {
+            "requests": [
+                {"method": "GET", "path": "/api/unknown/"},
+                {"method": "POST", "path": "/api/batch", "body": {"requests": []}},
+                {"method": "GET", "path": "/swagger/"}
+            ]
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for item in response.data['responses']:
+            self.assertEqual(item['status'], status.HTTP_404_NOT_FOUND)
+
+    def test_atomic_batch_rolls_back_on_failure(self):
+        response = self.client.post(self.url, {
+            "atomic": True,
+            "requests": [
+                {"method": "DELETE", "path": f"/api/animals/{self.animal.id}/"},
+                {"method": "POST", "path": "/api/sync/download", "body": {"last_synced_at": "invalid"}}
+            ]
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['rolled_back'])
+        self.assertEqual(response.data['responses'][0]['status'], status.HTTP_204_NO_CONTENT)
+        self.assertTrue(Animal.objects.filter(id=self.animal.id).exists())
+
+    def test_non_atomic_batch_keeps_successful_writes(self):
+        response = self.client.post(self.url, {
+            "requests": [
+                {"method": "DELETE", "path": f"/api/animals/{self.animal.id}/"},
+                {"method": "POST", "path": "/api/sync/download", "body": {"last_synced_at": "invalid"}}
+            ]
+        }, format='json')
+
+        self.assertFalse(response.data['rolled_back'])
+        self.assertEqual(response.data['responses'][1]['status'], status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Animal.objects.filter(id=self.animal.id).exists())
+
+    def test_rejects_too_many_sub_requests(self):
+        with self.settings(BATCH_MAX_REQUESTS=1):
+            response = self.client.post(self.url, {
+                "requests": [{"path": "/api/animals/"}, {"path": "/api/events/"}]
+            }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TombstoneTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.last_sync = timezone.now() - timedelta(hours=1)
+
+        self.animal = Animal.objects.create(
+            user=self.user,
+            name="Max",
+            type="Dog",
+            breed="Labrador",
+            date_of_birth="2018-11-20",
+            updated_at=timezone.now() - timedelta(days=3)
+        )
+        self.event = Event.objects.create(
+            animal=self.animal,
+            type="GROOMING",
+            date="2023-10-05",
+            updated_at=timezone.now() - timedelta(days=2)
+        )
+        self.vaccine = Vaccine.objects.create(
+            animal=self.animal,
+            name="Parvovirus",
+            application_date="2023-09-20",
+            updated_at=timezone.now() - timedelta(days=1)
+        )
+
+    def test_deleting_animal_records_tombstones_for_children(self):
+        response = self.client.delete(reverse('animal-detail', args=[self.animal.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        deleted = set(Tombstone.objects.values_list('model', 'object_id'))
+        self.assertEqual(deleted, {
+            ('animal', self.animal.id),
+            ('event', self.event.id),
+            ('vaccine', self.vaccine.id),
+        })
+
+    def test_download_reports_deletions_since_last_sync(self):
+        self.client.delete(reverse('event-detail', args=[self.event.id]))
+
+        response = self.client.post(reverse('download'), {
+            'last_synced_at': self.last_sync.isoformat()
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['full_sync'])
+        self.assertEqual(len(response.data['pets']), 0)
+        self.assertEqual(response.data['deleted'], [{
+            'id': str(self.event.id),
+            'model': 'event',
+            'deleted_at': response.data['deleted'][0]['deleted_at'],
+        }])
+
+    def test_download_skips_deletions_older_than_last_sync(self):
+        self.client.delete(reverse('vaccine-detail', args=[self.vaccine.id]))
+
+        response = self.client.post(reverse('download'), {
+            'last_synced_at': (timezone.now() + timedelta(minutes=1)).isoformat()
+        }, format='json')
+
+        self.assertEqual(response.data['deleted'], [])
+
+    def test_download_outside_retention_window_is_full_sync(self):
+        Tombstone.record(self.user, 'event', [uuid.uuid4()])
+        last_sync = timezone.now() - timedelta(days=365)
+
+        with self.settings(SYNC_TOMBSTONE_RETENTION_DAYS=30):
+            response = self.client.post(reverse('download'), {
+                'last_synced_at': last_sync.isoformat()
+            }, format='json')
+
+        self.assertTrue(response.data['full_sync'])
+        self.assertEqual(len(response.data['pets']), 1)
+        self.assertEqual(response.data['deleted'], [])
+
+    def test_check_update_counts_deletions(self):
+        self.client.delete(reverse('vaccine-detail', args=[self.vaccine.id]))
+
+        response = self.client.post(reverse('check_update'), {
+            'last_synced_at': self.last_sync.isoformat()
+        }, format='json')
+
+        self.assertTrue(response.data['has_updates'])
+        self.assertEqual(response.data['update_counts']['deleted'], 1)
+        self.assertEqual(response.data['update_counts']['vaccines'], 0)
+
+    def test_purge_removes_only_expired_tombstones(self):
+        Tombstone.record(self.user, 'event', [uuid.uuid4()], timezone.now() - timedelta(days=100))
+        recent = Tombstone.record(self.user, 'event', [uuid.uuid4()])[0]
+
+        call_command('purge_tombstones', days=90, stdout=StringIO())
+
+        self.assertEqual(list(Tombstone.objects.values_list('id', flat=True)), [recent.id])
+
+
+class UUID7Tests(OneShardMixin, TestCase):
+    def test_uuid7_is_version_7_and_time_ordered(self):
+        ids = [uuid7() for _ in range(5000)]
+        self.assertTrue(all(value.version == 7 for value in ids))
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_server_side_ids_use_uuid7_and_client_v4_ids_are_kept(self):
+        user = User.objects.create_user(username='testuser', password='pass')
+        server_side = Animal.objects.create(
+            user=user, name="Rex", type="Dog", breed="SRD", date_of_birth="2020-01-01"
+        )
+        client_id = uuid.uuid4()
+        client_side = Animal.objects.create(
+            id=client_id, user=user, name="Mimi", type="Cat", breed="SRD", date_of_birth="2020-01-01"
+        )
+
+        self.assertEqual(server_side.id.version, 7)
+        client_side.refresh_from_db()
+        self.assertEqual(client_side.id, client_id)
+
+
+class VaccineDueTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('vaccine-due')
+        self.today = timezone.now().date()
+
+        self.animal = Animal.objects.create(
+            user=self.user,
+            name="Max",
+            type="Dog",
+            breed="Labrador",
+            date_of_birth="2018-11-20",
+        )
+        self.soon = self.create_vaccine("V8", self.today + timedelta(days=5))
+        self.later = self.create_vaccine("Antirrábica", self.today + timedelta(days=60))
+        self.create_vaccine("Vencida", self.today - timedelta(days=1))
+        self.create_vaccine("Sem reforço", None)
+
+        other = User.objects.create_user(username='other', password='pass')
+        other_animal = Animal.objects.create(
+            user=other, name="Mimi", type="Cat", breed="SRD", date_of_birth="2020-01-01"
+        )
+        Vaccine.objects.create(
+            animal=other_animal, name="V4", application_date="2023-01-01",
+            next_dose_date=self.today + timedelta(days=2)
+        )
+
+    def create_vaccine(self, name, next_dose_date):
+        return Vaccine.objects.create(
+            animal=self.animal,
+            name=name,
+            application_date="2023-01-01",
+            next_dose_date=next_dose_date,
+        )
+
+    def test_default_window(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([v['id'] for v in response.data], [str(self.soon.id)])
+
+    def test_custom_window_is_ordered_by_next_dose(self):
+        response = self.client.get(self.url, {'days': 90})
+        self.assertEqual([v['id'] for v in response.data], [str(self.soon.id), str(self.later.id)])
+
+    def test_window_above_maximum_is_rejected(self):
+        with self.settings(VACCINE_DUE_MAX_DAYS=30):
+            response = self.client.get(self.url, {'days': 31})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_build_reminders_materializes_due_vaccines_for_all_users(self):
+        VaccineReminder.objects.create(user=self.user, vaccine=self.later, due_date=self.today)
+
+        call_command('build_vaccine_reminders', days=30, batch_size=1, stdout=StringIO())
+
+        reminders = VaccineReminder.objects.order_by('due_date')
+        self.assertEqual(reminders.count(), 2)
+        self.assertEqual(reminders.filter(user=self.user).get().vaccine, self.soon)
+
+
+class ViewSetFilterTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass'
+        )
+        self.client.force_authenticate(user=self.user)
+
+        self.rex = Animal.objects.create(
+            user=self.user, name="Rex", type="Dog", breed="SRD", date_of_birth="2020-01-01"
+        )
+        self.mimi = Animal.objects.create(
+            user=self.user, name="Mimi", type="Cat", breed="SRD", date_of_birth="2021-01-01"
+        )
+        self.checkup = Event.objects.create(
+            animal=self.rex, type="Consulta", date="2023-01-10",
+            updated_at=timezone.now() - timedelta(days=10)
+        )
+        self.surgery = Event.objects.create(
+            animal=self.rex, type="Cirurgia", date="2023-06-01", updated_at=timezone.now()
+        )
+        self.grooming = Event.objects.create(
+            animal=self.mimi, type="Banho", date="2023-03-01", updated_at=timezone.now()
+        )
+        self.v8 = Vaccine.objects.create(animal=self.rex, name="V8", application_date="2023-02-01")
+        self.v4 = Vaccine.objects.create(animal=self.mimi, name="V4", application_date="2023-08-01")
+
+    def ids(self, response):
+        return [item['id'] for item in response.data]
+
+    def test_filter_events_by_animal_and_type(self):
+        response = self.client.get(reverse('event-list'), {'animal': self.rex.id, 'type': 'Consulta'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ids(response), [str(self.checkup.id)])
+
+    def test_filter_events_by_date_range_with_ordering(self):
+        response = self.client.get(reverse('event-list'), {
+            'date__gte': '2023-02-01',
+            'date__lte': '2023-12-31',
+            'ordering': '-date',
+        })
+        self.assertEqual(self.ids(response), [str(self.surgery.id), str(self.grooming.id)])
+
+    def test_filter_events_updated_since(self):
+        since = timezone.now() - timedelta(days=1)
+        response = self.client.get(reverse('event-list'), {'updated_at__gt': since.isoformat()})
+        self.assertEqual(set(self.ids(response)), {str(self.surgery.id), str(self.grooming.id)})
+
+    def test_filter_vaccines_by_application_date(self):
+        response = self.client.get(reverse('vaccine-list'), {'application_date__gte': '2023-05-01'})
+        self.assertEqual(self.ids(response), [str(self.v4.id)])
+
+    def test_unindexed_filters_are_rejected(self):
+        response = self.client.get(reverse('event-list'), {'observation': 'febre'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse('vaccine-list'), {'name': 'V8'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_animals_updated_since(self):
+        Animal.objects.filter(pk=self.rex.pk).update(updated_at=timezone.now() - timedelta(days=10))
+        since = timezone.now() - timedelta(days=1)
+        response = self.client.get(reverse('animal-list'), {'updated_at__gt': since.isoformat()})
+        self.assertEqual(self.ids(response), [str(self.mimi.id)])
+
+        response = self.client.get(reverse('animal-list'), {'breed': 'SRD'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_lists_are_paginated_on_request(self):
+        self.assertEqual(len(self.client.get(reverse('event-list')).data), 3)
+
+        response = self.client.get(reverse('event-list'), {'limit': 2})
+        self.assertEqual([item['id'] for item in response.data['results']],
+                         [str(self.checkup.id), str(self.surgery.id)])
+        self.assertIsNone(response.data['previous'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([item['id'] for item in response.data['results']], [str(self.grooming.id)])
+        self.assertIsNone(response.data['next'])
+
+        with self.settings(API_MAX_PAGE_SIZE=1):
+            response = self.client.get(reverse('event-list'), {'limit': 50, 'include_archived': 'true'})
+        self.assertEqual([item['id'] for item in response.data['results']], [str(self.checkup.id)])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_ordering_ties_break_on_id(self):
+        Event.objects.update(date="2023-01-10")
+        expected = sorted(str(event_id) for event_id in Event.objects.values_list('id', flat=True))
+        for ordering in ('date', '-date'):
+            pages = [self.client.get(reverse('event-list'), {'ordering': ordering, 'limit': 1, 'offset': offset})
+                     for offset in range(3)]
+            self.assertEqual([page.data['results'][0]['id'] for page in pages], expected)
+
+    def test_filters_never_leak_other_users_rows(self):
+        other = User.objects.create_user(username='other', password='pass')
+        self.client.force_authenticate(user=other)
+        response = self.client.get(reverse('event-list'), {'animal': self.rex.id})
+        self.assertEqual(response.data, [])
+
+
+class EventSearchTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('event-search')
+
+        self.animal = Animal.objects.create(
+            user=self.user, name="Rex", type="Dog", breed="SRD", date_of_birth="2020-01-01"
+        )
+        self.fever = self.create_event("Febre alta após vacinação, febre controlada", "2023-01-10")
+        self.limp = self.create_event("Mancando da pata traseira", "2023-02-10")
+        self.create_event(None, "2023-03-10")
+
+        other = User.objects.create_user(username='other', password='pass')
+        other_animal = Animal.objects.create(
+            user=other, name="Mimi", type="Cat", breed="SRD", date_of_birth="2020-01-01"
+        )
+        Event.objects.create(animal=other_animal, type="Consulta", date="2023-01-01", observation="Febre")
+
+    def create_event(self, observation, date):
+        return Event.objects.create(animal=self.animal, type="Consulta", date=date, observation=observation)
+
+    def search(self, q, **params):
+        return self.client.get(self.url, {'q': q, **params})
+
+    def ids(self, response):
+        return [item['id'] for item in response.data['results']]
+
+    def test_search_matches_only_own_events(self):
+        response = self.search("febre")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ids(response), [str(self.fever.id)])
+
+    def test_search_ignores_accents_and_matches_prefix(self):
+        self.assertEqual(self.ids(self.search("vacinacao")), [str(self.fever.id)])
+        self.assertEqual(self.ids(self.search("manc")), [str(self.limp.id)])
+
+    def test_search_results_are_ranked(self):
+        mild = self.create_event("Sem febre hoje", "2023-04-10")
+        self.assertEqual(self.ids(self.search("febre")), [str(self.fever.id), str(mild.id)])
+
+    def test_search_is_paginated(self):
+        for day in range(1, 4):
+            self.create_event("Tosse seca", f"2023-05-0{day}")
+
+        first = self.search("tosse", limit=2)
+        self.assertEqual(len(first.data['results']), 2)
+        self.assertEqual(first.data['next_offset'], 2)
+
+        second = self.search("tosse", limit=2, offset=2)
+        self.assertEqual(len(second.data['results']), 1)
+        self.assertIsNone(second.data['next_offset'])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.fever.observation = "Alergia na pele"
+        self.fever.save()
+        self.assertEqual(self.ids(self.search("febre")), [])
+        self.assertEqual(self.ids(self.search("alergia")), [str(self.fever.id)])
+
+        self.client.delete(reverse('event-detail', args=[self.fever.id]))
+        self.assertEqual(self.ids(self.search("alergia")), [])
+
+    def test_events_from_sync_upload_are_indexed(self):
+        event_id = str(uuid.uuid4())
+        self.client.post(reverse('upload'), {
+            "pets": [{
+                "id": str(self.animal.id),
+                "name": "Rex",
+                "type": "Dog",
+                "breed": "SRD",
+                "date_of_birth": "2020-01-01",
+                "updated_at": self.animal.updated_at,
+                "events": [{
+                    "id": event_id,
+                    "type": "Consulta",
+                    "date": "2023-06-01",
+                    "observation": "Otite no ouvido esquerdo",
+                    "updated_at": timezone.now()
+                }]
+            }]
+        }, format='json')
+
+        self.assertEqual(self.ids(self.search("otite")), [event_id])
+
+    def test_index_follows_the_pet_owner(self):
+        other = User.objects.get(username='other')
+        Animal.objects.filter(pk=self.animal.pk).update(user=other)
+        self.assertEqual(self.ids(self.search("mancando")), [])
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.ids(self.search("mancando")), [str(self.limp.id)])
+
+    def test_index_without_owners_is_rebuilt(self):
+        with connections[active_alias()].cursor() as cursor:
+            if connections[active_alias()].vendor != 'sqlite':
+                self.skipTest("SQLite FTS5 index")
+            cursor.execute("DROP TRIGGER core_event_fts_insert")
+            cursor.execute("DROP TRIGGER core_event_fts_update")
+            cursor.execute("DROP TABLE core_event_fts")
+            cursor.execute("CREATE VIRTUAL TABLE core_event_fts USING fts5(observation)")
+        install_search_index(active_alias())
+        self.assertEqual(self.ids(self.search("febre")), [str(self.fever.id)])
+
+    def test_postgresql_search_is_index_backed(self):
+        statements = ' '.join(search_module._postgresql_statements())
+        self.assertIn("USING GIN (to_tsvector('simple', COALESCE(observation, '')))", statements)
+        self.assertNotIn('DROP INDEX', statements)
+
+    def test_query_without_terms_returns_nothing(self):
+        response = self.search('"*')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
+
+class BenchmarkSuiteTests(OneShardMixin, TestCase):
+    def test_generator_builds_requested_shape_deterministically(self):
+        users = generate_dataset(users=2, pets_per_user=3, events_per_pet=4, vaccines_per_pet=2, seed=7)
+
+        self.assertEqual(len(users), 2)
+        self.assertEqual(Animal.objects.count(), 6)
+        self.assertEqual(Event.objects.count(), 24)
+        self.assertEqual(Vaccine.objects.count(), 12)
+
+        ids = set(Animal.objects.values_list('id', flat=True))
+        history = set(Event.objects.values_list('id', 'date', 'updated_at'))
+        Animal.objects.all().delete()
+        generate_dataset(users=2, pets_per_user=3, events_per_pet=4, vaccines_per_pet=2,
+                         seed=7, username_prefix='again')
+        self.assertEqual(set(Animal.objects.values_list('id', flat=True)), ids)
+        self.assertEqual(set(Event.objects.values_list('id', 'date', 'updated_at')), history)
+
+    def test_upload_payload_writes_rows(self):
+        user = generate_dataset(users=1, pets_per_user=2, events_per_pet=2, vaccines_per_pet=1, seed=7)[0]
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        for bump in (1, 2):
+            response = client.post(reverse('upload'), upload_payload(user, bump), format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['created'], 2)
+        self.assertEqual(Event.objects.count(), 8)
+
+    def test_run_benchmarks_reports_every_scenario(self):
+        report = run_benchmarks(users=1, pets_per_user=1, events_per_pet=2, vaccines_per_pet=1,
+                                iterations=2, profile_iterations=1)
+
+        self.assertEqual(set(report['results']), set(scenarios()))
+        for result in report['results'].values():
+            self.assertEqual(result['errors'], 0)
+            self.assertIn('p95', result['latency_ms'])
+            self.assertGreater(result['queries']['max'], 0)
+            self.assertGreater(result['peak_memory_bytes'], 0)
+
+
+# Maximum queries per endpoint; `per_item` scales with the payload size
+# passed to assertQueryBudget (pets uploaded, sub-requests in a batch, ...).
+# Writes inside transaction.atomic count their SAVEPOINT/RELEASE statements.
+# Writes to pets, events and vaccines add two for the sync hash buckets (core.merkle).
+# Event and vaccine writes add two more for the pet's statistics row (core.stats);
+# deleting the latest event of a type or dose of a vaccine looks up the new latest
+# in the hot and archive tables.
+# Deleting a pet also reads and cascades into the archive tables (core.archive)
+# and its statistics row.
+# Every successful write adds one lookup for the user's first-sync snapshot (core.snapshots).
+# Export and bucket listings read pets plus the hot and archive tables of events and vaccines.
+QUERY_BUDGETS = {
+    'animal-list': QueryBudget(base=3),
+    'animal-detail:get': QueryBudget(base=3),
+    'animal-list:post': QueryBudget(base=6),
+    'animal-detail:put': QueryBudget(base=7),
+    'animal-detail:delete': QueryBudget(base=22),
+    'event-list': QueryBudget(base=1),
+    'event-list:post': QueryBudget(base=7),
+    'event-detail:delete': QueryBudget(base=11),
+    'event-search': QueryBudget(base=2),
+    'vaccine-list': QueryBudget(base=1),
+    'vaccine-due': QueryBudget(base=1),
+    'vaccine-detail:delete': QueryBudget(base=14),
+    'download': QueryBudget(base=4),
+    'check_update': QueryBudget(base=4),
+    'reconcile': QueryBudget(base=1),
+    'reconcile:buckets': QueryBudget(base=5),
+    'export': QueryBudget(base=5),
+    'metrics': QueryBudget(base=0),
+    'animal-stats-list': QueryBudget(base=2),
+    'animal-stats': QueryBudget(base=2),
+    # per uploaded record (pet, event or vaccine): one lookup plus one write
+    'upload': QueryBudget(base=5, per_item=2),
+    # three batched lookups, one bulk insert per model, one UPDATE per changed record
+    'patch': QueryBudget(base=9, per_item=1),
+    'batch': QueryBudget(base=0, per_item=4),
+}
+
+
+class QueryBudgetHarnessTests(OneShardMixin, TestCase):
+    def test_budget_scales_with_size(self):
+        self.assertEqual(QueryBudget(base=3, per_item=2).limit(5), 13)
+
+    def test_exceeding_budget_reports_captured_sql(self):
+        with self.assertRaises(QueryBudgetExceeded) as ctx:
+            with query_budget(1):
+                list(Event.objects.all())
+                list(Animal.objects.all())
+        self.assertIn('2 queries executed, budget is 1', str(ctx.exception))
+        self.assertIn('core_animal', str(ctx.exception))
+
+    def test_decorator_form(self):
+        @query_budget(QueryBudget(base=0, per_item=1), size=1)
+        def one_query():
+            return list(User.objects.all())
+
+        one_query()
+
+
+class EndpointQueryBudgetTests(OneShardMixin, QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.since = (timezone.now() - timedelta(days=30)).isoformat()
+
+    def make_pets(self, count, events=3, vaccines=2):
+        pets = []
+        for index in range(count):
+            animal = Animal.objects.create(
+                user=self.user, name=f"Pet {index}", type="Dog", breed="SRD", date_of_birth="2020-01-01"
+            )
+            for day in range(events):
+                Event.objects.create(
+                    animal=animal, type="Consulta", date=f"2023-01-{day + 1:02d}", observation="febre"
+                )
+            for _ in range(vaccines):
+                Vaccine.objects.create(
+                    animal=animal, name="V8", application_date="2023-01-01",
+                    next_dose_date=timezone.now().date() + timedelta(days=3)
+                )
+            pets.append(animal)
+        return pets
+
+    def upload_payload(self, pets):
+        updated_at = (timezone.now() + timedelta(minutes=1)).isoformat()
+        return {"pets": [{
+            "id": str(pet.id),
+            "name": pet.name,
+            "type": pet.type,
+            "breed": pet.breed,
+            "date_of_birth": "2020-01-01",
+            "updated_at": updated_at,
+            "events": [{
+                "id": str(event.id), "type": event.type, "date": str(event.date),
+                "observation": "febre alta", "updated_at": updated_at
+            } for event in pet.events.all()],
+            "vaccines": [{
+                "id": str(vaccine.id), "name": vaccine.name,
+                "application_date": str(vaccine.application_date), "updated_at": updated_at
+            } for vaccine in pet.vaccines.all()],
+        } for pet in pets]}
+
+    def test_list_endpoints_do_not_grow_with_data(self):
+        for count in (1, 5):
+            self.make_pets(count)
+            with self.assertQueryBudget(QUERY_BUDGETS['animal-list']):
+                response = self.client.get(reverse('animal-list'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with self.assertQueryBudget(QUERY_BUDGETS['event-list']):
+                response = self.client.get(reverse('event-list'), {'type': 'Consulta'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with self.assertQueryBudget(QUERY_BUDGETS['vaccine-list']):
+                response = self.client.get(reverse('vaccine-list'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with self.assertQueryBudget(QUERY_BUDGETS['vaccine-due']):
+                response = self.client.get(reverse('vaccine-due'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with self.assertQueryBudget(QUERY_BUDGETS['event-search']):
+                response = self.client.get(reverse('event-search'), {'q': 'febre'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_stats_do_not_grow_with_data(self):
+        for count in (1, 5):
+            pet = self.make_pets(count)[0]
+            with self.assertQueryBudget(QUERY_BUDGETS['animal-stats-list']):
+                response = self.client.get(reverse('animal-stats-list'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with self.assertQueryBudget(QUERY_BUDGETS['animal-stats']):
+                response = self.client.get(reverse('animal-stats', args=[pet.id]))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_animal_detail_writes(self):
+        pet = self.make_pets(1)[0]
+        with self.assertQueryBudget(QUERY_BUDGETS['animal-detail:get']):
+            response = self.client.get(reverse('animal-detail', args=[pet.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertQueryBudget(QUERY_BUDGETS['animal-list:post']):
+            response = self.client.post(reverse('animal-list'), {
+                "name": "Novo", "type": "Cat", "breed": "SRD", "date_of_birth": "2021-01-01"
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with self.assertQueryBudget(QUERY_BUDGETS['animal-detail:put']):
+            response = self.client.put(reverse('animal-detail', args=[pet.id]), {
+                "name": "Renomeado", "type": "Dog", "breed": "SRD", "date_of_birth": "2020-01-01"
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertQueryBudget(QUERY_BUDGETS['animal-detail:delete']):
+            response = self.client.delete(reverse('animal-detail', args=[pet.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_event_and_vaccine_writes(self):
+        pet = self.make_pets(1)[0]
+        with self.assertQueryBudget(QUERY_BUDGETS['event-list:post']):
+            response = self.client.post(reverse('event-list'), {
+                "animal": str(pet.id), "type": "Banho", "date": "2023-02-01"
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with self.assertQueryBudget(QUERY_BUDGETS['event-detail:delete']):
+            response = self.client.delete(reverse('event-detail', args=[response.data['id']]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        vaccine = pet.vaccines.first()
+        with self.assertQueryBudget(QUERY_BUDGETS['vaccine-detail:delete']):
+            response = self.client.delete(reverse('vaccine-detail', args=[vaccine.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_sync_reads_do_not_grow_with_data(self):
+        for count in (1, 5):
+            self.make_pets(count)
+            with self.assertQueryBudget(QUERY_BUDGETS['download']):
+                response = self.client.post(reverse('download'), {}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with self.assertQueryBudget(QUERY_BUDGETS['download']):
+                response = self.client.post(reverse('download'), {'last_synced_at': self.since}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with self.assertQueryBudget(QUERY_BUDGETS['check_update']):
+                response = self.client.post(reverse('check_update'), {'last_synced_at': self.since}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with self.assertQueryBudget(QUERY_BUDGETS['reconcile']):
+                response = self.client.post(reverse('reconcile'), {}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with self.assertQueryBudget(QUERY_BUDGETS['reconcile:buckets']):
+                response = self.client.post(reverse('reconcile'), {'buckets': ['00', 'ff']}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_export_does_not_grow_with_data(self):
+        self.make_pets(3)
+        with self.settings(EXPORT_CHUNK_SIZE=4):
+            with self.assertQueryBudget(QUERY_BUDGETS['export']):
+                response = self.client.get(reverse('export'))
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_metrics(self):
+        self.user.is_staff = True
+        self.user.save()
+        with self.assertQueryBudget(QUERY_BUDGETS['metrics']):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_upload_is_linear_in_records(self):
+        for count in (1, 3):
+            pets = self.make_pets(count)
+            payload = self.upload_payload(pets)
+            records = sum(1 + len(pet['events']) + len(pet['vaccines']) for pet in payload['pets'])
+            with self.assertQueryBudget(QUERY_BUDGETS['upload'], size=records):
+                response = self.client.post(reverse('upload'), payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_patch_is_linear_in_changed_records(self):
+        for count in (1, 3):
+            pets = self.make_pets(count)
+            updated_at = (timezone.now() + timedelta(minutes=1)).isoformat()
+            payload = {"pets": [{
+                "id": str(pet.id),
+                "changes": {"name": {"value": "Novo nome", "updated_at": updated_at}},
+                "events": [{"id": str(event.id), "changes": {"observation": {"value": "ok", "updated_at": updated_at}}}
+                           for event in pet.events.all()],
+            } for pet in pets]}
+            records = sum(1 + len(pet['events']) for pet in payload['pets'])
+            with self.assertQueryBudget(QUERY_BUDGETS['patch'], size=records):
+                response = self.client.post(reverse('patch'), payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['updated'], records)
+
+    def test_batch_is_linear_in_sub_requests(self):
+        self.make_pets(2)
+        sub_requests = [
+            {"method": "GET", "path": "/api/vaccines/"},
+            {"method": "POST", "path": "/api/sync/check-update", "body": {}},
+        ]
+        with self.assertQueryBudget(QUERY_BUDGETS['batch'], size=len(sub_requests)):
+            response = self.client.post(reverse('batch'), {"requests": sub_requests, "atomic": True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([sub['status'] for sub in response.data['responses']], [status.HTTP_200_OK] * 2)
+
+
+class PerformanceMiddlewareTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass'
+        )
+        self.client.force_authenticate(user=self.user)
+        animal = Animal.objects.create(
+            user=self.user, name="Rex", type="Dog", breed="SRD", date_of_birth="2020-01-01"
+        )
+        Event.objects.create(animal=animal, type="Consulta", date="2023-01-01")
+        # with DATABASE_SHARDS, requests also read the user's directory entry
+        shard_for_user(self.user.pk)
+        self.directory_reads = 1 if settings.DATABASE_SHARDS else 0
+        metrics_registry.reset()
+
+    def test_sampled_request_gets_server_timing_and_is_aggregated(self):
+        self.user.is_staff = True
+        self.user.save()
+        with self.settings(PERF_METRICS_SAMPLE_RATE=1.0):
+            response = self.client.get(reverse('animal-list'))
+
+        timing = response['Server-Timing']
+        self.assertIn('total;dur=', timing)
+        self.assertIn('db;dur=', timing)
+        self.assertIn('serializer;dur=', timing)
+
+        stats = metrics_registry.snapshot()['GET animal-list']
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['queries']['sum'], 3 + self.directory_reads)
+        self.assertEqual(stats['response_bytes']['sum'], len(response.content))
+        self.assertGreater(stats['serializer_ms']['sum'], 0)
+        self.assertEqual(sum(stats['histogram_ms'].values()), 1)
+
+    def test_server_timing_is_for_staff_only(self):
+        with self.settings(PERF_METRICS_SAMPLE_RATE=1.0, PERF_SERVER_TIMING_PUBLIC=False):
+            response = self.client.get(reverse('animal-list'))
+            self.assertNotIn('Server-Timing', response)
+            self.client.force_authenticate(user=None)
+            response = self.client.get(reverse('animal-list'))
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertNotIn('Server-Timing', response)
+        # still aggregated for /api/metrics
+        self.assertEqual(metrics_registry.snapshot()['GET animal-list']['count'], 2)
+
+        with self.settings(PERF_METRICS_SAMPLE_RATE=1.0, PERF_SERVER_TIMING_PUBLIC=True):
+            response = self.client.get(reverse('animal-list'))
+        self.assertIn('Server-Timing', response)
+
+    def test_unsampled_request_is_not_instrumented(self):
+        with self.settings(PERF_METRICS_SAMPLE_RATE=0.0):
+            response = self.client.get(reverse('animal-list'))
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(metrics_registry.snapshot(), {})
+
+    def test_duplicate_queries_are_counted(self):
+        with self.settings(PERF_METRICS_SAMPLE_RATE=1.0):
+            self.client.post(reverse('batch'), {"requests": [
+                {"path": "/api/vaccines/"}, {"path": "/api/vaccines/"}
+            ]}, format='json')
+
+        # the batch and both sub-requests read the same directory entry
+        self.assertEqual(metrics_registry.snapshot()['POST batch']['duplicate_queries'], 1 + 2 * self.directory_reads)
+
+    def test_metrics_endpoint_requires_admin(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        with self.settings(PERF_METRICS_SAMPLE_RATE=1.0):
+            self.client.get(reverse('event-list'))
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('GET event-list', response.data['routes'])
+
+
+class SlowRequestProfilerTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.config = {
+            'ENABLED': True,
+            'THRESHOLD_MS': 0,
+            'PATHS': ['/api/sync/download'],
+            'SAMPLE_INTERVAL_MS': 1,
+            'DIRECTORY': self.directory.name,
+            'MAX_PROFILES': 2,
+        }
+        override = self.settings(SLOW_REQUEST_PROFILING=self.config)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def profiles(self):
+        out = StringIO()
+        call_command('slow_profiles', 'list', stdout=out)
+        return [line.split()[0] for line in out.getvalue().splitlines() if 'ms' in line]
+
+    def test_slow_request_is_captured_with_metadata(self):
+        from .views import SyncDownloadView
+        original = SyncDownloadView.post
+
+        def slow_post(view, request):
+            time.sleep(0.05)
+            return original(view, request)
+
+        with mock.patch.object(SyncDownloadView, 'post', slow_post):
+            self.client.post(reverse('download'), {}, format='json')
+
+        [profile_id] = self.profiles()
+        out = StringIO()
+        call_command('slow_profiles', 'dump', profile_id, stdout=out)
+        profile = json.loads(out.getvalue())
+        self.assertEqual(profile['path'], '/api/sync/download')
+        self.assertEqual(profile['username'], 'testuser')
+        self.assertGreater(profile['payload_bytes'], 0)
+        self.assertGreaterEqual(profile['duration_ms'], 50)
+        self.assertGreater(profile['query_count'], 0)
+        self.assertGreater(profile['samples'], 0)
+        self.assertTrue(any('slow_post' in stack for stack in profile['stacks']))
+
+        out = StringIO()
+        call_command('slow_profiles', 'dump', profile_id, format='collapsed', stdout=out)
+        self.assertIn('slow_post', out.getvalue())
+
+    def test_fast_and_unwatched_requests_are_not_captured(self):
+        with self.settings(SLOW_REQUEST_PROFILING={**self.config, 'THRESHOLD_MS': 60_000}):
+            self.client.post(reverse('download'), {}, format='json')
+        self.client.post(reverse('check_update'), {}, format='json')
+
+        self.assertEqual(self.profiles(), [])
+
+    def test_ring_buffer_keeps_most_recent_profiles(self):
+        for _ in range(3):
+            self.client.post(reverse('download'), {}, format='json')
+        self.assertEqual(len(self.profiles()), 2)
+
+        call_command('slow_profiles', 'clear', stdout=StringIO())
+        self.assertEqual(self.profiles(), [])
+
+
+class FakeTransport:
+    def __init__(self):
+        self.calls = []
+
+    def post(self, path, body, token=None):
+        self.calls.append(path)
+        if path.startswith('/auth/'):
+            return 200, {'access': 'a', 'refresh': 'r'}
+        if path == '/api/sync/download':
+            return 200, {'pets': [{'id': 'pet', 'events': [], 'vaccines': []}]}
+        if path == '/api/sync/upload':
+            return 429, None
+        return 200, {}
+
+    def close(self):
+        pass
+
+
+class LoadTestTests(OneShardMixin, TestCase):
+    def test_saturation_point_is_where_throughput_stops_growing(self):
+        levels = [
+            {'concurrency': 1, 'throughput_rps': 100},
+            {'concurrency': 2, 'throughput_rps': 190},
+            {'concurrency': 4, 'throughput_rps': 195},
+            {'concurrency': 8, 'throughput_rps': 150},
+        ]
+        self.assertEqual(saturation_point(levels), 2)
+        self.assertIsNone(saturation_point(levels[:2]))
+
+    def test_run_load_test_reports_each_level_and_endpoint(self):
+        report = run_load_test(FakeTransport, [('user', 'pass')], [1, 2], duration=0.05,
+                               mix={'check': 1, 'delta': 1, 'upload': 1, 'token': 0})
+
+        self.assertEqual([level['concurrency'] for level in report['levels']], [1, 2])
+        self.assertNotIn('token', report['mix'])
+        for level in report['levels']:
+            self.assertGreater(level['requests'], 0)
+            self.assertEqual(set(level['endpoints']), {'check', 'delta', 'upload'})
+            self.assertEqual(level['endpoints']['upload']['error_rate'], 1.0)
+            self.assertEqual(level['endpoints']['check']['error_rate'], 0.0)
+            self.assertIn('p99', level['endpoints']['check']['latency_ms'])
+
+    def test_virtual_client_keeps_tokens_fresh(self):
+        transport = FakeTransport()
+        client = VirtualClient(transport, 'user', 'pass', random.Random(0))
+        client.login()
+        self.assertEqual(client.op_refresh(), 200)
+        self.assertEqual(transport.calls, ['/auth/token/', '/api/sync/download', '/auth/token/refresh/'])
+
+
+class SyncCostThrottleTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass'
+        )
+        self.client.force_authenticate(user=self.user)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        override = self.settings(
+            REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'sync': '10/hour'}},
+            SYNC_THROTTLE_COSTS={'FULL_DOWNLOAD': 6, 'DELTA_DOWNLOAD': 1, 'UPLOAD_ITEM': 1},
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.since = (timezone.now() - timedelta(hours=1)).isoformat()
+
+    def download(self, body):
+        return self.client.post(reverse('download'), body, format='json')
+
+    def test_full_downloads_cost_more_than_delta(self):
+        self.assertEqual(self.download({}).status_code, status.HTTP_200_OK)
+        response = self.download({})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+        # the rejected full download was not charged: 4 units remain for deltas
+        for _ in range(4):
+            self.assertEqual(self.download({'last_synced_at': self.since}).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.download({'last_synced_at': self.since}).status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_stale_last_synced_at_is_charged_as_full(self):
+        stale = (timezone.now() - timedelta(days=365)).isoformat()
+        self.download({'last_synced_at': stale})
+        self.assertEqual(self.download({'last_synced_at': stale}).status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_invalid_bodies_are_charged_as_delta(self):
+        for _ in range(10):
+            response = self.download({'last_synced_at': "ontem"})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.download({'last_synced_at': "ontem"}).status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_uploads_are_charged_per_item(self):
+        pet_id = str(uuid.uuid4())
+        def payload(events):
+            return {"pets": [{
+                "id": pet_id, "name": "Rex", "type": "Dog", "breed": "SRD",
+                "date_of_birth": "2020-01-01", "updated_at": timezone.now().isoformat(),
+                "events": [{
+                    "id": str(uuid.uuid4()), "type": "Banho", "date": "2023-01-01",
+                    "updated_at": timezone.now().isoformat()
+                } for _ in range(events)]
+            }]}
+
+        response = self.client.post(reverse('upload'), payload(8), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('upload'), payload(1), format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.client.post(reverse('upload'), payload(0), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_polling_is_free_and_budgets_are_per_user(self):
+        self.download({})
+        for _ in range(20):
+            response = self.client.post(reverse('check_update'), {}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        other = User.objects.create_user(username='other', password='pass')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.download({}).status_code, status.HTTP_200_OK)
+
+
+class CachedSchemaTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        override = self.settings(SCHEMA_CACHE_DIR=self.directory.name, SCHEMA_CODE_VERSION='v1')
+        override.enable()
+        self.addCleanup(override.disable)
+        clear_memory_cache()
+        self.addCleanup(clear_memory_cache)
+        self.url = reverse('schema')
+
+    def generate_calls(self):
+        from drf_spectacular.generators import SchemaGenerator
+        return mock.patch.object(SchemaGenerator, 'get_schema', autospec=True, side_effect=SchemaGenerator.get_schema)
+
+    def test_schema_is_generated_once_and_revalidated_with_etag(self):
+        with self.generate_calls() as get_schema:
+            first = self.client.get(self.url, HTTP_ACCEPT='application/vnd.oai.openapi+json')
+            second = self.client.get(self.url, HTTP_ACCEPT='application/vnd.oai.openapi+json')
+            not_modified = self.client.get(self.url, HTTP_ACCEPT='application/vnd.oai.openapi+json',
+                                           HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(get_schema.call_count, 1)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertIn('/api/sync/download', json.loads(first.content)['paths'])
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_formats_are_cached_separately(self):
+        yaml_response = self.client.get(self.url, HTTP_ACCEPT='application/vnd.oai.openapi')
+        json_response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        self.assertTrue(yaml_response.content.startswith(b'openapi:'))
+        self.assertEqual(json_response['Content-Type'], 'application/json')
+        self.assertNotEqual(yaml_response['ETag'], json_response['ETag'])
+
+    def test_other_workers_reuse_the_file_until_code_version_changes(self):
+        call_command('build_schema', stdout=StringIO())
+        clear_memory_cache()
+
+        with self.generate_calls() as get_schema:
+            self.client.get(self.url)
+            self.assertEqual(get_schema.call_count, 0)
+
+            with self.settings(SCHEMA_CODE_VERSION='v2'):
+                clear_memory_cache()
+                self.client.get(self.url)
+            self.assertEqual(get_schema.call_count, 1)
+
+
+LEAN_SCHEMA_SCRIPT = """
+import json, os, tempfile, django
+django.setup()
+from django.test import Client, override_settings
+with override_settings(SCHEMA_CACHE_DIR=tempfile.mkdtemp(), SCHEMA_CODE_VERSION='lean-test'):
+    schema = json.loads(Client().get('/schema/', HTTP_ACCEPT='application/vnd.oai.openapi+json').content)
+print(json.dumps(schema['paths']['/api/animals/']['get']['tags']))
+"""
+
+
+class StartupProfileTests(OneShardMixin, TestCase):
+    def test_lean_worker_boot_skips_admin_and_docs_machinery(self):
+        report = measure_boot('lean')
+        modules = {row['module'] for row in report['modules']}
+
+        self.assertEqual(report['profile'], 'lean')
+        self.assertTrue(modules.isdisjoint({'drf_spectacular.views', 'drf_spectacular.plumbing', 'core.admin'}))
+        self.assertTrue(set(report['apps']).isdisjoint({'django.contrib.admin', 'django.contrib.messages'}))
+        self.assertIn('core', report['apps'])
+
+    def test_lean_profile_still_serves_annotated_schema(self):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='config.settings', DJANGO_STARTUP_PROFILE='lean')
+        result = subprocess.run([sys.executable, '-c', LEAN_SCHEMA_SCRIPT], cwd=settings.BASE_DIR, env=env,
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(json.loads(result.stdout), ['Animais'])
+
+    def test_deferred_annotations_are_replayed_in_order(self):
+        from rest_framework.views import APIView
+
+        with self.settings(API_DOCS_DEFERRED=True):
+            @extend_schema(tags=['Lote'])
+            class DeferredView(APIView):
+                @extend_schema(description='mais recente')
+                @extend_schema(description='primeira')
+                def get(self, request):
+                    pass
+
+            self.assertIsNone(DeferredView.schema)
+            self.assertNotIn('kwargs', vars(DeferredView.get))
+            apply_deferred()
+
+        self.assertEqual(type(vars(DeferredView)['schema']).__name__, 'ExtendedSchema')
+        method_schema = DeferredView.get.kwargs['schema']
+        self.assertEqual(method_schema.__mro__[1].__name__, 'ExtendedSchema')
+
+    def test_parse_importtime(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |     yaml.error\n"
+            "import time:      2000 |       2120 |   yaml\n"
+        )
+        self.assertEqual(parse_importtime(output), [
+            {'module': 'yaml.error', 'depth': 2, 'self_ms': 0.12, 'cumulative_ms': 0.12},
+            {'module': 'yaml', 'depth': 1, 'self_ms': 2.0, 'cumulative_ms': 2.12},
+        ])
+
+    def test_importtime_command(self):
+        out = StringIO()
+        call_command('importtime', profile='lean', top=5, by_package=True, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('Boot (lean):'))
+        self.assertEqual(len(lines), 6)
+
+    def test_importtime_check_enforces_the_budget(self):
+        with self.settings(WORKER_BOOT_BUDGET_MS=0), self.assertRaisesMessage(CommandError, 'budget is 0 ms'):
+            call_command('importtime', profile='lean', top=0, check=True, stdout=StringIO())
+
+
+class SyncPatchTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('patch')
+        self.t0 = timezone.now() - timedelta(hours=1)
+        self.animal = Animal.objects.create(
+            user=self.user, name="Rex", type="Cachorro", breed="Labrador",
+            date_of_birth="2020-01-01", updated_at=self.t0,
+        )
+
+    def patch_pet(self, pet_id, **changes):
+        return self.client.post(self.url, {"pets": [{
+            "id": str(pet_id),
+            "changes": {field: {"value": value, "updated_at": stamp.isoformat()}
+                        for field, (value, stamp) in changes.items()},
+        }]}, format='json')
+
+    def test_creates_records_from_changes(self):
+        pet_id, event_id = uuid.uuid4(), uuid.uuid4()
+        stamp = timezone.now().isoformat()
+        response = self.client.post(self.url, {"pets": [{
+            "id": str(pet_id),
+            "changes": {field: {"value": value, "updated_at": stamp} for field, value in {
+                "name": "Mimi", "type": "Gato", "breed": "Siamês", "date_of_birth": "2021-02-28"}.items()},
+            "events": [{"id": str(event_id), "changes": {
+                "type": {"value": "Consulta", "updated_at": stamp},
+                "date": {"value": "2023-10-10", "updated_at": stamp},
+            }}],
+        }]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'created': 2, 'updated': 0, 'ignored': 0})
+        self.assertEqual(Animal.objects.get(id=pet_id).breed, "Siamês")
+        self.assertEqual(Event.objects.get(id=event_id).animal_id, pet_id)
+
+    def test_edits_to_different_fields_from_two_devices_are_both_kept(self):
+        t1, t2 = self.t0 + timedelta(minutes=1), self.t0 + timedelta(minutes=2)
+        self.patch_pet(self.animal.id, name=("Rex II", t2))
+        response = self.patch_pet(self.animal.id, breed=("Golden", t1), name=("Rex velho", t1))
+
+        self.assertEqual(response.data['updated'], 1)
+        self.animal.refresh_from_db()
+        self.assertEqual((self.animal.name, self.animal.breed), ("Rex II", "Golden"))
+        self.assertEqual(self.animal.updated_at, t2)
+
+    def test_stale_changes_are_ignored(self):
+        response = self.patch_pet(self.animal.id, name=("Antigo", self.t0 - timedelta(days=1)))
+        self.assertEqual(response.data, {'created': 0, 'updated': 0, 'ignored': 1})
+        self.animal.refresh_from_db()
+        self.assertEqual(self.animal.name, "Rex")
+
+    def test_update_writes_only_changed_columns(self):
+        with CaptureQueriesContext(connections[active_alias()]) as ctx:
+            self.patch_pet(self.animal.id, breed=("Golden", timezone.now()))
+        update = next(q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE'))
+        self.assertIn('"breed"', update)
+        self.assertNotIn('"name"', update)
+
+    def test_whole_record_upload_resets_field_timestamps(self):
+        self.patch_pet(self.animal.id, name=("Rex II", self.t0 + timedelta(minutes=5)))
+        self.client.post(reverse('upload'), {"pets": [{
+            "id": str(self.animal.id), "name": "Rex III", "type": "Cachorro", "breed": "Labrador",
+            "date_of_birth": "2020-01-01", "updated_at": (self.t0 + timedelta(minutes=10)).isoformat(),
+        }]}, format='json')
+        self.animal.refresh_from_db()
+        self.assertEqual(self.animal.field_updated_at, {})
+
+        self.patch_pet(self.animal.id, name=("Rex IV", self.t0 + timedelta(minutes=7)))
+        self.animal.refresh_from_db()
+        self.assertEqual(self.animal.name, "Rex III")
+
+    def test_new_record_without_required_fields_is_rejected(self):
+        pet_id = uuid.uuid4()
+        response = self.patch_pet(pet_id, name=("Mimi", timezone.now()))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(pet_id), response.data)
+        self.assertFalse(Animal.objects.filter(id=pet_id).exists())
+
+    def test_unknown_and_invalid_fields_are_rejected(self):
+        response = self.patch_pet(self.animal.id, user=(1, timezone.now()))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.patch_pet(self.animal.id, date_of_birth=("ontem", timezone.now()))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rest_updates_supersede_field_timestamps(self):
+        event = Event.objects.create(animal=self.animal, type="Banho", date="2023-01-01", updated_at=self.t0)
+        self.client.post(self.url, {"pets": [{"id": str(self.animal.id), "changes": {}, "events": [{
+            "id": str(event.id),
+            "changes": {"type": {"value": "Tosa", "updated_at": (self.t0 + timedelta(minutes=5)).isoformat()}},
+        }]}]}, format='json')
+        before = timezone.now()
+        response = self.client.patch(reverse('event-detail', args=[event.id]), {'observation': "Ok"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        event.refresh_from_db()
+        self.assertGreaterEqual(event.updated_at, before)
+        self.assertEqual(event.field_updated_at, {})
+
+    def test_field_timestamps_are_not_exposed(self):
+        self.patch_pet(self.animal.id, name=("Rex II", timezone.now()))
+        response = self.client.get(reverse('animal-detail', args=[self.animal.id]))
+        self.assertNotIn('field_updated_at', response.data)
+
+    def test_ids_of_another_user_are_refused(self):
+        other = User.objects.create_user(username='other', password='x')
+        other_pet = Animal.objects.create(user=other, name="Mimi", type="Gato", breed="SRD",
+                                          date_of_birth="2021-01-01")
+        foreign = Event.objects.create(animal=other_pet, type="Banho", date="2023-01-01")
+        stamp = timezone.now()
+        response = self.client.post(self.url, {"pets": [{
+            "id": str(self.animal.id), "changes": {},
+            "events": [{"id": str(foreign.id), "changes": {
+                "type": {"value": "Consulta", "updated_at": stamp.isoformat()},
+                "date": {"value": "2024-01-01", "updated_at": stamp.isoformat()},
+            }}],
+        }]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(foreign.id), response.data)
+        foreign.refresh_from_db()
+        self.assertEqual((foreign.type, foreign.animal_id), ("Banho", other_pet.id))
+
+    def test_records_sent_under_another_pet_are_refused(self):
+        second = Animal.objects.create(user=self.user, name="Bob", type="Cachorro", breed="SRD",
+                                       date_of_birth="2020-01-01")
+        event = Event.objects.create(animal=second, type="Banho", date="2023-01-01", updated_at=self.t0)
+        response = self.patch_pet_event(self.animal.id, event.id, observation=("Trocado", timezone.now()))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[str(event.id)], ["Registro pertence a outro pet."])
+        event.refresh_from_db()
+        self.assertIsNone(event.observation)
+
+    def patch_pet_event(self, pet_id, event_id, **changes):
+        return self.client.post(self.url, {"pets": [{
+            "id": str(pet_id), "changes": {},
+            "events": [{"id": str(event_id), "changes": {
+                field: {"value": value, "updated_at": stamp.isoformat()}
+                for field, (value, stamp) in changes.items()
+            }}],
+        }]}, format='json')
+
+
+class SyncReconcileTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('reconcile')
+        stamp = timezone.now().isoformat()
+        self.client.post(reverse('upload'), {"pets": [{
+            "id": str(uuid.uuid4()), "name": f"Pet {i}", "type": "Gato", "breed": "SRD",
+            "date_of_birth": "2020-01-01", "updated_at": stamp,
+            "events": [{"id": str(uuid.uuid4()), "type": "Consulta", "date": "2023-01-01", "updated_at": stamp}
+                       for _ in range(3)],
+            "vaccines": [{"id": str(uuid.uuid4()), "name": "V8", "application_date": "2023-01-01", "updated_at": stamp}],
+        } for i in range(3)]}, format='json')
+
+    def stored_buckets(self):
+        return set(SyncBucket.objects.filter(user=self.user).values_list('bucket', 'hash', 'count'))
+
+    def client_buckets(self):
+        """What a device computes from a full download."""
+        data = self.client.post(reverse('download'), {}, format='json').data
+        buckets = {}
+        rows = [('animal', pet) for pet in data['pets']]
+        rows += [(model, child) for pet in data['pets'] for model, key in (('event', 'events'), ('vaccine', 'vaccines'))
+                 for child in pet[key]]
+        for model, row in rows:
+            value, count = buckets.get(bucket_of(row['id']), (0, 0))
+            buckets[bucket_of(row['id'])] = (value ^ leaf_hash(model, row['id'], row['updated_at']), count + 1)
+        return buckets
+
+    def test_incremental_buckets_match_a_rebuild(self):
+        pet = Animal.objects.filter(user=self.user).first()
+        self.client.put(reverse('animal-detail', args=[pet.id]), {
+            "name": "Renomeado", "type": pet.type, "breed": pet.breed, "date_of_birth": "2020-01-01",
+        }, format='json')
+        self.client.post(reverse('patch'), {"pets": [{"id": str(pet.id), "events": [{
+            "id": str(pet.events.first().id),
+            "changes": {"observation": {"value": "ok", "updated_at": (timezone.now() + timedelta(hours=1)).isoformat()}},
+        }]}]}, format='json')
+        self.client.delete(reverse('vaccine-detail', args=[pet.vaccines.first().id]))
+        self.client.delete(reverse('animal-detail', args=[Animal.objects.filter(user=self.user).last().id]))
+        incremental = self.stored_buckets()
+
+        rebuild_buckets(self.user.id)
+        self.assertEqual(incremental, self.stored_buckets())
+        self.assertEqual(sum(count for _, _, count in incremental), 2 + 2 * 3 + 1)
+
+    def test_root_matches_client_computation(self):
+        local = self.client_buckets()
+        root = 0
+        for value, _ in local.values():
+            root ^= value
+
+        response = self.client.post(self.url, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['hash'], format_hash(root))
+        self.assertEqual(response.data['count'], 15)
+        self.assertEqual(len(response.data['children']), 16)
+
+    def test_walk_down_to_the_drifted_bucket(self):
+        local = self.client_buckets()
+        missing = Event.objects.filter(animal__user=self.user).first()
+        bucket = bucket_of(missing.id)
+        value, count = local[bucket]
+        local[bucket] = (value ^ leaf_hash('event', missing.id, missing.updated_at), count - 1)
+
+        def differing(node):
+            diffs = []
+            for child in node['children']:
+                mine, mine_count = 0, 0
+                for key, (value, count) in local.items():
+                    if key.startswith(child['key']):
+                        mine ^= value
+                        mine_count += count
+                if (format_hash(mine), mine_count) != (child['hash'], child['count']):
+                    diffs.append(child['key'])
+            return diffs
+
+        groups = differing(self.client.post(self.url, {}, format='json').data)
+        self.assertEqual(groups, [bucket[0]])
+        buckets = differing(self.client.post(self.url, {'prefix': groups[0]}, format='json').data)
+        self.assertEqual(buckets, [bucket])
+
+        listed = self.client.post(self.url, {'buckets': buckets}, format='json').data['buckets'][bucket]
+        self.assertIn({'model': 'event', 'id': str(missing.id), 'updated_at': missing.updated_at.isoformat().replace('+00:00', 'Z')}, listed)
+
+    def test_bucket_listing_returns_only_the_requested_buckets(self):
+        ids = [*Animal.objects.values_list('id', flat=True), *Event.objects.values_list('id', flat=True),
+               *Vaccine.objects.values_list('id', flat=True)]
+        wanted = sorted({bucket_of(object_id) for object_id in ids[:2]})
+        with CaptureQueriesContext(connections[active_alias()]) as queries:
+            response = self.client.post(self.url, {'buckets': wanted}, format='json')
+
+        self.assertEqual(set(response.data['buckets']), set(wanted))
+        listed = {row['id'] for rows in response.data['buckets'].values() for row in rows}
+        self.assertEqual(listed, {str(object_id) for object_id in ids if bucket_of(object_id) in wanted})
+        self.assertFalse([query for query in queries.captured_queries if 'LIKE' in query['sql']])
+
+    def test_bucket_requests_are_validated(self):
+        self.assertEqual(self.client.post(self.url, {'buckets': ['zz']}, format='json').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        too_many = [f'{i:02x}' for i in range(settings.SYNC_RECONCILE_MAX_BUCKETS + 1)]
+        self.assertEqual(self.client.post(self.url, {'buckets': too_many}, format='json').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_users_without_buckets_are_built_on_first_use(self):
+        SyncBucket.objects.filter(user=self.user).delete()
+        response = self.client.post(self.url, {}, format='json')
+        self.assertEqual(response.data['count'], 15)
+
+        SyncBucket.objects.filter(user=self.user).update(hash=0)
+        out = StringIO()
+        call_command('rebuild_sync_buckets', user=['testuser'], stdout=out)
+        self.assertIn('1 users', out.getvalue())
+        self.assertEqual(self.client.post(self.url, {}, format='json').data['hash'], response.data['hash'])
+
+
+class SyncSnapshotTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        override = self.settings(SYNC_SNAPSHOTS={
+            'DIRECTORY': self.directory.name, 'MIN_RECORDS': 3, 'MAX_AGE_HOURS': 24, 'ACCEL_REDIRECT_PREFIX': None,
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('download')
+        self.animal = Animal.objects.create(user=self.user, name="Rex", type="Cachorro", breed="SRD",
+                                            date_of_birth="2020-01-01")
+        for day in range(1, 4):
+            Event.objects.create(animal=self.animal, type="Consulta", date=f"2023-01-0{day}")
+
+    def full_download(self, **headers):
+        return self.client.post(self.url, {}, format='json', **headers)
+
+    def read_snapshot(self, response):
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        return json.loads(gzip.decompress(b''.join(response.streaming_content)))
+
+    def test_command_builds_snapshots_for_large_accounts_only(self):
+        small = User.objects.create_user(username='small', password='x')
+        Animal.objects.create(user=small, name="Mimi", type="Gato", breed="SRD", date_of_birth="2021-01-01")
+
+        out = StringIO()
+        call_command('build_sync_snapshots', stdout=out)
+
+        self.assertIn('Built 1 snapshots (4 records', out.getvalue())
+        snapshot = SyncSnapshot.objects.get()
+        self.assertEqual(snapshot.user, self.user)
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, snapshot.file_name)))
+
+    def test_full_download_serves_the_snapshot(self):
+        snapshot = build_snapshot(self.user)
+        live = json.loads(self.full_download().content)
+        response = self.full_download(HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        data = self.read_snapshot(response)
+        self.assertEqual(response['X-Sync-Snapshot'], snapshot.cursor.isoformat())
+        self.assertEqual(data['pets'], live['pets'])
+        self.assertTrue(data['full_sync'])
+
+    def test_delta_after_snapshot_catches_up(self):
+        build_snapshot(self.user)
+        data = self.read_snapshot(self.full_download(HTTP_ACCEPT_ENCODING='gzip'))
+        event = Event.objects.create(animal=self.animal, type="Banho", date="2023-02-01")
+
+        delta = self.client.post(self.url, {'last_synced_at': data['synced_at']}, format='json').data
+        self.assertEqual([e['id'] for e in delta['pets'][0]['events'] if e['type'] == 'Banho'], [str(event.id)])
+
+    def test_offline_upload_older_than_the_cursor_is_not_lost(self):
+        snapshot = build_snapshot(self.user)
+        first = self.read_snapshot(self.full_download(HTTP_ACCEPT_ENCODING='gzip'))
+        # edited offline before the build, uploaded after it
+        event_id = str(uuid.uuid4())
+        response = self.client.post(reverse('upload'), {"pets": [{
+            "id": str(self.animal.id), "name": "Rex", "type": "Cachorro", "breed": "SRD",
+            "date_of_birth": "2020-01-01", "updated_at": self.animal.updated_at,
+            "events": [{"id": event_id, "type": "Banho", "date": "2023-02-01",
+                        "updated_at": snapshot.cursor - timedelta(hours=1)}],
+        }]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertFalse(SyncSnapshot.objects.exists())
+        self.assertEqual(os.listdir(self.directory.name), [])
+        response = self.full_download(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.streaming)
+        self.assertIn(event_id, [e['id'] for e in response.data['pets'][0]['events']])
+        self.assertNotIn(event_id, [e['id'] for e in first['pets'][0]['events']])
+
+    def test_rest_writes_discard_the_snapshot(self):
+        build_snapshot(self.user)
+        response = self.client.patch(reverse('animal-detail', args=[self.animal.id]), {'name': "Rex II"},
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(SyncSnapshot.objects.exists())
+
+    def test_falls_back_to_live_download(self):
+        build_snapshot(self.user)
+        self.assertFalse(self.full_download().streaming)
+
+        SyncSnapshot.objects.update(cursor=timezone.now() - timedelta(hours=25))
+        self.assertFalse(self.full_download(HTTP_ACCEPT_ENCODING='gzip').streaming)
+
+        SyncSnapshot.objects.update(cursor=timezone.now())
+        os.remove(os.path.join(self.directory.name, SyncSnapshot.objects.get().file_name))
+        self.assertFalse(self.full_download(HTTP_ACCEPT_ENCODING='gzip').streaming)
+
+    def test_rebuild_replaces_the_previous_file(self):
+        first = build_snapshot(self.user).file_name
+        time.sleep(0.002)
+        second = build_snapshot(self.user).file_name
+        self.assertNotEqual(first, second)
+        self.assertEqual(os.listdir(self.directory.name), [second])
+
+    def test_accel_redirect(self):
+        snapshot = build_snapshot(self.user)
+        conf = dict(settings.SYNC_SNAPSHOTS, ACCEL_REDIRECT_PREFIX='/_snapshots/')
+        with self.settings(SYNC_SNAPSHOTS=conf):
+            response = self.full_download(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['X-Accel-Redirect'], f'/_snapshots/{snapshot.file_name}')
+        self.assertEqual(response.content, b'')
+
+
+class ExportTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('export')
+        self.animal = Animal.objects.create(user=self.user, name="Rex", type="Cachorro", breed="SRD",
+                                            date_of_birth="2020-01-01")
+        for day in range(1, 6):
+            Event.objects.create(animal=self.animal, type="Consulta", date=f"2023-01-0{day}",
+                                 observation=f"Retorno, dia {day}")
+        Vaccine.objects.create(animal=self.animal, name="V10", application_date="2023-01-01")
+
+        other = User.objects.create_user(username='other', password='x')
+        other_pet = Animal.objects.create(user=other, name="Mimi", type="Gato", breed="SRD",
+                                          date_of_birth="2021-01-01")
+        Event.objects.create(animal=other_pet, type="Banho", date="2023-01-01")
+
+    def download(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_csv_export(self):
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            archive = self.download()
+        self.assertEqual(archive.namelist(), ['animals.csv', 'events.csv', 'vaccines.csv'])
+
+        events = list(csv.DictReader(io.StringIO(archive.read('events.csv').decode())))
+        self.assertEqual(len(events), 5)
+        self.assertEqual({event['animal'] for event in events}, {str(self.animal.id)})
+        self.assertIn("Retorno, dia 3", [event['observation'] for event in events])
+        vaccine = next(csv.DictReader(io.StringIO(archive.read('vaccines.csv').decode())))
+        self.assertEqual((vaccine['application_date'], vaccine['next_dose_date']), ('2023-01-01', ''))
+
+    def test_ndjson_export(self):
+        archive = self.download(data_format='ndjson')
+        animals = [json.loads(line) for line in archive.read('animals.ndjson').decode().splitlines()]
+        self.assertEqual(animals, [{
+            'id': str(self.animal.id), 'name': "Rex", 'type': "Cachorro", 'breed': "SRD",
+            'date_of_birth': "2020-01-01", 'updated_at': animals[0]['updated_at'],
+        }])
+        self.assertEqual(len(archive.read('events.ndjson').decode().splitlines()), 5)
+
+    def test_large_history_is_streamed_in_pieces(self):
+        Event.objects.bulk_create([
+            Event(animal=self.animal, type="Consulta", date="2023-01-01", observation=os.urandom(100).hex())
+            for _ in range(1000)
+        ])
+        with self.settings(EXPORT_CHUNK_SIZE=100):
+            chunks = [chunk for chunk in self.client.get(self.url).streaming_content]
+        self.assertTrue(chunks[0].startswith(b'PK\x03\x04'))
+        self.assertGreater(len(chunks), 5)
+        self.assertLess(max(map(len, chunks)), sum(map(len, chunks)) / 3)
+
+    def test_invalid_format(self):
+        response = self.client.get(self.url, {'data_format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ImportHistoryTests(OneShardMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='clinic', password='testpass')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.pet_ids = [str(uuid.uuid4()) for _ in range(3)]
+        self.write('animals.csv', ['id', 'name', 'type', 'breed', 'date_of_birth', 'updated_at'], [
+            [pet_id, f"Pet {n}", "Cachorro", "SRD", "2020-01-01", "2024-01-01T00:00:00Z"]
+            for n, pet_id in enumerate(self.pet_ids)
+        ])
+        self.write('events.csv', ['id', 'animal', 'type', 'date', 'observation', 'updated_at'], [
+            [str(uuid.uuid4()), self.pet_ids[n % 3], "Consulta", "2023-01-01", "" if n % 2 else "Retorno",
+             "2024-01-01T00:00:00Z"]
+            for n in range(10)
+        ])
+
+    def write(self, name, header, rows):
+        with open(os.path.join(self.directory.name, name), 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    def run_import(self, *args, source=None):
+        out, err = StringIO(), StringIO()
+        call_command('import_history', source or self.directory.name, '--user', 'clinic', '--batch-size', '4',
+                     *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_imports_in_batches(self):
+        out, _ = self.run_import()
+        self.assertIn("animals.csv: 3 imported", out)
+        self.assertIn("events.csv: 10 imported", out)
+        self.assertEqual(Animal.objects.filter(user=self.user).count(), 3)
+        event = Event.objects.filter(observation__isnull=True).first()
+        self.assertEqual(event.content_hash, event.compute_content_hash())
+        self.assertEqual(sum(SyncBucket.objects.filter(user=self.user).values_list('count', flat=True)), 13)
+
+        out, _ = self.run_import()
+        self.assertIn("events.csv: 0 imported, 10 already present", out)
+
+    def test_imported_rows_reach_delta_downloads(self):
+        last_sync = timezone.now()
+        self.run_import()
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.post(reverse('download'), {'last_synced_at': last_sync.isoformat()}, format='json')
+        self.assertEqual(sorted(pet['id'] for pet in response.data['pets']), sorted(self.pet_ids))
+        self.assertEqual(sum(len(pet['events']) for pet in response.data['pets']), 10)
+        response = client.post(reverse('check_update'), {'last_synced_at': last_sync.isoformat()}, format='json')
+        self.assertTrue(response.data['has_updates'])
+
+        # the original stamp still decides field merges
+        pet = Animal.objects.get(id=self.pet_ids[0])
+        self.assertGreater(pet.updated_at, last_sync)
+        self.assertEqual(pet.field_timestamp('name'), datetime(2024, 1, 1, tzinfo=dt_timezone.utc))
+
+    def test_invalid_rows_are_rejected(self):
+        stranger = Animal.objects.create(user=User.objects.create_user(username='other', password='x'),
+                                         name="Mimi", type="Gato", breed="SRD", date_of_birth="2021-01-01")
+        with open(os.path.join(self.directory.name, 'vaccines.ndjson'), 'w') as fp:
+            fp.write(json.dumps({'id': str(uuid.uuid4()), 'animal': self.pet_ids[0], 'name': "V10",
+                                 'application_date': "2023-13-01", 'updated_at': "2024-01-01T00:00:00Z"}) + '\n')
+            fp.write(json.dumps({'id': str(uuid.uuid4()), 'animal': str(stranger.id), 'name': "V10",
+                                 'application_date': "2023-01-01", 'updated_at': "2024-01-01T00:00:00Z"}) + '\n')
+
+        out, err = self.run_import()
+        self.assertIn("vaccines.ndjson: 0 imported, 0 already present, 2 rejected", out)
+        self.assertIn("vaccines.ndjson row 1: {'application_date'", err)
+        self.assertIn("vaccines.ndjson row 2: {'animal'", err)
+        self.assertFalse(Vaccine.objects.exists())
+
+    def test_resume_from_checkpoint(self):
+        checkpoint = os.path.join(self.directory.name, 'progress.json')
+        with open(checkpoint, 'w') as fp:
+            json.dump({'user': 'clinic', 'files': {'animals.csv': 3, 'events.csv': 8}}, fp)
+        Animal.objects.bulk_create([
+            Animal(id=pet_id, user=self.user, name="Pet", type="Cachorro", breed="SRD", date_of_birth="2020-01-01")
+            for pet_id in self.pet_ids
+        ])
+
+        out, _ = self.run_import('--checkpoint', checkpoint, '--resume')
+        self.assertIn("events.csv: 2 imported", out)
+        self.assertEqual(Event.objects.count(), 2)
+        with open(checkpoint) as fp:
+            self.assertEqual(json.load(fp)['files'], {'animals.csv': 3, 'events.csv': 10})
+
+    def test_imports_an_export_archive(self):
+        source = User.objects.create_user(username='source', password='x')
+        pet = Animal.objects.create(user=source, name="Rex", type="Cachorro", breed="SRD", date_of_birth="2020-01-01")
+        Event.objects.create(animal=pet, type="Consulta", date="2023-01-01")
+        archive = os.path.join(self.directory.name, 'export.zip')
+        with open(archive, 'wb') as fp:
+            fp.writelines(export_chunks(source, 'ndjson'))
+        pet.delete()
+
+        out, _ = self.run_import(source=archive)
+        self.assertIn("animals.ndjson: 1 imported", out)
+        self.assertEqual(Event.objects.get().animal.user, self.user)
+
+
+class ArchiveTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.animal = Animal.objects.create(user=self.user, name="Rex", type="Cachorro", breed="SRD",
+                                            date_of_birth="2015-01-01")
+        self.old_event = Event.objects.create(animal=self.animal, type="Consulta", date="2016-03-01",
+                                              observation="Primeira consulta")
+        self.recent_event = Event.objects.create(animal=self.animal, type="Banho", date=timezone.now().date())
+        self.old_vaccine = Vaccine.objects.create(animal=self.animal, name="V10", application_date="2016-03-01",
+                                                  next_dose_date="2017-03-01")
+        # still due: stays in place however old the application is
+        self.booster = Vaccine.objects.create(animal=self.animal, name="Raiva", application_date="2016-03-01",
+                                              next_dose_date=timezone.now().date() + timedelta(days=30))
+        old = timezone.now() - timedelta(days=settings.ARCHIVE_HORIZON_DAYS + 1)
+        Event.objects.filter(pk=self.old_event.pk).update(updated_at=old)
+        Vaccine.objects.filter(animal=self.animal).update(updated_at=old)
+        rebuild_buckets(self.user.id)
+
+    def archive(self):
+        out = StringIO()
+        call_command('archive_history', '--batch-size', '1', stdout=out)
+        return out.getvalue()
+
+    def test_moves_old_rows_and_keeps_tree_hash(self):
+        before = tree(self.user.id)
+        out = self.archive()
+        self.assertIn("Archived 1 events", out)
+        self.assertEqual(list(Event.objects.values_list('id', flat=True)), [self.recent_event.id])
+        self.assertEqual(list(ArchivedEvent.objects.values_list('id', flat=True)), [self.old_event.id])
+        self.assertEqual(list(ArchivedVaccine.objects.values_list('id', flat=True)), [self.old_vaccine.id])
+        self.assertTrue(Vaccine.objects.filter(pk=self.booster.pk).exists())
+        self.assertEqual(tree(self.user.id), before)
+        rebuild_buckets(self.user.id)
+        self.assertEqual(tree(self.user.id), before)
+
+    def test_horizon_must_exceed_tombstone_retention(self):
+        with self.assertRaises(CommandError):
+            call_command('archive_history', '--days', str(settings.SYNC_TOMBSTONE_RETENTION_DAYS))
+
+    def test_lists_include_archived_rows_on_request(self):
+        self.archive()
+        url = reverse('event-list')
+        response = self.client.get(url, {'ordering': 'date'})
+        self.assertEqual([event['id'] for event in response.data], [str(self.recent_event.id)])
+        response = self.client.get(url, {'ordering': 'date', 'include_archived': 'true'})
+        self.assertEqual([event['id'] for event in response.data],
+                         [str(self.old_event.id), str(self.recent_event.id)])
+
+        response = self.client.get(reverse('animal-list'), {'include_archived': 'true'})
+        self.assertEqual(len(response.data[0]['events']), 2)
+        self.assertEqual(len(response.data[0]['vaccines']), 2)
+
+    def test_detail_routes_reach_archived_rows(self):
+        self.archive()
+        url = reverse('event-detail', args=[self.old_event.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['observation'], "Primeira consulta")
+        self.assertFalse(Event.objects.filter(pk=self.old_event.pk).exists())
+
+        response = self.client.patch(url, {'observation': "Revisada"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Event.objects.get(pk=self.old_event.pk).observation, "Revisada")
+        self.assertFalse(ArchivedEvent.objects.exists())
+
+        other = User.objects.create_user(username='other', password='x')
+        self.client.force_authenticate(user=other)
+        response = self.client.get(reverse('vaccine-detail', args=[self.old_vaccine.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upload_restores_archived_rows(self):
+        self.archive()
+        response = self.client.post(reverse('upload'), {"pets": [{
+            "id": str(self.animal.id), "name": "Rex", "type": "Cachorro", "breed": "SRD",
+            "date_of_birth": "2015-01-01", "updated_at": timezone.now() - timedelta(days=1000),
+            "events": [{"id": str(self.old_event.id), "type": "Consulta", "date": "2016-03-01",
+                        "observation": "Corrigida", "updated_at": timezone.now()}],
+        }]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(Event.objects.get(pk=self.old_event.pk).observation, "Corrigida")
+        self.assertFalse(ArchivedEvent.objects.exists())
+
+    def test_upload_moving_an_archived_row_inside_the_horizon_restores_it(self):
+        self.archive()
+        response = self.client.post(reverse('upload'), {"pets": [{
+            "id": str(self.animal.id), "name": "Rex", "type": "Cachorro", "breed": "SRD",
+            "date_of_birth": "2015-01-01", "updated_at": timezone.now() - timedelta(days=1000),
+            "events": [{"id": str(self.old_event.id), "type": "Consulta", "date": timezone.now().date(),
+                        "observation": "Remarcada", "updated_at": timezone.now()}],
+        }]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(Event.objects.get(pk=self.old_event.pk).observation, "Remarcada")
+        self.assertFalse(ArchivedEvent.objects.filter(pk=self.old_event.pk).exists())
+        response = self.client.get(reverse('event-list'), {'include_archived': 'true'})
+        self.assertEqual(len(response.data), 2)
+        rebuilt = tree(self.user.id)
+        self.assertEqual(rebuilt['count'], 5)
+        rebuild_buckets(self.user.id)
+        self.assertEqual(tree(self.user.id), rebuilt)
+
+    def test_full_download_with_archived_rows(self):
+        self.archive()
+        response = self.client.post(reverse('download'), {}, format='json')
+        self.assertEqual(len(response.data['pets'][0]['events']), 1)
+        response = self.client.post(reverse('download'), {'include_archived': True}, format='json')
+        self.assertEqual({event['id'] for event in response.data['pets'][0]['events']},
+                         {str(self.old_event.id), str(self.recent_event.id)})
+
+    def test_export_includes_archived_rows(self):
+        self.archive()
+        response = self.client.get(reverse('export'))
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        events = list(csv.DictReader(io.StringIO(archive.read('events.csv').decode())))
+        self.assertEqual(len(events), 2)
+
+
+class AnimalStatsTests(OneShardMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.animal = Animal.objects.create(user=self.user, name="Rex", type="Cachorro", breed="SRD",
+                                            date_of_birth="2020-01-01")
+        self.today = timezone.now().date()
+        Event.objects.create(animal=self.animal, type="Consulta", date="2023-01-10")
+        self.visit = Event.objects.create(animal=self.animal, type="Consulta", date="2023-05-10")
+        Event.objects.create(animal=self.animal, type="Banho", date="2023-06-01")
+        Vaccine.objects.create(animal=self.animal, name="V10", application_date="2023-01-01",
+                               next_dose_date=self.today - timedelta(days=10))
+        Vaccine.objects.create(animal=self.animal, name="Raiva", application_date="2023-01-01",
+                               next_dose_date=self.today + timedelta(days=20))
+        self.url = reverse('animal-stats', args=[self.animal.id])
+
+    def stats(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def assert_matches_rebuild(self):
+        stored = AnimalStats.objects.get(animal=self.animal)
+        rebuilt = rebuild_stats([self.animal.id])[0]
+        for field in ('event_counts', 'last_event_dates', 'vaccine_count', 'latest_doses'):
+            self.assertEqual(getattr(stored, field), getattr(rebuilt, field), field)
+
+    def test_stats_endpoint(self):
+        data = self.stats()
+        self.assertEqual(data['event_count'], 3)
+        self.assertEqual(data['event_counts'], {"Consulta": 2, "Banho": 1})
+        self.assertEqual(data['last_vet_visit'], "2023-05-10")
+        self.assertEqual(data['vaccine_count'], 2)
+        self.assertEqual(data['vaccines_overdue'], 1)
+        self.assertEqual(data['next_dose_date'], (self.today + timedelta(days=20)).isoformat())
+
+        response = self.client.get(reverse('animal-stats-list'))
+        self.assertEqual([row['animal'] for row in response.data], [str(self.animal.id)])
+
+    def test_rest_writes_update_stats_incrementally(self):
+        self.stats()
+        response = self.client.patch(reverse('event-detail', args=[self.visit.id]), {'type': "Banho"},
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = self.stats()
+        self.assertEqual(data['event_counts'], {"Consulta": 1, "Banho": 2})
+        self.assertEqual(data['last_vet_visit'], "2023-01-10")
+        self.client.delete(reverse('event-detail', args=[self.visit.id]))
+        self.assertEqual(self.stats()['last_event_dates'], {"Consulta": "2023-01-10", "Banho": "2023-06-01"})
+        self.assert_matches_rebuild()
+
+    def test_sync_merges_update_stats(self):
+        self.stats()
+        event_id, vaccine_id = uuid.uuid4(), uuid.uuid4()
+        stamp = timezone.now().isoformat()
+        response = self.client.post(reverse('patch'), {"pets": [{
+            "id": str(self.animal.id), "changes": {},
+            "events": [{"id": str(event_id), "changes": {
+                "type": {"value": "Consulta", "updated_at": stamp},
+                "date": {"value": "2024-02-01", "updated_at": stamp},
+            }}],
+            "vaccines": [{"id": str(vaccine_id), "changes": {
+                "name": {"value": "Gripe", "updated_at": stamp},
+                "application_date": {"value": "2024-02-01", "updated_at": stamp},
+                "next_dose_date": {"value": (self.today - timedelta(days=1)).isoformat(), "updated_at": stamp},
+            }}],
+        }]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('upload'), {"pets": [{
+            "id": str(self.animal.id), "name": "Rex", "type": "Cachorro", "breed": "SRD",
+            "date_of_birth": "2020-01-01", "updated_at": timezone.now() - timedelta(days=1000),
+            "events": [{"id": str(uuid.uuid4()), "type": "Exame", "date": "2024-03-01",
+                        "updated_at": timezone.now()}],
+        }]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = self.stats()
+        self.assertEqual(data['event_count'], 5)
+        self.assertEqual(data['last_vet_visit'], "2024-03-01")
+        self.assertEqual(data['vaccines_overdue'], 2)
+        self.assert_matches_rebuild()
+
+    def test_boosters_supersede_earlier_doses(self):
+        self.stats()
+        shots = [
+            Vaccine.objects.create(animal=self.animal, name="Raiva", application_date=applied,
+                                   next_dose_date=applied + timedelta(days=365))
+            for applied in (self.today - timedelta(days=365 * years + 30) for years in range(4, -1, -1))
+        ]
+        data = self.stats()
+        # V10's dose is due; only the latest of the six rabies doses counts, and it isn't
+        self.assertEqual(data['vaccines_overdue'], 1)
+        self.assertEqual(data['next_dose_date'], shots[-1].next_dose_date.isoformat())
+        self.assert_matches_rebuild()
+
+        self.client.delete(reverse('vaccine-detail', args=[shots[-1].id]))
+        self.assertEqual(self.stats()['vaccines_overdue'], 2)
+        self.assert_matches_rebuild()
+
+    def test_archiving_keeps_stats(self):
+        before = self.stats()
+        Event.objects.filter(animal=self.animal).update(
+            updated_at=timezone.now() - timedelta(days=settings.ARCHIVE_HORIZON_DAYS + 1)
+        )
+        call_command('archive_history', stdout=StringIO())
+        self.assertEqual(ArchivedEvent.objects.count(), 3)
+        self.assertEqual(self.stats(), {**before, 'updated_at': self.stats()['updated_at']})
+
+    def test_rebuild_command_repairs_drift(self):
+        self.stats()
+        AnimalStats.objects.filter(animal=self.animal).update(event_counts={"Banho": 40}, vaccine_count=0)
+        out = StringIO()
+        call_command('rebuild_animal_stats', '--user', 'testuser', stdout=out)
+        self.assertIn("Rebuilt statistics for 1 pets.", out.getvalue())
+        self.assertEqual(self.stats()['event_counts'], {"Consulta": 2, "Banho": 1})
+        self.assertEqual(self.stats()['vaccine_count'], 2)
+
+    def test_deleting_a_pet_removes_its_stats(self):
+        self.stats()
+        response = self.client.delete(reverse('animal-detail', args=[self.animal.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(AnimalStats.objects.exists())
+
+
+class GroupCommitTests(OneShardMixin, TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+
+    def submit_concurrently(self, coordinator, works):
+        barrier = threading.Barrier(len(works))
+        outcomes = [None] * len(works)
+        # threads start without the test's shard scope
+        alias = active_alias()
+
+        def submit(n, work):
+            barrier.wait()
+            try:
+                with use_shard(alias):
+                    outcomes[n] = coordinator.submit(alias, work)
+            except Exception as exc:
+                outcomes[n] = exc
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=submit, args=(n, work)) for n, work in enumerate(works)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_concurrent_merges_share_a_transaction_with_own_outcomes(self):
+        def create(name, fail=False):
+            def work():
+                Animal.objects.create(user=self.user, name=name, type="Cachorro", breed="SRD",
+                                      date_of_birth="2020-01-01")
+                if fail:
+                    raise ValueError(name)
+                return threading.get_ident()
+            return work
+
+        outcomes = self.submit_concurrently(WriteCoordinator(window_ms=500), [
+            create("Rex"), create("Mimi"), create("Bob", fail=True), create("Luna"),
+        ])
+        self.assertIsInstance(outcomes[2], ValueError)
+        # one leader thread ran every merge
+        self.assertEqual(len({outcomes[0], outcomes[1], outcomes[3]}), 1)
+        self.assertEqual(set(Animal.objects.values_list('name', flat=True)), {"Rex", "Mimi", "Luna"})
+
+    def test_full_group_commits_without_waiting_for_the_window(self):
+        started = time.perf_counter()
+        outcomes = self.submit_concurrently(WriteCoordinator(window_ms=10_000, max_batch=2),
+                                            [lambda: 1, lambda: 2])
+        self.assertEqual(sorted(outcomes), [1, 2])
+        self.assertLess(time.perf_counter() - started, 5)
+
+    @override_settings(SYNC_GROUP_COMMIT={'ENABLED': True, 'WINDOW_MS': 1, 'MAX_BATCH': 32, 'MAX_ITEMS': 20})
+    def test_upload_through_coordinator(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.post(reverse('upload'), {"pets": [{
+            "id": str(uuid.uuid4()), "name": "Rex", "type": "Cachorro", "breed": "SRD",
+            "date_of_birth": "2020-01-01", "updated_at": timezone.now(),
+        }]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 1)
+        response = client.post(reverse('patch'), {"pets": [{"id": str(uuid.uuid4()), "changes": {
+            "name": {"value": "Mimi", "updated_at": timezone.now().isoformat()},
+        }}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Animal.objects.count(), 1)
+
+
+@skipIf(settings.DATABASE_SHARDS, "the admin is not registered with DATABASE_SHARDS")
+class AdminTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_superuser(username='suporte', password='x', email='s@example.com')
+        self.client.force_login(self.staff)
+        self.owner = User.objects.create_user(username='tutor', password='x')
+        self.animal = Animal.objects.create(user=self.owner, name="Rex", type="Cachorro", breed="SRD",
+                                            date_of_birth="2020-01-01")
+        self.other = Animal.objects.create(user=self.staff, name="Mimi", type="Gato", breed="SRD",
+                                           date_of_birth="2020-01-01")
+        for day in range(1, 6):
+            Event.objects.create(animal=self.animal, type="Consulta", date=f"2023-01-0{day}")
+        self.other_event = Event.objects.create(animal=self.other, type="Banho", date="2023-01-01")
+
+    def changelist(self, model, **params):
+        response = self.client.get(reverse(f'admin:core_{model}_changelist'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as few:
+            self.changelist('event')
+        for day in range(1, 21):
+            Event.objects.create(animal=self.other, type="Banho", date=f"2023-02-{day:02d}")
+        with CaptureQueriesContext(connection) as many:
+            self.changelist('event')
+        self.assertEqual(len(many), len(few))
+
+    def test_search_uses_exact_ids_and_names(self):
+        response = self.changelist('event', q=str(self.animal.id))
+        self.assertEqual(response.context['cl'].result_count, 5)
+        response = self.changelist('event', q='suporte')
+        self.assertEqual(list(response.context['cl'].result_list), [self.other_event])
+        response = self.changelist('animal', q='Rex')
+        self.assertEqual(list(response.context['cl'].result_list), [self.animal])
+        self.assertEqual(self.changelist('animal', q='Re').context['cl'].result_count, 0)
+
+    def test_count_is_capped(self):
+        with self.settings(ADMIN_EXACT_COUNT_LIMIT=3):
+            self.assertEqual(EstimatedCountPaginator(Event.objects.order_by('-id'), 2).count, 4)
+        self.assertEqual(EstimatedCountPaginator(Event.objects.order_by('-id'), 2).count, 6)
+
+    def test_animal_autocomplete(self):
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'core', 'model_name': 'event', 'field_name': 'animal', 'term': 'Rex',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['id'] for row in response.json()['results']], [str(self.animal.id)])
+
+
+class AdminRegistrationTests(TestCase):
+    def test_models_are_not_registered_with_shards(self):
+        site = AdminSite()
+        with self.settings(DATABASE_SHARDS=['shard_0']):
+            register_admin(site)
+        self.assertFalse(site.is_registered(Animal))
+        with self.settings(DATABASE_SHARDS=[]):
+            register_admin(site)
+        self.assertTrue(all(site.is_registered(model) for model in (Animal, Event, Vaccine)))
+
+
+class ShardPlacementTests(OneShardMixin, TestCase):
+    def test_rendezvous_placement_moves_only_to_a_new_shard(self):
+        two = {user_id: pick_shard(user_id, ['shard_0', 'shard_1']) for user_id in range(1, 3001)}
+        three = {user_id: pick_shard(user_id, ['shard_0', 'shard_1', 'shard_2']) for user_id in range(1, 3001)}
+        moved = [user_id for user_id in two if two[user_id] != three[user_id]]
+
+        self.assertEqual({three[user_id] for user_id in moved}, {'shard_2'})
+        self.assertAlmostEqual(len(moved) / len(two), 1 / 3, delta=0.05)
+
+    @override_settings(DATABASE_SHARDS=[])
+    def test_unsharded_setup_uses_default_without_directory(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(shard_for_user(1), 'default')
+
+
+@skipUnless(len(settings.DATABASE_SHARDS) >= 2, "run with DJANGO_SHARDS=2")
+class ShardedStorageTests(APITestCase):
+    """Needs shard databases: DJANGO_SHARDS=2 python manage.py test core.tests.ShardedStorageTests"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.first, self.second = settings.DATABASE_SHARDS[:2]
+        self.alice = User.objects.create_user(username='alice', password='x')
+        self.bob = User.objects.create_user(username='bob', password='x')
+        UserShard.objects.create(user=self.alice, alias=self.first)
+        UserShard.objects.create(user=self.bob, alias=self.second)
+
+    def as_user(self, user):
+        self.client.force_authenticate(user=user)
+        return self.client
+
+    def upload(self, user):
+        pet_id = str(uuid.uuid4())
+        response = self.as_user(user).post(reverse('upload'), {'pets': [{
+            'id': pet_id, 'name': "Rex", 'type': "Cachorro", 'breed': "SRD", 'date_of_birth': "2020-01-01",
+            'updated_at': timezone.now(),
+            'events': [{'id': str(uuid.uuid4()), 'type': "Consulta", 'date': "2023-01-01",
+                        'updated_at': timezone.now()}],
+        }]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return pet_id
+
+    def test_requests_use_the_users_shard(self):
+        pet_id = self.upload(self.alice)
+        self.as_user(self.bob).post(reverse('animal-list'), {
+            'name': "Mimi", 'type': "Gato", 'breed': "SRD", 'date_of_birth': "2021-01-01",
+        }, format='json')
+
+        self.assertEqual(list(Animal.objects.using(self.first).values_list('id', flat=True)), [uuid.UUID(pet_id)])
+        self.assertEqual(Event.objects.using(self.first).count(), 1)
+        self.assertEqual(list(Animal.objects.using(self.second).values_list('name', flat=True)), ["Mimi"])
+        self.assertFalse(Animal.objects.using('default').exists())
+
+        download = self.as_user(self.alice).post(reverse('download'), {}, format='json').data
+        self.assertEqual([pet['id'] for pet in download['pets']], [pet_id])
+        self.assertEqual(len(download['pets'][0]['events']), 1)
+        tree = self.as_user(self.alice).post(reverse('reconcile'), {}, format='json').data
+        self.assertEqual(tree['count'], 2)
+
+    def test_rebalance_moves_a_user_online(self):
+        pet_id = self.upload(self.alice)
+        self.as_user(self.alice).post(reverse('reconcile'), {}, format='json')
+
+        UserShard.objects.filter(user=self.alice).update(moving=True)
+        self.assertEqual(self.as_user(self.alice).get(reverse('animal-list')).status_code, status.HTTP_200_OK)
+        response = self.as_user(self.alice).delete(reverse('animal-detail', args=[pet_id]))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        UserShard.objects.filter(user=self.alice).update(moving=False)
+
+        out = StringIO()
+        call_command('rebalance_shards', '--user', 'alice', '--to', self.second, stdout=out)
+        self.assertIn("Moved 1 users", out.getvalue())
+
+        self.assertEqual(UserShard.objects.get(user=self.alice).alias, self.second)
+        self.assertFalse(Animal.objects.using(self.first).exists())
+        self.assertFalse(SyncBucket.objects.using(self.first).exists())
+        self.assertEqual(Event.objects.using(self.second).count(), 1)
+        self.assertEqual(SyncBucket.objects.using(self.second).filter(user=self.alice).count(), 256)
+        tree = self.as_user(self.alice).post(reverse('reconcile'), {}, format='json').data
+        self.assertEqual(tree['count'], 2)
+
+    def fenced_upload(self, fenced):
+        """Upload for alice; returns the SQL on the directory and whether the merge ran in a 'default' transaction."""
+        default = connections['default']
+        outer = len(default.atomic_blocks)
+        seen = {}
+        apply = SyncUploadView.apply
+
+        def spy(view, *args):
+            seen['depth'] = len(default.atomic_blocks)
+            return apply(view, *args)
+
+        with CaptureQueriesContext(default) as queries, mock.patch.object(SyncUploadView, 'apply', spy), \
+                mock.patch('core.sharding.fences_writes', return_value=fenced):
+            self.upload(self.alice)
+        statements = [query['sql'] for query in queries.captured_queries if 'core_usershard' in query['sql']]
+        return statements, seen['depth'] > outer
+
+    def test_writes_hold_the_directory_entry_until_they_finish(self):
+        # the entry is locked before it is read, and the merge runs under that lock
+        statements, locked = self.fenced_upload(fenced=True)
+        self.assertTrue(statements[0].startswith('UPDATE'))
+        self.assertTrue(locked)
+
+        UserShard.objects.filter(user=self.alice).update(moving=True)
+        response = self.as_user(self.alice).post(reverse('upload'), {'pets': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_writes_without_row_locks_only_check_the_flag(self):
+        # on SQLite the fence would lock the whole database for every user
+        statements, locked = self.fenced_upload(fenced=False)
+        self.assertFalse(any(statement.startswith('UPDATE') for statement in statements))
+        self.assertFalse(locked)
+        if connections['default'].vendor == 'sqlite':
+            self.assertFalse(fences_writes())
+
+    def test_deleting_a_user_clears_their_shard(self):
+        self.upload(self.alice)
+        self.alice.delete()
+        self.assertFalse(Animal.objects.using(self.first).exists())
+        self.assertFalse(Event.objects.using(self.first).exists())
@@ -0,0 +1,66 @@
+import time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+class SyncCostThrottle(BaseThrottle):
+    """Per-user budget charged by the estimated cost of each request.
+
+    The rate for `scope` in `DEFAULT_THROTTLE_RATES` (e.g. ``'2000/hour'``) is
+    read as cost units per period instead of a request count. Views report
+    their cost through ``get_throttle_cost(request)``. Free requests (cost 0,
+    such as check-update polling) never touch the counter. A request that
+    would overrun the budget is rejected without being charged.
+
+    Counters are fixed-window integers updated with the cache's atomic
+    ``incr``, so they work unchanged on a shared Redis/Memcached cache.
+    """
+    scope = 'sync'
+    cache_alias = 'default'
+
+    def __init__(self):
+        self.wait_time = None
+
+    def parse_rate(self, rate):
+        if rate is None:
+            return None, None
+        budget, period = rate.split('/')
+        duration = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+        return int(budget), duration
+
+    def allow_request(self, request, view):
+        budget, duration = self.parse_rate(api_settings.DEFAULT_THROTTLE_RATES.get(self.scope))
+        if budget is None or not request.user.is_authenticated:
+            return True
+
+        get_cost = getattr(view, 'get_throttle_cost', None)
+        cost = get_cost(request) if get_cost else 1
+        if cost <= 0:
+            return True
+
+        cache = caches[self.cache_alias]
+        now = time.time()
+        window = int(now // duration)
+        key = f'throttle_{self.scope}_{request.user.pk}_{window}'
+        cache.add(key, 0, duration)
+        try:
+            used = cache.incr(key, cost)
+        except ValueError:
+            # the key expired between add() and incr()
+            cache.set(key, cost, duration)
+            used = cost
+
+        if used > budget:
+            cache.decr(key, cost)
+            self.wait_time = (window + 1) * duration - now
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_time
+
+
+def sync_cost(name):
+    return settings.SYNC_THROTTLE_COSTS[name]
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AnimalViewSet, EventViewSet, VaccineViewSet, SyncUploadView,SyncDownloadView, SyncCheckUpdatesView
+from .views import AnimalViewSet, EventViewSet, VaccineViewSet, SyncUploadView, SyncPatchView, SyncDownloadView, SyncCheckUpdatesView, SyncReconcileView, ExportView, BatchView, PerformanceMetricsView
 
 router = DefaultRouter()
 router.register(r'animals',AnimalViewSet)
@@ -10,6 +10,11 @@ router.register(r'vaccines',VaccineViewSet)
 urlpatterns = [
      path('',include(router.urls)),
      path('sync/upload',SyncUploadView.as_view(),name='upload'),
+     path('sync/patch',SyncPatchView.as_view(),name='patch'),
      path('sync/download',SyncDownloadView.as_view(),name='download'),
-     path('sync/check-update',SyncCheckUpdatesView.as_view(),name='check_update')
+     path('sync/check-update',SyncCheckUpdatesView.as_view(),name='check_update'),
+     path('sync/reconcile',SyncReconcileView.as_view(),name='reconcile'),
+     path('export',ExportView.as_view(),name='export'),
+     path('batch',BatchView.as_view(),name='batch'),
+     path('metrics',PerformanceMetricsView.as_view(),name='metrics')
 ]
\ No newline at end of file
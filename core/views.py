@@ -1,45 +1,251 @@
+import io
+import json
+from datetime import timedelta
+from urllib.parse import urlsplit
 from rest_framework import viewsets, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser, IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import Http404, StreamingHttpResponse
+from django.db import transaction
+from django.urls import resolve, Resolver404
+from django.conf import settings
 from django.utils.timezone import now
-from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiTypes
 from django.db.models import Q
-from .models import Animal, Event, Vaccine
-from .serializers import AnimalSerializer, EventSerializer, VaccineSerializer, SyncUploadRequestSerializer, SyncDownloadRequestSerializer, SyncDownloadResponseSerializer
+from .archive import ARCHIVES, order_rows, ordered, restore, restore_missing
+from .docs import extend_schema, OpenApiExample, OpenApiTypes
+from .export import export_chunks
+from .filters import AnimalFilter, EventFilter, StableOrderingFilter, VaccineFilter
+from .groupcommit import run_merge
+from .instrumentation import registry as metrics_registry
+from .merkle import batched, bucket_leaves, record_write, tree
+from .models import Animal, Event, Vaccine, Tombstone
+from .serializers import AnimalSerializer, EventSerializer, VaccineSerializer, SyncUploadRequestSerializer, SyncUploadResponseSerializer, SyncPatchRequestSerializer, SyncPatchResponseSerializer, AnimalPatchSerializer, EventPatchSerializer, VaccinePatchSerializer, SyncDownloadRequestSerializer, SyncDownloadResponseSerializer, SyncReconcileRequestSerializer, SyncBucketLeavesSerializer, BatchRequestSerializer, VaccineDueQuerySerializer, EventSearchQuerySerializer, ExportQuerySerializer, ArchiveQuerySerializer, AnimalStatsSerializer
+from .search import search_events
+from .sharding import ShardedViewMixin, active_alias, atomic
+from .stats import animal_stats, count_write
+from .snapshots import SnapshotInvalidationMixin, snapshot_response
+from .throttling import SyncCostThrottle, sync_cost
+
+
+def include_archived(request):
+    params = ArchiveQuerySerializer(data=request.query_params)
+    params.is_valid(raise_exception=True)
+    return params.validated_data['include_archived']
+
+
+def delta_since(validated_data):
+    """`last_synced_at`, or None when the client needs (or asked for) a full download.
+
+    Tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS are purged, so a cursor
+    older than that can't be brought up to date with a delta.
+    """
+    last_synced_at = validated_data.get('last_synced_at')
+    retention = timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+    if last_synced_at and last_synced_at < now() - retention:
+        return None
+    return last_synced_at
+
+
+class ArchivedHistoryMixin:
+    """Archived rows (core/archive.py) on request: lists add them with `include_archived`,
+    detail routes fall back to them, and writes move them back to the hot table first."""
+
+    @extend_schema(parameters=[ArchiveQuerySerializer])
+    def list(self, request, *args, **kwargs):
+        if not include_archived(request):
+            return super().list(request, *args, **kwargs)
+        hot = self.filter_queryset(self.get_queryset())
+        archived = ARCHIVES[self.queryset.model].objects.filter(animal__user=request.user)
+        archived = self.filterset_class(request.query_params, queryset=archived, request=request).qs
+        ordering = StableOrderingFilter().get_ordering(request, archived, self)
+        hot, archived = ordered(hot, ordering), ordered(archived, ordering)
+        if self.paginator.requested(request):
+            # the page is among the first offset + limit + 1 rows of either table
+            window = self.paginator.get_offset(request) + self.paginator.get_limit(request) + 1
+            hot, archived = hot[:window], archived[:window]
+        rows = order_rows([*hot, *archived], ordering)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(self.get_serializer(rows, many=True).data)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            model = self.queryset.model
+            obj = get_object_or_404(ARCHIVES[model].objects.filter(animal__user=self.request.user),
+                                    pk=self.kwargs['pk'])
+            if self.request.method in SAFE_METHODS:
+                self.check_object_permissions(self.request, obj)
+                return obj
+            # written rows must be where delta downloads look for them
+            restore(model, [obj.pk])
+            return super().get_object()
 
 
 @extend_schema(tags=['Animais'])
-class AnimalViewSet(viewsets.ModelViewSet):
+class AnimalViewSet(ShardedViewMixin, SnapshotInvalidationMixin, viewsets.ModelViewSet):
     queryset = Animal.objects.all()
     serializer_class = AnimalSerializer
+    filterset_class = AnimalFilter
+    ordering_fields = ['updated_at']
+    ordering = ['id']
 
     def get_queryset(self):
-        return Animal.objects.filter(user=self.request.user)
+        queryset = Animal.objects.filter(user=self.request.user)
+        if self.action == 'list':
+            queryset = queryset.prefetch_related('events', 'vaccines')
+            if include_archived(self.request):
+                queryset = queryset.prefetch_related('archived_events', 'archived_vaccines')
+        return queryset
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'include_archived': include_archived(self.request)}
+
+    @extend_schema(parameters=[ArchiveQuerySerializer])
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
     def perform_update(self, serializer):
-        serializer.save(updated_at=now())
+        serializer.save(updated_at=now(), field_updated_at={})
+
+    @atomic()
+    @batched()
+    def perform_destroy(self, instance):
+        deleted_at = now()
+        Tombstone.record(self.request.user, 'event', [
+            *instance.events.values_list('id', flat=True), *instance.archived_events.values_list('id', flat=True)
+        ], deleted_at)
+        Tombstone.record(self.request.user, 'vaccine', [
+            *instance.vaccines.values_list('id', flat=True), *instance.archived_vaccines.values_list('id', flat=True)
+        ], deleted_at)
+        Tombstone.record(self.request.user, 'animal', [instance.id], deleted_at)
+        instance.delete()
+
+    @extend_schema(
+        responses=AnimalStatsSerializer(many=True),
+        description="Estatísticas de todos os pets do usuário: eventos por tipo, última consulta e vacinas "
+                    "vencidas. Mantidas a cada escrita, sem recalcular o histórico.",
+    )
+    @action(detail=False, methods=['get'], url_path='stats', url_name='stats-list')
+    def all_stats(self, request):
+        animal_ids = Animal.objects.filter(user=request.user).order_by('id').values_list('id', flat=True)
+        page = self.paginate_queryset(animal_ids)
+        if page is None:
+            return Response(AnimalStatsSerializer(animal_stats(animal_ids), many=True).data)
+        return self.get_paginated_response(AnimalStatsSerializer(animal_stats(page), many=True).data)
+
+    @extend_schema(responses=AnimalStatsSerializer)
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        animal = self.get_object()
+        return Response(AnimalStatsSerializer(animal_stats([animal.pk])[0]).data)
 
 
 @extend_schema(tags=['Eventos'])
-class EventViewSet(viewsets.ModelViewSet):
+class EventViewSet(ShardedViewMixin, SnapshotInvalidationMixin, ArchivedHistoryMixin, viewsets.ModelViewSet):
     queryset = Event.objects.all()
     serializer_class = EventSerializer
+    filterset_class = EventFilter
+    ordering_fields = ['date', 'updated_at']
+    ordering = ['id']
 
     def get_queryset(self):
         return Event.objects.filter(animal__user=self.request.user)
 
+    def perform_update(self, serializer):
+        serializer.save(updated_at=now(), field_updated_at={})
+
+    @atomic()
+    def perform_destroy(self, instance):
+        Tombstone.record(self.request.user, 'event', [instance.id])
+        instance.delete()
+
+    @extend_schema(
+        parameters=[EventSearchQuerySerializer],
+        responses={200: OpenApiTypes.OBJECT},
+        description="Busca textual nas observações dos eventos do usuário, usando o índice full-text do banco. "
+                    "Resultados ordenados por relevância; use `next_offset` para a próxima página.",
+    )
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        params = EventSearchQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        limit = params.validated_data['limit']
+        offset = params.validated_data['offset']
+
+        # fetch one extra row to know whether another page exists without counting
+        events = search_events(request.user, params.validated_data['q'], limit + 1, offset)
+        next_offset = offset + limit if len(events) > limit else None
+        serializer = self.get_serializer(events[:limit], many=True)
+        return Response({
+            "results": serializer.data,
+            "next_offset": next_offset
+        })
+
 @extend_schema(tags=['Vacinas'])
-class VaccineViewSet(viewsets.ModelViewSet):
+class VaccineViewSet(ShardedViewMixin, SnapshotInvalidationMixin, ArchivedHistoryMixin, viewsets.ModelViewSet):
     queryset  = Vaccine.objects.all()
     serializer_class = VaccineSerializer
+    filterset_class = VaccineFilter
+    ordering_fields = ['application_date', 'next_dose_date', 'updated_at']
+    ordering = ['id']
 
     def get_queryset(self):
         return Vaccine.objects.filter(animal__user=self.request.user)
 
+    def perform_update(self, serializer):
+        serializer.save(updated_at=now(), field_updated_at={})
+
+    @atomic()
+    def perform_destroy(self, instance):
+        Tombstone.record(self.request.user, 'vaccine', [instance.id])
+        instance.delete()
+
+    @extend_schema(
+        parameters=[VaccineDueQuerySerializer],
+        description="Lista as vacinas de todos os pets do usuário com próxima dose entre hoje e os próximos `days` dias.",
+    )
+    @action(detail=False, methods=['get'])
+    def due(self, request):
+        params = VaccineDueQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        days = params.validated_data.get('days', settings.VACCINE_DUE_DEFAULT_DAYS)
+
+        today = now().date()
+        vaccines = self.get_queryset().filter(
+            next_dose_date__range=(today, today + timedelta(days=days))
+        ).order_by('next_dose_date', 'id')
+        page = self.paginate_queryset(vaccines)
+        if page is None:
+            return Response(self.get_serializer(vaccines, many=True).data)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+
+def upload_item_count(data):
+    """Pets plus nested events and vaccines in an upload body, at least 1."""
+    pets = data.get('pets') if hasattr(data, 'get') else None
+    if not isinstance(pets, list):
+        return 1
+    items = 0
+    for pet in pets:
+        items += 1
+        if isinstance(pet, dict):
+            for nested in ('events', 'vaccines'):
+                if isinstance(pet.get(nested), list):
+                    items += len(pet[nested])
+    return max(items, 1)
+
 
 @extend_schema(
     request=SyncUploadRequestSerializer,  
+    responses=SyncUploadResponseSerializer,
     examples=[
         OpenApiExample(
             'Exemplo completo de sincronização',
@@ -108,17 +314,26 @@ class VaccineViewSet(viewsets.ModelViewSet):
         )
     ],
     tags=["Sincronização"],
-    description="Sincroniza os dados do aplicativo com o servidor, atualizando apenas se `updated_at` for mais recente."
+    description="Sincroniza os dados do aplicativo com o servidor, atualizando apenas se `updated_at` for mais recente. "
+                "Registros mais recentes mas com o mesmo conteúdo só têm o `updated_at` atualizado e contam em `skipped`."
 )
-class SyncUploadView(APIView):
+class SyncUploadView(ShardedViewMixin, SnapshotInvalidationMixin, APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [SyncCostThrottle]
 
+    def get_throttle_cost(self, request):
+        return upload_item_count(request.data) * sync_cost('UPLOAD_ITEM')
 
     def post(self,request):
-        user = request.user
         serializer = SyncUploadRequestSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         pets = serializer.validated_data['pets']
+        counts = run_merge(upload_item_count(request.data), lambda: self.apply(request.user, pets))
+        return Response(SyncUploadResponseSerializer(counts).data, status=status.HTTP_200_OK)
+
+    @batched()
+    def apply(self, user, pets):
+        counts = {'created': 0, 'updated': 0, 'skipped': 0, 'outdated': 0}
         for pet_data in pets:
             pet_id = pet_data.get('id', None)
             events = pet_data.pop('events', [])
@@ -127,54 +342,208 @@ class SyncUploadView(APIView):
 
             try:
                 pet_obj = Animal.objects.get(id=pet_id,user=user)
-                if updated_at_incoming > pet_obj.updated_at:
-                    for attr, value in pet_data.items():
-                        setattr(pet_obj, attr, value)
-                    pet_obj.updated_at = updated_at_incoming
-                    pet_obj.save()    
+                counts[self.overwrite(pet_obj, pet_data, updated_at_incoming)] += 1
             except Animal.DoesNotExist:
                 pet_data['user'] = user
                 pet_data['updated_at'] = updated_at_incoming
                 pet_obj = Animal.objects.create(**pet_data)
+                counts['created'] += 1
             
             for event in events:
                 event_id = event.get('id',None)            
                 event_updated_at = event.get('updated_at')
                 try:
                     event_obj = Event.objects.get(id=event_id,animal=pet_obj)
-                    if event_updated_at > event_obj.updated_at:
-                        for attr, value in event.items():
-                            setattr(event_obj,attr,value)
-                        event_obj.updated_at = event_updated_at
-                        event_obj.save()
+                    counts[self.overwrite(event_obj, event, event_updated_at)] += 1
                 except Event.DoesNotExist:
+                    event_obj = restore_missing(Event, event_id, animal__user=user)
+                    if event_obj is not None:
+                        counts[self.overwrite(event_obj, event, event_updated_at)] += 1
+                        continue
                     event['animal'] = pet_obj
                     event['updated_at'] = event_updated_at
                     Event.objects.create(**event)
+                    counts['created'] += 1
             
             for vaccine in vaccines:
                 vaccine_id = vaccine.get('id')
                 vaccine_updated_at = vaccine.get('updated_at')
                 try:
                     vaccine_obj = Vaccine.objects.get(id=vaccine_id,animal=pet_obj)
-                    if vaccine_updated_at > vaccine_obj.updated_at:
-                        for attr, value in vaccine.items():
-                            setattr(vaccine_obj,attr,value)
-                        vaccine_obj.updated_at = vaccine_updated_at
-                        vaccine_obj.save()
+                    counts[self.overwrite(vaccine_obj, vaccine, vaccine_updated_at)] += 1
                 except Vaccine.DoesNotExist:
+                    vaccine_obj = restore_missing(Vaccine, vaccine_id, animal__user=user)
+                    if vaccine_obj is not None:
+                        counts[self.overwrite(vaccine_obj, vaccine, vaccine_updated_at)] += 1
+                        continue
                     vaccine['animal'] = pet_obj
                     vaccine['updated_at'] = vaccine_updated_at
                     Vaccine.objects.create(**vaccine)
+                    counts['created'] += 1
+        return counts
+
+    def overwrite(self, obj, data, updated_at):
+        """Whole-record write when `data` is newer and its content differs from the stored row."""
+        if updated_at <= obj.updated_at:
+            return 'outdated'
+        if obj.compute_content_hash(**data) == obj.content_hash:
+            # only the timestamp moved: store just that, so a later upload stamped in
+            # between still comes back outdated, without touching the search index
+            type(obj).objects.filter(pk=obj.pk).update(updated_at=updated_at)
+            obj.updated_at = updated_at
+            record_write(obj, created=False)
+            return 'skipped'
+        for attr, value in data.items():
+            setattr(obj, attr, value)
+        obj.updated_at = updated_at
+        obj.field_updated_at = {}
+        obj.save()
+        return 'updated'
+
+
+@extend_schema(
+    request=SyncPatchRequestSerializer,
+    responses=SyncPatchResponseSerializer,
+    examples=[
+        OpenApiExample(
+            'Nome do pet e observação de um evento alterados',
+            value={
+                "pets": [
+                    {
+                        "id": "550e8400-e29b-41d4-a716-446655440000",
+                        "changes": {
+                            "name": {"value": "Rex II", "updated_at": "2023-10-26T08:00:00Z"}
+                        },
+                        "events": [
+                            {
+                                "id": "550e8400-e29b-41d4-a716-446655440001",
+                                "changes": {
+                                    "observation": {"value": "Retorno em 30 dias", "updated_at": "2023-10-26T08:05:00Z"}
+                                }
+                            }
+                        ]
+                    }
+                ]
+            },
+            request_only=True,
+        ),
+    ],
+    tags=["Sincronização"],
+    description="Envia apenas os campos alterados de cada registro, cada um com o seu `updated_at`. "
+                "O servidor aplica cada campo separadamente, mantendo o valor mais recente, então edições de "
+                "campos diferentes em dois aparelhos não se sobrescrevem. Registros novos precisam trazer "
+                "todos os campos obrigatórios."
+)
+class SyncPatchView(ShardedViewMixin, SnapshotInvalidationMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [SyncCostThrottle]
 
-        return Response(status=status.HTTP_200_OK)
+    def get_throttle_cost(self, request):
+        return upload_item_count(request.data) * sync_cost('UPLOAD_ITEM')
+
+    def post(self, request):
+        serializer = SyncPatchRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        pets = serializer.validated_data['pets']
+        counts = run_merge(upload_item_count(request.data), lambda: self.apply(request.user, pets))
+        return Response(SyncPatchResponseSerializer(counts).data, status=status.HTTP_200_OK)
+
+    @batched()
+    def apply(self, user, pets):
+        self.counts = {'created': 0, 'updated': 0, 'ignored': 0}
+        self.new_rows = {Animal: [], Event: [], Vaccine: []}
+        animals = Animal.objects.filter(user=user).in_bulk([pet['id'] for pet in pets])
+        event_ids = [event['id'] for pet in pets for event in pet.get('events', [])]
+        events = Event.objects.filter(animal__user=user).in_bulk(event_ids)
+        vaccine_ids = [vaccine['id'] for pet in pets for vaccine in pet.get('vaccines', [])]
+        vaccines = Vaccine.objects.filter(animal__user=user).in_bulk(vaccine_ids)
+        # ids missing from the hot tables are either new or archived; archived ones come back first
+        for model, ids, existing in ((Event, event_ids, events), (Vaccine, vaccine_ids, vaccines)):
+            missing = [object_id for object_id in ids if object_id not in existing]
+            existing.update((row.id, row) for row in restore(model, missing, animal__user=user))
+        self.check_ownership(pets, animals, events, vaccines)
+
+        for pet in pets:
+            pet_obj = self.merge(Animal, AnimalPatchSerializer, animals, pet, user=user)
+            for event in pet.get('events', []):
+                self.merge(Event, EventPatchSerializer, events, event, animal=pet_obj)
+            for vaccine in pet.get('vaccines', []):
+                self.merge(Vaccine, VaccinePatchSerializer, vaccines, vaccine, animal=pet_obj)
+
+        for model, rows in self.new_rows.items():
+            model.objects.bulk_create(rows)
+            for row in rows:
+                record_write(row, created=True)
+                if model is not Animal:
+                    count_write(row, created=True)
+        return self.counts
+
+    def check_ownership(self, pets, animals, events, vaccines):
+        """Refuse ids stored for another user, or events and vaccines sent under a pet they don't belong to."""
+        errors = {}
+        for model, existing, ids in (
+            (Animal, animals, [pet['id'] for pet in pets]),
+            (Event, events, [event['id'] for pet in pets for event in pet.get('events', [])]),
+            (Vaccine, vaccines, [vaccine['id'] for pet in pets for vaccine in pet.get('vaccines', [])]),
+        ):
+            # not the caller's: either new, or someone else's
+            unknown = [object_id for object_id in ids if object_id not in existing]
+            if not unknown:
+                continue
+            taken = set(model.objects.filter(id__in=unknown).values_list('id', flat=True))
+            if model in ARCHIVES:
+                taken.update(ARCHIVES[model].objects.filter(id__in=unknown).values_list('id', flat=True))
+            for object_id in taken:
+                errors[str(object_id)] = ["Registro pertence a outro usuário."]
+        for pet in pets:
+            for key, existing in (('events', events), ('vaccines', vaccines)):
+                for record in pet.get(key, []):
+                    obj = existing.get(record['id'])
+                    if obj is not None and obj.animal_id != pet['id']:
+                        errors[str(record['id'])] = ["Registro pertence a outro pet."]
+        if errors:
+            raise ValidationError(errors)
+
+    def merge(self, model, serializer_class, existing, record, **parent):
+        changes = record['changes']
+        obj = existing.get(record['id'])
+        if obj is None:
+            missing = serializer_class.required_fields() - set(changes)
+            if missing:
+                raise ValidationError({str(record['id']): [
+                    f"Registro novo sem os campos obrigatórios: {', '.join(sorted(missing))}."
+                ]})
+            obj = model(
+                id=record['id'],
+                updated_at=max(updated_at for _, updated_at in changes.values()),
+                field_updated_at={field: updated_at.isoformat() for field, (_, updated_at) in changes.items()},
+                **{field: value for field, (value, _) in changes.items()},
+                **parent,
+            )
+            obj.content_hash = obj.compute_content_hash()
+            existing[obj.id] = obj
+            self.new_rows[model].append(obj)
+            self.counts['created'] += 1
+            return obj
+
+        applied = obj.merge_fields(changes)
+        if applied:
+            obj.save(update_fields=[*applied, 'updated_at', 'field_updated_at'])
+            self.counts['updated'] += 1
+        else:
+            self.counts['ignored'] += 1
+        return obj
 
 
 @extend_schema(
     request=SyncDownloadRequestSerializer,
     responses=SyncDownloadResponseSerializer,
     tags=["Sincronização"],
-    description="Retorna os animais com eventos e vacinas alterados após a data de sincronização enviada.",
+    description="Retorna os animais com eventos e vacinas alterados após a data de sincronização enviada, "
+                "e em `deleted` os registros excluídos desde então. Se `last_synced_at` for mais antigo que a "
+                "janela de retenção das exclusões, todos os dados são enviados e `full_sync` vem como `true`. "
+                "Downloads completos de quem aceita gzip podem vir de um snapshot pré-gerado (`Content-Encoding: gzip`); "
+                "o `synced_at` dele é o do snapshot e o próximo download incremental traz o que mudou depois.",
     examples=[
         OpenApiExample(
             name="Requisição com 'last_synced_at'",
@@ -192,17 +561,35 @@ class SyncUploadView(APIView):
         )
     ]
 )
-class SyncDownloadView(APIView):
+class SyncDownloadView(ShardedViewMixin, APIView):
     permission_classes = [IsAuthenticated]
+    shard_read_only = True
+    throttle_classes = [SyncCostThrottle]
 
+    def get_throttle_cost(self, request):
+        serializer = SyncDownloadRequestSerializer(data=request.data)
+        # an invalid body gets a 400 without reading anything
+        if not serializer.is_valid() or delta_since(serializer.validated_data):
+            return sync_cost('DELTA_DOWNLOAD')
+        return sync_cost('FULL_DOWNLOAD')
 
     def post(self, request):
         serializer = SyncDownloadRequestSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        last_synced_at = serializer.validated_data.get('last_synced_at')
-        pets_qs = Animal.objects.filter(user=request.user)
+        last_synced_at = delta_since(serializer.validated_data)
+        archived = serializer.validated_data['include_archived']
+        if last_synced_at is None and not archived:
+            snapshot = snapshot_response(request)
+            if snapshot is not None:
+                return snapshot
+        now_sync = now()
+
+        pets_qs = Animal.objects.filter(user=request.user).prefetch_related('events', 'vaccines')
+        if archived:
+            pets_qs = pets_qs.prefetch_related('archived_events', 'archived_vaccines')
+        deleted_qs = Tombstone.objects.none()
         
         if last_synced_at:
             pets_qs = pets_qs.filter(
@@ -210,13 +597,14 @@ class SyncDownloadView(APIView):
                 Q(events__updated_at__gt=last_synced_at) |
                 Q(vaccines__updated_at__gt=last_synced_at)
             ).distinct()
-
-        now_sync = now()
+            deleted_qs = Tombstone.objects.filter(user=request.user, deleted_at__gt=last_synced_at)
 
         response_serializer = SyncDownloadResponseSerializer({
             'pets': pets_qs,
+            'deleted': deleted_qs,
+            'full_sync': last_synced_at is None,
             'synced_at': now_sync
-        })
+        }, context={'include_archived': archived})
         return Response(response_serializer.data)
     
 
@@ -231,10 +619,12 @@ class SyncDownloadView(APIView):
             name="Exemplo de resposta com atualizações",
             value={
                 "has_updates": True,
+                "full_sync": False,
                 "update_counts": {
                     "animals": 3,
                     "events": 5,
-                    "vaccines": 2
+                    "vaccines": 2,
+                    "deleted": 1
                 }
             },
             response_only=True
@@ -243,10 +633,12 @@ class SyncDownloadView(APIView):
             name="Exemplo sem atualizações",
             value={
                 "has_updates": False,
+                "full_sync": False,
                 "update_counts": {
                     "animals": 0,
                     "events": 0,
-                    "vaccines": 0
+                    "vaccines": 0,
+                    "deleted": 0
                 }
             },
             response_only=True
@@ -260,10 +652,13 @@ class SyncDownloadView(APIView):
         )
     ],
     tags=["Sincronização"],
-    description="Verifica se existem animais, eventos ou vacinas que foram atualizados após a última sincronização."
+    description="Verifica se existem animais, eventos ou vacinas que foram atualizados ou excluídos após a última sincronização. "
+                "Se `last_synced_at` for mais antigo que a janela de retenção das exclusões, `full_sync` vem como `true`, "
+                "`has_updates` também, e as contagens são as de um download completo."
 )
-class SyncCheckUpdatesView(APIView):
+class SyncCheckUpdatesView(ShardedViewMixin, APIView):
     permission_classes = [IsAuthenticated]
+    shard_read_only = True
 
 
     def post(self, request):
@@ -271,29 +666,233 @@ class SyncCheckUpdatesView(APIView):
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        last_synced_at = serializer.validated_data.get('last_synced_at')
+        last_synced_at = delta_since(serializer.validated_data)
+        # a cursor past the retention window needs a full download, whatever changed since
+        expired = last_synced_at is None and 'last_synced_at' in serializer.validated_data
         user = request.user
 
         animals_qs = Animal.objects.filter(user=user)
         events_qs = Event.objects.filter(animal__user=user)
         vaccines_qs = Vaccine.objects.filter(animal__user=user)
+        deleted_qs = Tombstone.objects.none()
 
         if last_synced_at:
             animals_qs = animals_qs.filter(updated_at__gt=last_synced_at)
             events_qs = events_qs.filter(updated_at__gt=last_synced_at)
             vaccines_qs = vaccines_qs.filter(updated_at__gt=last_synced_at)
+            deleted_qs = Tombstone.objects.filter(user=user, deleted_at__gt=last_synced_at)
 
         animal_count = animals_qs.count()
         event_count = events_qs.count()
         vaccine_count = vaccines_qs.count()
+        deleted_count = deleted_qs.count()
 
-        has_updates = any([animal_count, event_count, vaccine_count])
+        has_updates = expired or any([animal_count, event_count, vaccine_count, deleted_count])
 
         return Response({
             "has_updates": has_updates,
+            "full_sync": last_synced_at is None,
             "update_counts": {
                 "animals": animal_count,
                 "events": event_count,
-                "vaccines": vaccine_count
+                "vaccines": vaccine_count,
+                "deleted": deleted_count
             }
-        })
\ No newline at end of file
+        })
+
+
+@extend_schema(
+    request=SyncReconcileRequestSerializer,
+    responses={200: OpenApiTypes.OBJECT},
+    examples=[
+        OpenApiExample(
+            name="Raiz da árvore",
+            value={},
+            request_only=True,
+        ),
+        OpenApiExample(
+            name="Nó da raiz",
+            value={
+                "prefix": "",
+                "hash": "1b7e0c59a3f24d10",
+                "count": 42,
+                "children": [{"key": "0", "hash": "0a94c1e2b7d35f08", "count": 3}],
+            },
+            response_only=True,
+        ),
+        OpenApiExample(
+            name="Listar buckets divergentes",
+            value={"buckets": ["a3", "f1"]},
+            request_only=True,
+        ),
+    ],
+    tags=["Sincronização"],
+    description="Verificação barata do estado completo. Cada registro (animal, evento ou vacina) é uma folha com "
+                "hash SHA-256 de `<modelo>:<id>:<updated_at>` (primeiros 8 bytes deslocados 1 bit à direita); "
+                "o bucket é formado pelos dois últimos dígitos hexadecimais do id e guarda o XOR das folhas. "
+                "Sem `buckets`, retorna o hash do nó `prefix` (vazio = raiz, um dígito = grupo) e dos filhos. "
+                "Com `buckets`, lista id e `updated_at` dos registros desses buckets para baixar apenas o que diverge."
+)
+class SyncReconcileView(ShardedViewMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    shard_read_only = True
+    throttle_classes = [SyncCostThrottle]
+
+    def get_throttle_cost(self, request):
+        return sync_cost('RECONCILE')
+
+    def post(self, request):
+        serializer = SyncReconcileRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        buckets = serializer.validated_data.get('buckets')
+        if buckets:
+            leaves = bucket_leaves(request.user.id, buckets)
+            return Response({'buckets': SyncBucketLeavesSerializer({'buckets': leaves}).data['buckets']})
+        return Response(tree(request.user.id, serializer.validated_data['prefix']))
+
+
+@extend_schema(
+    parameters=[ExportQuerySerializer],
+    responses={(200, 'application/zip'): OpenApiTypes.BINARY},
+    tags=["Exportação"],
+    description="Baixa todo o histórico do usuário (animais, eventos e vacinas) como um ZIP com um arquivo "
+                "por tabela, em CSV ou NDJSON. O arquivo é gerado enquanto é enviado, sem tamanho conhecido "
+                "de antemão (sem `Content-Length`)."
+)
+class ExportView(ShardedViewMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [SyncCostThrottle]
+
+    def get_throttle_cost(self, request):
+        return sync_cost('EXPORT')
+
+    def get(self, request):
+        params = ExportQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data_format = params.validated_data['data_format']
+
+        response = StreamingHttpResponse(
+            export_chunks(request.user, data_format, using=active_alias()), content_type='application/zip'
+        )
+        response['Content-Disposition'] = f'attachment; filename="historico-{now():%Y%m%d}-{data_format}.zip"'
+        return response
+
+
+@extend_schema(
+    request=BatchRequestSerializer,
+    responses={
+        200: OpenApiTypes.OBJECT,
+        400: OpenApiTypes.OBJECT
+    },
+    examples=[
+        OpenApiExample(
+            name="Inicialização do aplicativo",
+            value={
+                "atomic": True,
+                "requests": [
+                    {"method": "GET", "path": "/api/animals/"},
+                    {"method": "GET", "path": "/api/vaccines/?limit=50"},
+                    {"method": "POST", "path": "/api/sync/check-update", "body": {"last_synced_at": "2025-07-03T12:00:00Z"}}
+                ]
+            },
+            request_only=True
+        ),
+        OpenApiExample(
+            name="Resposta do lote",
+            value={
+                "atomic": True,
+                "rolled_back": False,
+                "responses": [
+                    {"status": 200, "body": []},
+                    {"status": 200, "body": {"next": None, "previous": None, "results": []}},
+                    {"status": 200, "body": {"has_updates": False, "full_sync": False,
+                                             "update_counts": {"animals": 0, "events": 0, "vaccines": 0, "deleted": 0}}}
+                ]
+            },
+            response_only=True
+        )
+    ],
+    tags=["Lote"],
+    description="Executa várias requisições da API em uma única chamada, autenticando apenas uma vez. "
+                "Com `atomic` todas compartilham a mesma transação e, se alguma falhar, nada é gravado."
+)
+class BatchView(ShardedViewMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+
+    def post(self, request):
+        serializer = BatchRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        sub_requests = serializer.validated_data['requests']
+        all_or_nothing = serializer.validated_data['atomic']
+
+        rolled_back = False
+        if all_or_nothing:
+            with atomic():
+                responses = [self.dispatch_sub_request(request, sub) for sub in sub_requests]
+                if any(item['status'] >= 400 for item in responses):
+                    transaction.set_rollback(True, using=active_alias())
+                    rolled_back = True
+        else:
+            responses = [self.dispatch_sub_request(request, sub) for sub in sub_requests]
+
+        return Response({
+            "atomic": all_or_nothing,
+            "rolled_back": rolled_back,
+            "responses": responses
+        })
+
+    def dispatch_sub_request(self, request, sub):
+        url = urlsplit(sub['path'])
+        try:
+            match = resolve(url.path)
+        except Resolver404:
+            match = None
+        if match is None or not url.path.startswith('/api/') or getattr(match.func, 'cls', None) in (BatchView, ExportView):
+            return {"status": status.HTTP_404_NOT_FOUND, "body": {"detail": "Rota não encontrada."}}
+
+        body = b'' if 'body' not in sub else json.dumps(sub['body']).encode()
+        environ = {
+            key: value for key, value in request.META.items()
+            if key.startswith(('SERVER_', 'REMOTE_', 'wsgi.'))
+        }
+        environ.update({
+            'REQUEST_METHOD': sub['method'],
+            'PATH_INFO': url.path,
+            'SCRIPT_NAME': '',
+            'QUERY_STRING': url.query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(body)),
+            'HTTP_ACCEPT': 'application/json',
+            'wsgi.input': io.BytesIO(body),
+        })
+        sub_request = WSGIRequest(environ)
+        # reuse the user authenticated by the batch call instead of re-checking the token
+        sub_request._force_auth_user = request.user
+        sub_request.user = request.user
+
+        response = match.func(sub_request, *match.args, **match.kwargs)
+        if hasattr(response, 'data'):
+            data = response.data
+        else:
+            data = json.loads(response.content) if response.content else None
+        return {"status": response.status_code, "body": data}
+
+
+
+@extend_schema(
+    responses={200: OpenApiTypes.OBJECT},
+    tags=["Monitoramento"],
+    description="Métricas de desempenho agregadas por rota neste processo (somente administradores). "
+                "Contém tempo total, tempo de banco, consultas, consultas duplicadas, tempo de serialização, "
+                "tamanho das respostas e histograma de latência das requisições amostradas."
+)
+class PerformanceMetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+
+    def get(self, request):
+        return Response({
+            "sample_rate": settings.PERF_METRICS_SAMPLE_RATE,
+            "routes": metrics_registry.snapshot()
+        })